@@ -40,30 +40,19 @@ if __name__ == "__main__":
     import requests
 
     # load only the first HTML table for LS IPGs (Employment standards) as an example
+    # (the page is fetched and parsed once, the hyperlinks of the cells come resolved with the rows)
     url = "https://www.canada.ca/en/employment-social-development/programs/laws-regulations/labour/interpretations-policies.html"
     IPGs_tables = HTMLTablestoDataframes(url=url)
-    LS_IPGs = IPGs_tables.df_list[1].values
+    LS_IPGs_table = IPGs_tables.tables[1]
+    title_idx = LS_IPGs_table.column("Title", default=0)
+    number_idx = LS_IPGs_table.column("Number", "No.", default=1)
 
-    # organize and check
-    preprocessed_IPGs = [GenericIPG(id=i[1], title=i[0]) for i in LS_IPGs]
-    print([(i.id, i.title) for i in preprocessed_IPGs])
-
-    # fetch html objects at given hyperlink
-    IPGs_main_page = requests.get("https://www.canada.ca/en/employment-social-development/programs/laws-regulations/labour/interpretations-policies.html#hs")
-
-    # extract the table and hrefs
-    ls_ipgs_table = BeautifulSoup(IPGs_main_page.text, features="lxml")
-    ls_ipgs_table_hrefs = ls_ipgs_table.find_all(href=True)
-
-    result = re.search('<a href=(.*)</a>', str(ls_ipgs_table_hrefs)) # extracts all the hyperlink HTML objects (hrefs)
-    result = [" ".join(i.lower().split()) for i in result.group(0).split("</a>")]      # lowercase + whitespace removal to avoid matching issues
-
-    # add the hyperlinks that were embedded in each LS IPG to the class instance
-    for i in result:
-        for j in preprocessed_IPGs:
-            href = re.search(f'<a href="(.*)">{" ".join(j.title.lower().split())}', i) # lowercase + whitespace removal to avoid matching issues
-            if href is not None:
-                j.hyperlink = "https://www.canada.ca" + href.group(1)
+    # organize and check, with each IPG's hyperlink taken from its title cell
+    LS_IPGs = LS_IPGs_table.index_by(number_idx)
+    preprocessed_IPGs = [
+        GenericIPG(id=ipg_id, title=row[title_idx].text, hyperlink=row[title_idx].href or "<placeholder>")
+        for ipg_id, row in LS_IPGs.items()
+    ]
 
     # check if everything is looking good
     for i in preprocessed_IPGs:
@@ -82,4 +71,4 @@ if __name__ == "__main__":
     df = pd.DataFrame(preprocessed_IPGs)
     print(df)
     print(df.text)
-    df.to_csv("../data/IPGs_Occupational_Health_and_Safety.csv", index=False)
\ No newline at end of file
+    df.to_csv("../data/IPGs_Occupational_Health_and_Safety.csv", index=False)
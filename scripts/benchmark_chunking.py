@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks the chunking stage and the length-sorted embedding batches on a mixed corpus.
+It:
+  - Generates a corpus mixing short passages (IPG-like), sections (CLC-like) and long crawled pages
+  - Reports the tokens lost to truncation at the model's max sequence length, with and without chunking
+  - Reports the padding tokens wasted by embedding batches in corpus order and in length-sorted order
+  - Embeds the chunks in both orders and reports docs/sec, with a stub model whose cost grows with
+    the padded batch size (or a real SentenceTransformer model with --model)
+"""
+
+import argparse
+import random
+import time
+import warnings
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+
+from utils.chunker import RegexTokenizer, TokenChunker, chunk_corpus, length_sorted_order, load_tokenizer
+
+WORDS = "employer employee shall hours work leave section pursuant regulation wage notice day week".split()
+
+
+class PaddedStubEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Stub model spending `cost_per_token` seconds per token of the padded batch, like a transformer."""
+
+    def __init__(self, tokenizer, cost_per_token: float = 2e-6, dim: int = 384) -> None:
+        self.tokenizer = tokenizer
+        self.cost_per_token = cost_per_token
+        self.dim = dim
+
+    def __call__(self, input: Documents) -> Embeddings:
+        max_len = max(len(self.tokenizer.token_spans(text)) for text in input)
+        time.sleep(self.cost_per_token * max_len * len(input))
+        return [np.zeros(self.dim, dtype=np.float32) for _ in input]
+
+
+def make_corpus(nb_docs: int, seed: int = 0) -> tuple[list[str], list[str], list[dict]]:
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(nb_docs):
+        nb_words = rng.choice([rng.randint(20, 80), rng.randint(100, 400), rng.randint(800, 4000)])
+        documents.append(" ".join(rng.choice(WORDS) for _ in range(nb_words)) + ".")
+    ids = [f"DOC-{i}" for i in range(nb_docs)]
+    return ids, documents, [{"source": "synthetic"} for _ in ids]
+
+
+def padding_waste(token_counts: list[int], batch_size: int) -> int:
+    waste = 0
+    for start in range(0, len(token_counts), batch_size):
+        batch = token_counts[start : start + batch_size]
+        waste += max(batch) * len(batch) - sum(batch)
+    return waste
+
+
+def embed_all(embedding_func, documents: list[str], batch_size: int) -> float:
+    start = time.perf_counter()
+    for start_idx in range(0, len(documents), batch_size):
+        embedding_func(documents[start_idx : start_idx + batch_size])
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--max-seq-length", type=int, default=384)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--model", help="SentenceTransformer model to use instead of the stub, e.g. multi-qa-mpnet-base-dot-v1")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    tokenizer = load_tokenizer(args.model) if args.model else RegexTokenizer()
+    ids, documents, metadatas = make_corpus(args.docs)
+    chunker = TokenChunker(tokenizer, max_tokens=args.max_seq_length)
+    _, chunk_texts, chunk_metadatas = chunk_corpus(ids, documents, metadatas, chunker)
+
+    doc_tokens = [len(tokenizer.token_spans(text)) for text in documents]
+    chunk_tokens = [metadata["token_count"] for metadata in chunk_metadatas]
+    truncated = sum(max(0, n - args.max_seq_length) for n in doc_tokens)
+    print(f"{len(documents)} documents ({sum(doc_tokens)} tokens) -> {len(chunk_texts)} chunks ({sum(chunk_tokens)} tokens)")
+    print(f"Tokens truncated at {args.max_seq_length}: {truncated} without chunking, 0 with chunking")
+
+    order = length_sorted_order(chunk_texts)
+    sorted_texts = [chunk_texts[idx] for idx in order]
+    print(f"Padding tokens in batches of {args.batch_size}: "
+          f"{padding_waste(chunk_tokens, args.batch_size)} in corpus order, "
+          f"{padding_waste([chunk_tokens[idx] for idx in order], args.batch_size)} length-sorted")
+
+    if args.model:
+        embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=args.model)
+    else:
+        embedding_func = PaddedStubEmbeddingFunction(tokenizer)
+
+    print(f"{'order':>14} {'chunks':>7} {'seconds':>9} {'docs/sec':>9}")
+    for name, texts in [("corpus", chunk_texts), ("length-sorted", sorted_texts)]:
+        elapsed = embed_all(embedding_func, texts, args.batch_size)
+        print(f"{name:>14} {len(texts):>7} {elapsed:>9.2f} {len(texts) / elapsed:>9.1f}")
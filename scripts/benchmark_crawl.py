@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks the crawl engine of extract_canada_page.py against a local stand-in HTTP server.
+It:
+  - Serves a synthetic canada.ca-like site (root page, table of contents, linked pages) on localhost
+  - Adds an artificial latency to every response to mimic the round-trip to the real site
+  - Crawls the site with different worker counts and reports the pages/sec for each
+"""
+
+import argparse
+import contextlib
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import extract_canada_page
+from utils.http_cache import create_session
+
+PAGE_TEMPLATE = """<html><body>
+<ol class="breadcrumb"><li><a href="/en.html">Canada.ca</a></li><li><a href="/en/root.html">Root</a></li></ol>
+<main><h1>{title}</h1>{toc}<p>{text}</p>{links}</main>
+</body></html>"""
+
+
+def render_page(path: str, fan_out: int) -> str:
+    name = path.rsplit("/", 1)[-1].removesuffix(".html")
+    links, toc = "", ""
+
+    if name == "root":
+        toc_items = "".join(f'<li><a href="/en/root-step-{i}.html">Step {i}</a></li>' for i in range(3))
+        toc = f'<ul class="toc">{toc_items}</ul>'
+    else:
+        links = "".join(f'<a href="/en/{name}-{i}.html">Sub-page {i}</a>' for i in range(fan_out))
+
+    text = f"Synthetic content for {name}. " * 50
+    return PAGE_TEMPLATE.format(title=name, toc=toc, text=text, links=links)
+
+
+def start_server(latency: float, fan_out: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            body = render_page(self.path, fan_out).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(workers: int, base_url: str, start_path: str = "/en/root.html") -> tuple[int, float]:
+    extract_canada_page.BASE_URL = base_url
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pages_per_root = extract_canada_page.crawl_pages(
+            [f"{base_url}{start_path}"], max_workers=workers, session=create_session(workers)
+        )
+    elapsed = time.perf_counter() - start
+
+    return sum(len(pages) for pages in pages_per_root), elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds of latency added to every response")
+    parser.add_argument("--fan-out", type=int, default=20, help="Number of links on every page")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 10, 20])
+    args = parser.parse_args()
+
+    server = start_server(args.latency, args.fan_out)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{'workers':>8} {'pages':>8} {'seconds':>9} {'pages/sec':>10}")
+    for workers in args.workers:
+        nb_pages, elapsed = run(workers, base_url)
+        print(f"{workers:>8} {nb_pages:>8} {elapsed:>9.2f} {nb_pages / elapsed:>10.1f}")
+
+    server.shutdown()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks the near-duplicate elimination of the scraped pages.
+It:
+  - Generates pages sharing a large boilerplate (header, menus, footer), a part of which are
+    near-copies of another page (a few words edited), as when the crawl roots overlap
+  - Reports the duplicates found against the planted ones (precision and recall over pairs)
+  - Reports the documents and tokens that no longer need to be embedded, and the time taken
+"""
+
+import argparse
+import itertools
+import random
+import time
+
+from utils.dedup import MinHashDeduplicator, deduplicate
+
+WORDS = [f"w{i}" for i in range(5000)]
+
+
+def make_pages(nb_pages: int, duplicate_rate: float, seed: int = 0) -> tuple[list[str], list[str], list[int]]:
+    """Ids, texts and, for every page, the position of the page it was copied from (itself otherwise)."""
+    rng = random.Random(seed)
+    header = " ".join(rng.choice(WORDS) for _ in range(150))
+    footer = " ".join(rng.choice(WORDS) for _ in range(150))
+    texts, origins = [], []
+    for idx in range(nb_pages):
+        if texts and rng.random() < duplicate_rate:
+            origin = rng.randrange(len(texts))
+            words = texts[origin].split()
+            for _ in range(rng.randint(1, 5)):
+                words[rng.randrange(len(words))] = rng.choice(WORDS)
+            texts.append(" ".join(words))
+            origins.append(origins[origin])
+        else:
+            body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(100, 800)))
+            texts.append(f"{header} {body} {footer}")
+            origins.append(idx)
+    return [f"PAGE-{idx}" for idx in range(nb_pages)], texts, origins
+
+
+def pairs(groups) -> set:
+    return {pair for group in groups for pair in itertools.combinations(sorted(group), 2)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.3)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--num-perm", type=int, default=128)
+    args = parser.parse_args()
+
+    ids, texts, origins = make_pages(args.pages, args.duplicate_rate)
+    planted = {}
+    for idx, origin in enumerate(origins):
+        planted.setdefault(origin, []).append(idx)
+    expected = pairs(planted.values())
+
+    deduplicator = MinHashDeduplicator(args.threshold, num_perm=args.num_perm)
+    start = time.perf_counter()
+    clusters = deduplicator.clusters(texts)
+    elapsed = time.perf_counter() - start
+    found = pairs(clusters)
+
+    true_positives = len(found & expected)
+    precision = true_positives / len(found) if found else 1.0
+    recall = true_positives / len(expected) if expected else 1.0
+    kept_ids, kept_texts, _, nb_removed = deduplicate(ids, texts, [{} for _ in ids], deduplicator)
+    tokens_before = sum(len(text.split()) for text in texts)
+    tokens_after = sum(len(text.split()) for text in kept_texts)
+
+    print(f"{args.pages} pages, {args.pages - len(planted)} planted duplicates, bands x rows = {deduplicator.bands} x {deduplicator.rows}")
+    print(f"found {nb_removed} duplicates in {elapsed:.2f}s ({args.pages / elapsed:.0f} pages/sec)")
+    print(f"pair precision {precision:.3f}, pair recall {recall:.3f}")
+    print(f"documents to embed: {len(texts)} -> {len(kept_texts)}, tokens: {tokens_before} -> {tokens_after} "
+          f"({1 - tokens_after / tokens_before:.1%} saved)")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks how the multi-process embedding pool scales with the number of workers.
+It:
+  - Embeds the same synthetic corpus with 1, 2, 4 and 8 worker processes
+  - Uses a CPU-bound stub model by default, or a real SentenceTransformer model with --model
+  - Reports docs/sec and the speedup over a single worker
+"""
+
+import argparse
+import time
+import warnings
+from functools import partial
+
+from chromadb.utils import embedding_functions
+
+from benchmark_ingest import StubEmbeddingFunction, make_corpus
+from utils.embedding_pool import ProcessPoolEmbeddingFunction
+
+
+def run(model_factory, nb_workers: int, documents: list[str], batch_size: int) -> float:
+    with ProcessPoolEmbeddingFunction(num_workers=nb_workers, model_factory=model_factory) as embedding_func:
+        embedding_func(documents[: nb_workers * 8])  # Start the workers and load the models before timing
+
+        start = time.perf_counter()
+        for start_idx in range(0, len(documents), batch_size):
+            embedding_func(documents[start_idx : start_idx + batch_size])
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--model", help="SentenceTransformer model to use instead of the stub, e.g. multi-qa-mpnet-base-dot-v1")
+    parser.add_argument("--cost-per-doc", type=float, default=0.002, help="CPU seconds the stub model spends per document")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    if args.model:
+        model_factory = partial(embedding_functions.SentenceTransformerEmbeddingFunction, model_name=args.model)
+    else:
+        model_factory = partial(StubEmbeddingFunction, cost_per_doc=args.cost_per_doc, busy=True)
+
+    _, documents, _ = make_corpus(args.docs)
+
+    print(f"{'workers':>8} {'docs':>8} {'seconds':>9} {'docs/sec':>10} {'speedup':>8}")
+    baseline = None
+    for nb_workers in args.workers:
+        elapsed = run(model_factory, nb_workers, documents, batch_size=32 * nb_workers)
+        baseline = baseline or elapsed
+        print(f"{nb_workers:>8} {args.docs:>8} {elapsed:>9.2f} {args.docs / elapsed:>10.1f} {baseline / elapsed:>8.2f}")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+This script compares the exact in-memory search (utils.exact_search) with the HNSW index of chromadb.
+It:
+  - Builds a temporary collection with build_chroma_collection and a stub model (no download needed)
+  - Draws queries close to documents of the corpus (as real questions are close to the passages answering them)
+  - Reports recall@k of HNSW against the exact results, with and without a metadata filter
+  - Reports the latency (p50/p99 per call) and queries/sec of both backends for several query batch sizes
+"""
+
+import argparse
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+from benchmark_ingest import StubEmbeddingFunction, make_corpus
+from utils.chromadb_utils import build_chroma_collection
+from utils.exact_search import ExactSearchIndex
+
+
+def recall_at_k(expected: list[list[str]], found: list[list[str]]) -> float:
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    total = sum(len(e) for e in expected)
+    return hits / total if total else 1.0
+
+
+def time_backend(search, queries: np.ndarray, batch_size: int, k: int, where: dict = None) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for idx in range(0, len(queries), batch_size):
+        call_start = time.perf_counter()
+        search(query_embeddings=queries[idx : idx + batch_size], n_results=k, where=where, include=["distances"])
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    return {"p50": np.percentile(latencies, 50) * 1000, "p99": np.percentile(latencies, 99) * 1000, "qps": len(queries) / elapsed}
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=768, help="768 for multi-qa-mpnet-base-dot-v1")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--space", default="cosine", choices=["cosine", "ip", "l2"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32])
+    args = parser.parse_args()
+
+    ids, documents, metadatas = make_corpus(args.docs)
+    embedding_func = StubEmbeddingFunction(dim=args.dim)
+    with tempfile.TemporaryDirectory() as chroma_path:
+        collection = build_chroma_collection(chroma_path, "exact_search", "stub", ids, documents, metadatas,
+                                             distance_func_name=args.space, embedding_function=embedding_func)
+        start = time.perf_counter()
+        index = ExactSearchIndex.from_collection(collection)
+        print(f"{args.docs} x {args.dim} embeddings loaded in {time.perf_counter() - start:.2f}s "
+              f"({index.embeddings.nbytes / 2**20:.1f} MiB)")
+
+        rng = np.random.default_rng(0)
+        targets = rng.choice(len(index.ids), size=args.queries)
+        base = np.asarray(embedding_func([documents[idx] for idx in targets]), dtype=np.float32)
+        queries = base + rng.standard_normal(base.shape, dtype=np.float32) * np.linalg.norm(base, axis=1, keepdims=True) / np.sqrt(args.dim)
+
+        print(f"\nrecall@{args.k} of HNSW against exact search")
+        for where in (None, {"position": {"$lt": args.docs // 10}}):
+            expected = index.query(queries, n_results=args.k, where=where)["ids"]
+            found = collection.query(query_embeddings=queries, n_results=args.k, where=where, include=[])["ids"]
+            print(f"  where={where}: {recall_at_k(expected, found):.4f}")
+
+        print(f"\n{'backend':>8} {'batch':>6} {'p50 ms':>9} {'p99 ms':>9} {'queries/sec':>12}")
+        for batch_size in args.batch_sizes:
+            for name, search in (("hnsw", collection.query), ("exact", index.query)):
+                result = time_backend(search, queries, batch_size, args.k)
+                print(f"{name:>8} {batch_size:>6} {result['p50']:>9.2f} {result['p99']:>9.2f} {result['qps']:>12.0f}")
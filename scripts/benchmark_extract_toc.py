@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks the extraction of the Canada Labour Code sections done by extract_toc.py.
+It:
+  - Loads a saved copy of a FullText.html page (--html), or generates a synthetic one
+  - Extracts every section with the previous per-leaf DOM search and with the single-pass section index
+  - Checks that both give the same text and reports sections/sec for both
+"""
+
+import argparse
+import time
+
+from extract_toc import HEADER_TAGS, build_section_index
+from utils.html_parser import parse_html
+
+
+def extract_section_per_leaf(soup, fragment: str) -> str:
+    """The per-leaf lookup extract_page_text used before the section index."""
+    section_header = soup.find(HEADER_TAGS, id=fragment)
+    if not section_header:
+        return ""
+
+    parent_header = section_header.find_parent('header')
+    if parent_header:
+        section_header = parent_header
+
+    extracted_text = section_header.get_text(separator="\n", strip=True)
+    for sibling in section_header.find_next_siblings():
+        if sibling.name in HEADER_TAGS and parent_header is None:
+            break
+        extracted_text += "\n" + sibling.get_text(separator="\n", strip=True)
+
+    return extracted_text.replace("\n", " ").replace("\r", " ").strip()
+
+
+def make_full_text(nb_parts: int, sections_per_part: int) -> str:
+    body = []
+    for part in range(nb_parts):
+        body.append(f'<h2 id="h-part-{part}">Part {part}</h2><p>Purpose of part {part}.</p>')
+        for section in range(sections_per_part):
+            body.append(
+                f'<h3 id="h-{part}-{section}">Section {part}.{section}</h3>'
+                f'<p>{section} (1) An employer shall keep records of the hours worked.</p>'
+                f'<ul><li>(a) the first case;</li><li>(b) the second case.</li></ul>'
+            )
+    body.append(
+        '<section><header><h2 id="h-schedule-1">SCHEDULE I</h2><p>(Section 2)</p></header>'
+        '<p>Schedule content.</p><h3 id="h-schedule-1-item">Item</h3><p>More schedule content.</p></section>'
+    )
+    return f"<html><body><div class='docContents'>{''.join(body)}</div></body></html>"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--html", help="Saved copy of a FullText.html page")
+    parser.add_argument("--parts", type=int, default=20)
+    parser.add_argument("--sections", type=int, default=100, help="Sections per part of the synthetic page")
+    args = parser.parse_args()
+
+    if args.html:
+        with open(args.html, "rb") as f:
+            soup = parse_html(f.read())
+    else:
+        soup = parse_html(make_full_text(args.parts, args.sections))
+
+    fragments = [header["id"] for header in soup.find_all(HEADER_TAGS, id=True)]
+
+    start = time.perf_counter()
+    per_leaf = {fragment: extract_section_per_leaf(soup, fragment) for fragment in fragments}
+    per_leaf_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    section_index = build_section_index(soup)
+    indexed = {fragment: section_index.get(fragment, "") for fragment in fragments}
+    index_elapsed = time.perf_counter() - start
+
+    mismatches = [fragment for fragment in fragments if per_leaf[fragment] != indexed[fragment]]
+    assert not mismatches, f"{len(mismatches)} sections differ, e.g. {mismatches[:5]}"
+
+    print(f"{'method':>14} {'sections':>9} {'seconds':>9} {'sections/sec':>13}")
+    for method, elapsed in [("per-leaf", per_leaf_elapsed), ("section index", index_elapsed)]:
+        print(f"{method:>14} {len(fragments):>9} {elapsed:>9.2f} {len(fragments) / elapsed:>13.1f}")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks the BM25 index and the hybrid (BM25 + vector) search of utils.bm25.
+It:
+  - Builds a temporary collection of synthetic act sections (ids holding the section numbers) with a stub model
+  - Reports the time to build the BM25 index and to sync it after 1% of the sections changed
+  - Reports p50/p99 latency of BM25, vector and hybrid search for single queries
+  - Reports how often the section asked for ("section 206.1") is in the top k, with vector search alone and
+    fused with BM25 (the stub model knows nothing of section numbers, like a real one mostly)
+"""
+
+import argparse
+import random
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+from benchmark_ingest import StubEmbeddingFunction
+from utils.bm25 import BM25Index, HybridSearch
+from utils.chromadb_utils import build_chroma_collection
+
+WORDS = ("employer employee shall hours work leave wage notice averaging overtime holiday termination "
+         "severance danger refusal inspector complaint pay schedule rest period minister regulation").split()
+
+
+def make_sections(nb_sections: int, seed: int = 0) -> tuple[list[str], list[str], list[dict]]:
+    rng = random.Random(seed)
+    ids, documents = [], []
+    for idx in range(nb_sections):
+        number = f"{idx // 3 + 1}" if idx % 3 == 0 else f"{idx // 3 + 1}-{idx % 3}"
+        ids.append(f"CLC-{number}")
+        documents.append(f"{number.replace('-', '.')} (1) " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(30, 300))))
+    return ids, documents, [{"source": "synthetic", "parent_id": id_} for id_ in ids]
+
+
+def latencies_ms(search, queries: list[str]) -> tuple[float, float]:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        latencies.append(time.perf_counter() - start)
+    return np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    ids, documents, metadatas = make_sections(args.sections)
+    keywords = [metadata["parent_id"] for metadata in metadatas]
+
+    start = time.perf_counter()
+    bm25 = BM25Index()
+    bm25.sync(ids, documents, keywords)
+    print(f"BM25 index of {len(bm25)} sections built in {time.perf_counter() - start:.2f}s, {len(bm25.postings)} terms")
+
+    rng = random.Random(1)
+    changed = list(documents)
+    for idx in rng.sample(range(len(ids)), len(ids) // 100):
+        changed[idx] += " amended"
+    start = time.perf_counter()
+    nb_indexed, _ = bm25.sync(ids, changed, keywords)
+    print(f"sync after {nb_indexed} sections changed: {time.perf_counter() - start:.3f}s")
+
+    targets = [rng.randrange(len(ids)) for _ in range(args.queries)]
+    section_queries = [f"What does section {ids[idx][4:].replace('-', '.')} say?" for idx in targets]
+    topic_queries = [" ".join(rng.sample(WORDS, 3)) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as chroma_path:
+        collection = build_chroma_collection(chroma_path, "hybrid", "stub", ids, documents, metadatas,
+                                             embedding_function=StubEmbeddingFunction(dim=768))
+        hybrid = HybridSearch(collection, bm25)
+
+        print(f"\n{'search':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, search in (
+            ("bm25", lambda query: bm25.search(query, args.k)),
+            ("vector", lambda query: collection.query(query_texts=[query], n_results=args.k)),
+            ("hybrid", lambda query: hybrid.query([query], n_results=args.k)),
+        ):
+            p50, p99 = latencies_ms(search, section_queries + topic_queries)
+            print(f"{name:>8} {p50:>8.2f} {p99:>8.2f}")
+
+        vector_hits = collection.query(query_texts=section_queries, n_results=args.k, include=[])["ids"]
+        hybrid_hits = hybrid.query(section_queries, n_results=args.k)["ids"]
+        for name, hits in (("vector", vector_hits), ("hybrid", hybrid_hits)):
+            rate = np.mean([ids[idx] in found for idx, found in zip(targets, hits)])
+            print(f"section asked for in the top {args.k} ({name}): {rate:.1%}")
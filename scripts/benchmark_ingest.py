@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks the ingestion of documents into a ChromaDB collection.
+It:
+  - Generates a synthetic corpus and embeds it with a deterministic stub model (no download needed)
+  - Ingests it the way build_chroma_collection used to (embedding inside collection.add, batches of 166)
+  - Ingests it with build_chroma_collection (embedding and insertion pipelined)
+  - Checks that every document made it into the collection and reports docs/sec for both
+"""
+
+import argparse
+import hashlib
+import tempfile
+import time
+import warnings
+
+import chromadb
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from more_itertools import batched
+
+from utils.chromadb_utils import build_chroma_collection
+
+
+class StubEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Deterministic embeddings derived from a hash of the text.
+    `cost_per_call` + `cost_per_doc` seconds per document are spent on every call to stand in
+    for the model: sleeping (like a model releasing the GIL) or, when `busy` is set, spinning on the CPU."""
+
+    def __init__(self, dim: int = 384, cost_per_doc: float = 0.0, busy: bool = False, cost_per_call: float = 0.0) -> None:
+        self.dim = dim
+        self.cost_per_doc = cost_per_doc
+        self.busy = busy
+        self.cost_per_call = cost_per_call
+
+    def __call__(self, input: Documents) -> Embeddings:
+        cost = self.cost_per_call + self.cost_per_doc * len(input)
+        if self.busy:
+            deadline = time.process_time() + cost
+            while time.process_time() < deadline:
+                pass
+        else:
+            time.sleep(cost)
+        embeddings = []
+        for text in input:
+            seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+            embeddings.append(np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32))
+        return embeddings
+
+
+def make_corpus(nb_docs: int) -> tuple[list[str], list[str], list[dict]]:
+    ids = [f"DOC-{i}" for i in range(nb_docs)]
+    documents = [f"Document {i} about section {i % 97} of the Canada Labour Code. " * 20 for i in range(nb_docs)]
+    metadatas = [{"source": "synthetic", "position": i} for i in range(nb_docs)]
+    return ids, documents, metadatas
+
+
+def check_collection(collection, ids: list[str]) -> None:
+    stored_ids = set(collection.get(include=[])["ids"])
+    missing = set(ids) - stored_ids
+    assert not missing, f"{len(missing)} documents missing from {collection.name}, e.g. {sorted(missing)[:5]}"
+
+
+def run_sequential(chroma_path: str, embedding_func, ids, documents, metadatas) -> float:
+    client = chromadb.PersistentClient(chroma_path)
+    collection = client.create_collection(name="sequential", embedding_function=embedding_func)
+
+    start = time.perf_counter()
+    for batch in batched(range(len(documents)), 166):
+        start_idx, end_idx = batch[0], batch[-1] + 1
+        collection.add(
+            ids=ids[start_idx:end_idx],
+            documents=documents[start_idx:end_idx],
+            metadatas=metadatas[start_idx:end_idx],
+        )
+    elapsed = time.perf_counter() - start
+
+    check_collection(collection, ids)
+    return elapsed
+
+
+def run_pipelined(chroma_path: str, embedding_func, ids, documents, metadatas) -> float:
+    start = time.perf_counter()
+    collection = build_chroma_collection(
+        chroma_path,
+        "pipelined",
+        "stub-model",
+        ids,
+        documents,
+        metadatas,
+        embedding_function=embedding_func,
+    )
+    elapsed = time.perf_counter() - start
+
+    check_collection(collection, ids)
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--cost-per-doc", type=float, default=0.0005, help="Seconds the stub model spends per document")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    ids, documents, metadatas = make_corpus(args.docs)
+    embedding_func = StubEmbeddingFunction(cost_per_doc=args.cost_per_doc)
+
+    print(f"{'mode':>10} {'docs':>8} {'seconds':>9} {'docs/sec':>10}")
+    for mode, run in [("sequential", run_sequential), ("pipelined", run_pipelined)]:
+        with tempfile.TemporaryDirectory() as chroma_path:
+            elapsed = run(chroma_path, embedding_func, ids, documents, metadatas)
+        print(f"{mode:>10} {args.docs:>8} {elapsed:>9.2f} {args.docs / elapsed:>10.1f}")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks the HTML parsing backends used by the scrapers.
+It:
+  - Loads recorded pages (--pages, by default the bodies stored in the HTTP cache) or a synthetic canada.ca-like page
+  - Parses them with every backend, fully and partially (only the elements extract_canada_page needs)
+  - Checks that the partial parse extracts the same title, hierarchy and text, and reports ms/page for each
+"""
+
+import argparse
+import glob
+import time
+
+from extract_canada_page import extract_hierarchy, extract_title
+from utils.html_parser import PAGE_ELEMENTS, parse_html
+from utils.http_cache import DEFAULT_CACHE_DIR
+from utils.page_utils import extract_main_content
+
+BACKENDS = ["html.parser", "lxml"]
+
+
+def make_page() -> bytes:
+    menu = "".join(f'<li><a href="/en/menu-{i}.html">Menu entry {i}</a></li>' for i in range(300))
+    footer = "".join(f'<li><a href="/en/footer-{i}.html">Footer link {i}</a></li>' for i in range(100))
+    links = "".join(f'<p>Paragraph {i}. <a href="/en/page-{i}.html">Related page {i}</a></p>' for i in range(100))
+    return (
+        "<html><head><script>var analytics = {};</script><style>body {margin: 0}</style></head><body>"
+        f'<header><nav><ul class="menu">{menu}</ul></nav></header>'
+        '<ol class="breadcrumb"><li><a href="/en.html">Canada.ca</a></li><li><a href="/en/labour.html">Labour</a></li></ol>'
+        f"<main><h1>Labour standards</h1>{links}<p>Date modified: 2025-02-13</p></main>"
+        f"<footer><ul>{footer}</ul></footer></body></html>"
+    ).encode("utf-8")
+
+
+def extract(soup):
+    return extract_title(soup), extract_hierarchy(soup), extract_main_content(soup)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default=str(DEFAULT_CACHE_DIR / "*.body"), help="Glob of recorded HTML pages")
+    parser.add_argument("--repeat", type=int, default=20, help="Times each page is parsed")
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(args.pages)):
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    if not pages:
+        print(f"No recorded pages found at {args.pages}, using a synthetic page")
+        pages = [make_page()]
+
+    print(f"{'backend':>12} {'mode':>8} {'pages':>6} {'ms/page':>9}")
+    for backend in BACKENDS:
+        for mode, only in [("full", None), ("partial", PAGE_ELEMENTS)]:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                for page in pages:
+                    parse_html(page, only=only, backend=backend)
+            elapsed = time.perf_counter() - start
+            print(f"{backend:>12} {mode:>8} {len(pages):>6} {1000 * elapsed / (args.repeat * len(pages)):>9.2f}")
+
+        for page in pages:
+            assert extract(parse_html(page, backend=backend)) == extract(parse_html(page, only=PAGE_ELEMENTS, backend=backend))
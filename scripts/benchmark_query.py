@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+This script load-tests the query service.
+It:
+  - Builds a temporary collection over a synthetic corpus with a stub model (no download needed)
+  - Runs concurrent clients sending queries (drawn from a pool, so some repeat) for a fixed duration
+  - Runs once without micro-batching (batches of 1, no cache) and once with the default settings
+  - Reports p50/p99 latency, QPS and the cache hit rate for both
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+from benchmark_ingest import StubEmbeddingFunction, make_corpus
+from utils.chromadb_utils import build_chroma_collection
+from utils.query_service import QueryService
+
+QUERIES = [
+    "What are the rules applying to maternity leave?",
+    "What does the notion of averaging of hours mean for federally regulated employers?",
+    "What is constructive dismissal?",
+    "What is the definition of danger?",
+    "How to prevent harmful behaviour at work?",
+]
+
+
+async def client(service: QueryService, queries: list[str], deadline: float, latencies: list[float]) -> None:
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await service.query(rng.choice(queries), n_results=3)
+        latencies.append(time.perf_counter() - start)
+
+
+async def load_test(service: QueryService, queries: list[str], nb_clients: int, duration: float) -> list[float]:
+    latencies = []
+    async with service:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(client(service, queries, deadline, latencies) for _ in range(nb_clients)))
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of load per run")
+    parser.add_argument("--distinct-queries", type=int, default=200, help="Size of the pool of queries sent")
+    parser.add_argument("--cost-per-call", type=float, default=0.01, help="Seconds the stub model spends per encode call")
+    parser.add_argument("--cost-per-doc", type=float, default=0.001, help="Seconds the stub model spends per query")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    queries = [f"{QUERIES[i % len(QUERIES)]} ({i})" for i in range(args.distinct_queries)]
+    embedding_func = StubEmbeddingFunction(cost_per_doc=args.cost_per_doc, cost_per_call=args.cost_per_call)
+
+    with tempfile.TemporaryDirectory() as chroma_path:
+        collection = build_chroma_collection(chroma_path, "load_test", "stub-model", *make_corpus(args.docs),
+                                             embedding_function=StubEmbeddingFunction())
+
+        print(f"{'mode':>14} {'queries':>8} {'p50 ms':>8} {'p99 ms':>8} {'QPS':>8} {'hit rate':>9}")
+        for mode, settings in [("one by one", {"max_batch_size": 1, "cache_size": 0}), ("micro-batched", {})]:
+            service = QueryService(collection, embedding_func, **settings)
+            latencies = asyncio.run(load_test(service, queries, args.clients, args.duration))
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print(f"{mode:>14} {len(latencies):>8} {p50:>8.1f} {p99:>8.1f} {len(latencies) / args.duration:>8.1f} "
+                  f"{service.stats()['hit_rate']:>9.2f}")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+This script runs the offline benchmark suite and stores its results, so that commits can be compared.
+It:
+  - Serves recorded HTML fixtures (--fixtures, see --record) or synthetic pages from a local stand-in HTTP server
+  - Measures the crawl done by extract_canada_page.py (pages/sec), from a recorded starting page of
+    extract_canada_page.py (or --crawl-start) when there is one, from a synthetic site otherwise
+  - Measures the extraction of a FullText page done by extract_toc.py (sections/sec), from the recorded
+    FullText.html fixture (--full-text, the first one found by default) or a synthetic one
+  - Records in the results whether every benchmark ran on fixtures or on synthetic pages
+  - Measures build_chroma_collection (docs/sec) and the query service (p50/p99 latency, QPS) on a synthetic
+    corpus of configurable size, with a deterministic stub embedding model
+  - Writes the results to <results dir>/<commit>.json and compares them with a previous run (--compare)
+
+No network access is needed, except to record fixtures.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import subprocess
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+import numpy as np
+
+import benchmark_crawl
+from benchmark_extract_toc import make_full_text
+from benchmark_ingest import StubEmbeddingFunction, make_corpus
+from benchmark_query import QUERIES, load_test
+from extract_canada_page import PAGES_TO_PROCESS
+from extract_toc import HEADER_TAGS, build_section_index, extract_page_text
+from utils.chromadb_utils import build_chroma_collection
+from utils.html_parser import parse_html
+from utils.http_cache import create_session
+from utils.query_service import QueryService
+
+RESULTS_DIR = Path("../benchmark_results")
+FULL_TEXT_FIXTURE = "FullText.html"
+SYNTHETIC_CRAWL_START = "/en/root.html"
+
+
+def record_fixtures(urls: list[str], fixtures_dir: Path) -> None:
+    """Save the pages at `urls` under `fixtures_dir`, at the path they have on their site."""
+    session = create_session()
+    for url in urls:
+        response = session.get(url, timeout=10)
+        response.raise_for_status()
+        path = fixtures_dir / urlparse(url).path.lstrip("/")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(response.content)
+        print(f"Recorded {url} -> {path}")
+
+
+def start_server(fixtures_dir: Path, latency: float, fan_out: int) -> ThreadingHTTPServer:
+    """Serve the fixture recorded at the requested path, or a synthetic page when there is none."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            fixture = fixtures_dir / self.path.lstrip("/") if fixtures_dir else None
+            if fixture and fixture.is_file():
+                body = fixture.read_bytes()
+            else:
+                body = benchmark_crawl.render_page(self.path, fan_out).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def find_full_text(fixtures_dir: Path, full_text: str = None) -> Path:
+    """The FullText page to extract: `full_text` (relative to the fixtures), or the first one recorded."""
+    if not fixtures_dir:
+        return None
+    if full_text:
+        return fixtures_dir / full_text.lstrip("/")
+    return next(iter(sorted(fixtures_dir.rglob(FULL_TEXT_FIXTURE))), None)
+
+
+def find_crawl_start(fixtures_dir: Path, crawl_start: str = None) -> str:
+    """The path the crawl starts from: `crawl_start`, or the first starting page of
+    extract_canada_page.py that was recorded (None when there is none)."""
+    if crawl_start:
+        return "/" + crawl_start.lstrip("/")
+    if fixtures_dir:
+        for _, url in PAGES_TO_PROCESS:
+            path = urlparse(url).path
+            if (fixtures_dir / path.lstrip("/")).is_file():
+                return path
+    return None
+
+
+def bench_crawl(base_url: str, workers: int, start_path: str = None) -> dict:
+    nb_pages, elapsed = benchmark_crawl.run(workers, base_url, start_path or SYNTHETIC_CRAWL_START)
+    return {"pages": nb_pages, "pages_per_sec": nb_pages / elapsed}
+
+
+def bench_sections(fixture: Path, nb_parts: int, sections_per_part: int) -> dict:
+    if fixture:
+        markup = fixture.read_bytes()
+    else:
+        markup = make_full_text(nb_parts, sections_per_part)
+
+    start = time.perf_counter()
+    soup = parse_html(markup)
+    section_index = build_section_index(soup)
+    fragments = [header["id"] for header in soup.find_all(HEADER_TAGS, id=True)]
+    texts = [extract_page_text(soup, f"https://example.org/FullText.html#{fragment}", section_index) for fragment in fragments]
+    elapsed = time.perf_counter() - start
+
+    return {"sections": len(texts), "sections_per_sec": len(texts) / elapsed}
+
+
+def bench_ingest(chroma_path: str, nb_docs: int):
+    ids, documents, metadatas = make_corpus(nb_docs)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        collection = build_chroma_collection(chroma_path, "benchmark", "stub-model", ids, documents, metadatas,
+                                             embedding_function=StubEmbeddingFunction())
+    elapsed = time.perf_counter() - start
+    return collection, {"docs": nb_docs, "docs_per_sec": nb_docs / elapsed}
+
+
+def bench_query(collection, nb_clients: int, duration: float) -> dict:
+    queries = [f"{QUERIES[i % len(QUERIES)]} ({i})" for i in range(200)]
+    service = QueryService(collection, StubEmbeddingFunction(cost_per_call=0.01, cost_per_doc=0.001))
+    latencies = asyncio.run(load_test(service, queries, nb_clients, duration))
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {"queries": len(latencies), "p50_ms": p50, "p99_ms": p99, "qps": len(latencies) / duration}
+
+
+# Direction of every metric, to tell regressions from improvements
+HIGHER_IS_BETTER = {
+    "pages_per_sec": True,
+    "sections_per_sec": True,
+    "docs_per_sec": True,
+    "qps": True,
+    "p50_ms": False,
+    "p99_ms": False,
+}
+
+
+def current_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Print every metric next to its baseline value and return the ones that regressed by more than `threshold`."""
+    regressions = []
+    print(f"\nCompared with {baseline['commit']}:")
+    print(f"{'metric':>28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for bench, metrics in results["metrics"].items():
+        for name, value in metrics.items():
+            if name not in HIGHER_IS_BETTER or name not in baseline["metrics"].get(bench, {}):
+                continue
+            previous = baseline["metrics"][bench][name]
+            change = (value - previous) / previous if previous else 0.0
+            regressed = -change > threshold if HIGHER_IS_BETTER[name] else change > threshold
+            if regressed:
+                regressions.append(f"{bench}.{name}")
+            print(f"{bench + '.' + name:>28} {previous:>10.1f} {value:>10.1f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", type=Path, help="Directory of recorded HTML pages, stored at their path on the site")
+    parser.add_argument("--record", nargs="+", metavar="URL", help="Record these pages into --fixtures and exit")
+    parser.add_argument("--full-text", help="Path of the FullText page to extract, relative to --fixtures (e.g. eng/acts/L-2/FullText.html)")
+    parser.add_argument("--crawl-start", help="Path of the recorded page to start the crawl from (e.g. /en/services/jobs/workplace.html)")
+    parser.add_argument("--results-dir", type=Path, default=RESULTS_DIR)
+    parser.add_argument("--compare", help="Commit (or results file) to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds of latency added to every response")
+    parser.add_argument("--fan-out", type=int, default=20, help="Number of links on every synthetic page")
+    parser.add_argument("--crawl-workers", type=int, default=10)
+    parser.add_argument("--parts", type=int, default=20, help="Parts of the synthetic FullText page")
+    parser.add_argument("--sections", type=int, default=100, help="Sections per part of the synthetic FullText page")
+    parser.add_argument("--docs", type=int, default=5000, help="Documents in the synthetic corpus")
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent query clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of query load")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    if args.record:
+        if not args.fixtures:
+            parser.error("--record needs --fixtures")
+        record_fixtures(args.record, args.fixtures)
+        raise SystemExit
+
+    # Loaded before running, the results of this run may overwrite it (same commit)
+    baseline = None
+    if args.compare:
+        baseline_path = Path(args.compare)
+        if not baseline_path.is_file():
+            baseline_path = args.results_dir / f"{args.compare}.json"
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    full_text = find_full_text(args.fixtures, args.full_text)
+    if full_text and not full_text.is_file():
+        parser.error(f"No FullText fixture at {full_text}")
+    crawl_start = find_crawl_start(args.fixtures, args.crawl_start)
+    if args.crawl_start and not (args.fixtures and (args.fixtures / crawl_start.lstrip("/")).is_file()):
+        parser.error(f"No fixture recorded at {crawl_start}")
+
+    server = start_server(args.fixtures, args.latency, args.fan_out)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    metrics = {}
+    print(f"Crawling from {crawl_start or 'a synthetic site'}...")
+    metrics["crawl"] = bench_crawl(base_url, args.crawl_workers, crawl_start)
+    server.shutdown()
+    print(f"Extracting sections from {full_text or 'a synthetic FullText page'}...")
+    metrics["sections"] = bench_sections(full_text, args.parts, args.sections)
+    with tempfile.TemporaryDirectory() as chroma_path:
+        print("Ingesting...")
+        collection, metrics["ingest"] = bench_ingest(chroma_path, args.docs)
+        print("Querying...")
+        metrics["query"] = bench_query(collection, args.clients, args.duration)
+
+    results = {
+        "commit": current_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "parameters": {
+            **{k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items() if k not in ("record", "compare")},
+            # Sub-pages missing from the fixtures are served as synthetic pages
+            "crawl_input": f"fixtures:{crawl_start}" if crawl_start else "synthetic",
+            "sections_input": f"fixtures:{full_text.relative_to(args.fixtures)}" if full_text else "synthetic",
+        },
+        "metrics": metrics,
+    }
+
+    print(f"\n{'benchmark':>10} {'metric':>18} {'value':>10}")
+    for bench, values in metrics.items():
+        for name, value in values.items():
+            print(f"{bench:>10} {name:>18} {value:>10.1f}")
+
+    args.results_dir.mkdir(parents=True, exist_ok=True)
+    results_path = args.results_dir / f"{results['commit']}.json"
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results saved to {results_path}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            raise SystemExit(f"Regressions: {', '.join(regressions)}")
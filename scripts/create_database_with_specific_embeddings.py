@@ -1,79 +1,142 @@
+import logging
+import os
+import pathlib
+
 import chromadb
 from chromadb.utils import embedding_functions
 import pandas as pd
 
-# create client
-client = chromadb.PersistentClient(path="../chromadb_directory")
-
-# load embedding model
-sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="multi-qa-mpnet-base-dot-v1")
-
-# fetch or create collection
-collection = client.get_or_create_collection("Labour_Program_Feb132025", 
-                                             embedding_function=sentence_transformer_ef,
-                                             metadata={
-                                                 "hnsw:space":"cosine",
-                                             })
-
-# Load the data to be embedded
-df1 = pd.read_csv(r"outputs/clc.csv", encoding='utf-8')
-df1.fillna(value="N/A", inplace=True)
-df2 = pd.read_csv(r"outputs/clsr.csv", encoding='utf-8')
-df2.fillna(value="N/A", inplace=True)
-df3 = pd.read_csv(r"outputs/ipgs.csv", encoding='utf-8')
-df3.fillna(value="N/A", inplace=True)
-df4 = pd.read_csv(r"outputs/pages.csv", encoding='utf-8')
-df4.fillna(value="N/A", inplace=True)
-
-passages_df1 = [str(i) for i in df1["text"].values]
-passages_df2 = [str(i) for i in df2["text"].values]
-passages_df3 = [str(i) for i in df3["text"].values]
-passages_df4 = [str(i) for i in df4["text"].values]
-
-# adding documents to the collection (prints the documents added once done)
-collection.upsert(
-    documents=df1["text"].values.tolist(),
-    ids=df1["id"].values.tolist(),
-    metadatas=[{ttl:str([sect, hrchy, hlink])} for # this is an unresolved issue with chromadb (we have to convert the list to str currently)
-               ttl, sect, hrchy, hlink in 
-               zip(df1.title.values, df1.section_number.values, df1.hierarchy.values, df1.hyperlink.values)]
-)
-
-collection.upsert(
-    documents=df2["text"].values.tolist(),
-    ids=df2["id"].values.tolist(),
-    metadatas=[{ttl:str([sect, hrchy, hlink])} for
-               ttl, sect, hrchy, hlink in 
-               zip(df2.title.values, df2.section_number.values, df2.hierarchy.values, df2.hyperlink.values)]
-)
-
-collection.upsert(
-    documents=df3["text"].values.tolist(),
-    ids=df3["id"].values.tolist(),
-    metadatas=[{k:v} for k,v in zip(df3.title.values, df3.hyperlink.values)]
-)
-
-collection.upsert(
-    documents=df4["text"].values.tolist(),
-    ids=df4["id"].values.tolist(),
-    metadatas=[{k:v} for k,v in zip(df4.title.values, df4.hyperlink.values)]
-)
-
-# quick check if the output makes sense
-queries = [
-    "What are the rules applying to maternity leave?",
-    "What does the notion of averaging of hours mean for federally regulated employers?",
-    "What is constructive dismissal?",
-    "What is the definition of danger?",
-    "How to prevent harmful behaviour at work?"
-]
-
-results = collection.query(
-    query_texts=queries,        # Chroma will embed this for you
-    n_results=3,                # how many results to return
-    include=["metadatas", "distances", "documents", "embeddings"]
-)
-
-print(results.items()) # this works well
-print("hello")
+from utils.bm25 import BM25Index, bm25_path
+from utils.chromadb_utils import EMBEDDING_CACHE_DIRNAME, HNSWParams, document_metadata, manifest_path, sync_collection
+from utils.chunker import TokenChunker, chunk_corpus, load_tokenizer
+from utils.dedup import MinHashDeduplicator, deduplicate
+from utils.embedding_cache import CachedEmbeddingFunction
+from utils.embedding_pool import ProcessPoolEmbeddingFunction
+from utils.metrics import METRICS
+from utils.page_utils import OUTPUT_FORMATS
+
+CHROMA_PATH = pathlib.Path("../chromadb_directory")
+OUTPUTS_PATH = pathlib.Path("outputs")
+MODEL_NAME = "multi-qa-mpnet-base-dot-v1"
+COLLECTION_NAME = "Labour_Program_Feb132025"
+EMBEDDING_WORKERS = int(os.environ.get("EMBEDDING_WORKERS", "1")) # set to the number of cores on CPU-only ingest hosts
+HNSW_PARAMS = HNSWParams.from_env() # e.g. HNSW_M=32 HNSW_SEARCH_EF=200, see tune_hnsw.py to pick them
+NEAR_DUPLICATE_THRESHOLD = 0.85 # estimated Jaccard similarity of the word shingles above which two pages are collapsed
+
+# Read the output of a scraper, in the formats it is configured to write (OUTPUT_FORMATS) when there
+# is one: a file left in another format by an earlier run is stale. The newest file wins, the
+# columnar one on a tie.
+def load_output(name: str) -> pd.DataFrame:
+    existing = [path for path in (OUTPUTS_PATH / f"{name}.parquet", OUTPUTS_PATH / f"{name}.csv") if path.exists()]
+    configured = [path for path in existing if path.suffix.lstrip(".") in OUTPUT_FORMATS] or existing
+    output_path = max(configured, key=lambda path: path.stat().st_mtime, default=None)
+    if output_path is not None and output_path.suffix == ".parquet":
+        df = pd.read_parquet(output_path).replace("", "N/A") # empty fields are read as NaN from the CSV
+    else:
+        df = pd.read_csv(OUTPUTS_PATH / f"{name}.csv", encoding='utf-8')
+    df.fillna(value="N/A", inplace=True)
+    return df
+
+# Text of a field of a row ("" for the empty fields, read as "N/A" from the outputs)
+def field(row, name: str) -> str:
+    value = row.get(name)
+    return "" if value is None or value == "N/A" else str(value)
+
+# (id, document, metadata) of the sections of an act or regulation (rows of extract_toc.py)
+def section_documents(rows, source: str):
+    for row in rows:
+        metadata = document_metadata(source, field(row, "title"), field(row, "hyperlink"), field(row, "section_number"),
+                                     field(row, "hierarchy").split(" / "))
+        yield str(row["id"]), row["text"], metadata
+
+# (id, document, metadata) of scraped pages (rows of extract_ipgs.py and extract_canada_page.py)
+def page_documents(rows, source: str):
+    for row in rows:
+        metadata = document_metadata(source, field(row, "title"), field(row, "hyperlink"), hierarchy=field(row, "hierarchy").split(" / "))
+        yield str(row["id"]), row["text"], metadata
+
+if __name__ == "__main__": # required to spawn the embedding worker processes
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    # create client
+    client = chromadb.PersistentClient(path=str(CHROMA_PATH))
+
+    # load embedding model, sharded across worker processes if asked to (embeddings are cached on disk, keyed by model and text)
+    if EMBEDDING_WORKERS > 1:
+        model_ef = ProcessPoolEmbeddingFunction(model_name=MODEL_NAME, num_workers=EMBEDDING_WORKERS)
+    else:
+        model_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=MODEL_NAME)
+    sentence_transformer_ef = CachedEmbeddingFunction(
+        model_ef,
+        model_name=MODEL_NAME,
+        cache_dir=CHROMA_PATH / EMBEDDING_CACHE_DIRNAME,
+    )
+
+    # fetch or create collection (construction_ef and M only apply when the collection is created)
+    collection = client.get_or_create_collection(COLLECTION_NAME, 
+                                                 embedding_function=sentence_transformer_ef,
+                                                 metadata=HNSW_PARAMS.to_metadata("cosine"))
+    HNSW_PARAMS.apply(collection)
+
+    # Load the data to be embedded and gather the whole corpus, so that documents removed
+    # from the CSVs can be removed from the collection too
+    corpus = []
+    for name in ("clc", "clsr"):
+        corpus.extend(section_documents(load_output(name).to_dict("records"), name))
+
+    # the crawl roots overlap: near-identical pages are collapsed into the first one, which lists the others as aliases
+    pages = []
+    for name in ("ipgs", "pages"):
+        pages.extend(page_documents(load_output(name).to_dict("records"), name))
+    page_ids, page_texts, page_metadatas = (list(column) for column in zip(*pages))
+    *pages, nb_removed = deduplicate(page_ids, page_texts, page_metadatas, MinHashDeduplicator(NEAR_DUPLICATE_THRESHOLD))
+    logging.info("Collapsed %d near-duplicate pages", nb_removed)
+    corpus.extend(zip(*pages))
+    ids, documents, metadatas = (list(column) for column in zip(*corpus))
+
+    # split long documents into overlapping chunks that fit in the model's max sequence length
+    ids, documents, metadatas = chunk_corpus(ids, documents, metadatas, TokenChunker(load_tokenizer(MODEL_NAME)))
+
+    # only the documents added or changed since the last run are embedded (prints a summary once done)
+    sync_collection(collection, manifest_path(CHROMA_PATH, collection.name), ids, documents, metadatas,
+                    embedding_func=sentence_transformer_ef, embedding_batch_size=32 * EMBEDDING_WORKERS)
+    sentence_transformer_ef.flush()
+    print(sentence_transformer_ef.stats())
+
+    # keep the BM25 index of the collection (for hybrid search) in line with it, keyed on the ids holding the section numbers
+    bm25 = BM25Index.load(bm25_path(CHROMA_PATH, collection.name))
+    bm25.sync(ids, documents, [metadata["parent_id"] for metadata in metadatas])
+    bm25.save(bm25_path(CHROMA_PATH, collection.name))
+    print(f"Metrics written to {', '.join(map(str, METRICS.write_report('create_database')))}")
+
+    # quick check if the output makes sense
+    queries = [
+        "What are the rules applying to maternity leave?",
+        "What does the notion of averaging of hours mean for federally regulated employers?",
+        "What is constructive dismissal?",
+        "What is the definition of danger?",
+        "How to prevent harmful behaviour at work?"
+    ]
+
+    results = collection.query(
+        query_texts=queries,        # Chroma will embed this for you
+        n_results=3,                # how many results to return
+        include=["metadatas", "distances", "documents", "embeddings"]
+    )
+
+    print(results.items()) # this works well
+
+    # queries can be scoped with a filter on the metadata, only searching the matching records
+    scoped_results = collection.query(
+        query_texts=queries,
+        n_results=3,
+        where={"$and": [{"source": "clc"}, {"part": "Part III"}]}, # e.g. standard hours, wages, vacations and holidays
+        include=["metadatas", "distances"]
+    )
+    print(scoped_results["metadatas"])
+    print("hello")
+
+    if EMBEDDING_WORKERS > 1:
+        model_ef.close()
+
 
@@ -4,22 +4,32 @@ This script extracts content from Canada government pages and saves them to a CS
 For each page it:
   - Creates a Page object containing the page's metadata and content
   - Extracts the navigation hierarchy from the header
-  - Extracts the main content text
+  - Extracts the main content text, without the blocks repeated across the crawled pages (boilerplate)
   - Saves the page data to a CSV if it doesn't already exist
+The crawl is checkpointed in a frontier file (CRAWL_FRONTIER): a crawl interrupted midway resumes
+where it stopped when the script is run again. The file is removed once the pages are saved.
 """
 
-import requests
-from bs4 import BeautifulSoup
-from typing import List, Tuple
-from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from typing import Iterator, List, Tuple
 
-from utils.page_utils import Page, extract_main_content, save_to_csv
+from utils.crawler import CrawlEngine, CrawlTask
+from utils.frontier import CrawlFrontier
+from utils.html_parser import PAGE_ELEMENTS, parse_html
+from utils.http_cache import create_cached_session
+from utils.metrics import METRICS
+from utils.boilerplate import remove_boilerplate
+from utils.page_utils import OUTPUT_FORMATS, Page, extract_main_blocks, save_pages
 
 MAX_BATCH_SIZE = 10
+MAX_DEPTH = 1
 BASE_URL = "https://www.canada.ca"
 
-PROCESSED_LINKS = set()
-BLACKLIST_ROOT_URLS = set()
+FRONTIER_PATH = os.environ.get("CRAWL_FRONTIER", "outputs/.pages_frontier.sqlite")
+BLACKLIST_ROOT_URLS = ("/en/news/",)
+
+logger = logging.getLogger(__name__)
 
 def extract_hierarchy(soup) -> Tuple[List[str], List[str]]:
     hierarchy = []
@@ -55,93 +65,76 @@ def extract_toc_links(soup) -> List[str]:
             links.append(f"{BASE_URL}{href}")
     return links
 
-def process_page(url: str, current_depth: int, skip_toc: bool = False):
-    current_processed_pages = []
-    print(f"Processing {url} at depth {current_depth}")
-    
-    try:     
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Check for table of contents if not skipping
-        if not skip_toc:
-            toc_links = extract_toc_links(soup)
-            if toc_links:
-                print(f"Found table of contents in {url}, processing sub-pages...")
-                for full_url in toc_links:
-                    if full_url not in PROCESSED_LINKS:
-                        PROCESSED_LINKS.add(full_url) # Mark as processed
-                        processed_pages = process_page(full_url, current_depth, skip_toc=True)
-                        current_processed_pages.extend(processed_pages)
-                return current_processed_pages
-        
-        # Extract page components
-        title = extract_title(soup)
-        hierarchy, url_hierarchy = extract_hierarchy(soup)
-        text, linked_pages = extract_main_content(soup)
-
-        page = Page(None, title, url, hierarchy, url_hierarchy, linked_pages, text)
-        current_processed_pages.append(page)
-        
-        # Process linked pages if depth allows
-        if current_depth < 1:
-            print(f"Processing links from {url} at depth {current_depth}")
-            sub_links_to_process = []
-                
-            # Mark all links as processed before starting
-            for link in linked_pages:
-                full_url = f"{BASE_URL}{link}"
-                if full_url not in PROCESSED_LINKS and not any(link.startswith(root_url) for root_url in BLACKLIST_ROOT_URLS):
-                    PROCESSED_LINKS.add(full_url)
-                    sub_links_to_process.append(full_url)
-            
-            # Process in parallel only at depth 0
-            if current_depth == 0:
-                # Process in batches of 10
-                with ThreadPoolExecutor(max_workers=MAX_BATCH_SIZE) as executor:
-                    futures = [executor.submit(process_page, url, current_depth + 1) for url in sub_links_to_process]
-
-                    # Wait for batch completion and add results in order
-                    # for future in sorted(futures.keys(), key=lambda f: futures[f]):
-                    for future in futures:
-                        processed_pages = future.result()
-                        if processed_pages:
-                            current_processed_pages.extend(processed_pages)
-            else:
-                # Process sequentially for depth > 0
-                for link in sub_links_to_process:
-                    processed_pages = process_page(link, current_depth + 1)
-                    current_processed_pages.extend(processed_pages)
-                
-    except Exception as e:
-        print(f"Error processing {url}: {e}")
-
-    return current_processed_pages
+def parse_page(task: CrawlTask, response) -> Tuple[List[Page], List[CrawlTask]]:
+    soup = parse_html(response.content, only=PAGE_ELEMENTS)
+
+    # Check for table of contents if not skipping
+    if not task.skip_toc:
+        toc_links = extract_toc_links(soup)
+        if toc_links:
+            logger.info("Found table of contents in %s, processing sub-pages...", task.url)
+            return [], [CrawlTask(full_url, task.depth, skip_toc=True) for full_url in toc_links]
+
+    # Extract page components
+    title = extract_title(soup)
+    hierarchy, url_hierarchy = extract_hierarchy(soup)
+    blocks, linked_pages = extract_main_blocks(soup)
+
+    page = Page(None, title, task.url, hierarchy, url_hierarchy, linked_pages, " ".join(blocks), blocks)
+
+    # Process linked pages if depth allows
+    sub_tasks = []
+    if task.depth < MAX_DEPTH:
+        logger.info("Processing links from %s at depth %d", task.url, task.depth)
+        # Blacklisted and already processed links are dropped by the frontier
+        for link in linked_pages:
+            sub_tasks.append(CrawlTask(f"{BASE_URL}{link}", task.depth + 1))
+
+    return [page], sub_tasks
+
+def crawl_pages(urls: List[str], max_workers: int = MAX_BATCH_SIZE, session=None, frontier: CrawlFrontier = None) -> List[List[Page]]:
+    """Crawl all the root urls at once, sharing the worker pool and the processed links.
+    Returns the pages found from each root url, in the order of the roots."""
+    engine = CrawlEngine(parse_page, max_workers=max_workers, session=session or create_cached_session(max_workers))
+    seeds = [CrawlTask(url, 0, order=(idx,)) for idx, url in enumerate(urls)]
+    results = engine.crawl(seeds, frontier or CrawlFrontier(blocked_prefixes=BLACKLIST_ROOT_URLS))
+
+    pages_per_root = [[] for _ in urls]
+    for order, page in results:
+        pages_per_root[order[0]].append(page)
+    return pages_per_root
+
+def process_page(url: str, current_depth: int, skip_toc: bool = False, frontier: CrawlFrontier = None) -> List[Page]:
+    engine = CrawlEngine(parse_page, max_workers=MAX_BATCH_SIZE, session=create_cached_session(MAX_BATCH_SIZE))
+    results = engine.crawl([CrawlTask(url, current_depth, skip_toc)], frontier or CrawlFrontier(blocked_prefixes=BLACKLIST_ROOT_URLS))
+    return [page for _, page in results]
+
+# (id prefix, url) of the starting pages
+PAGES_TO_PROCESS = [
+    ("LABOUR", "https://www.canada.ca/en/employment-social-development/corporate/portfolio/labour.html"),
+    ("WORKPLACE", "https://www.canada.ca/en/services/jobs/workplace.html"),
+    ("LABOUR-REPORTS", "https://www.canada.ca/en/employment-social-development/corporate/portfolio/labour/programs/labour-standards/reports.html")
+]
+
+def iter_pages(pages_to_process: List[Tuple[str, str]] = PAGES_TO_PROCESS, frontier: CrawlFrontier = None) -> Iterator[Page]:
+    """Crawl from the starting pages and yield the pages found, with ids numbered per starting page
+    and the boilerplate learned over the first of them removed."""
+    # The starting pages are claimed first, so they are never crawled again as sub-pages of another one
+    pages_per_root = crawl_pages([page_url for _, page_url in pages_to_process], frontier=frontier)
+
+    def numbered_pages():
+        for (id_prefix, _), processed_pages in zip(pages_to_process, pages_per_root):
+            # Set the id for each page (Otherwise, might not be in order due to parallel processing)
+            for idx, page in enumerate(processed_pages):
+                page.id = f"{id_prefix}-{idx + 1}"
+                yield page
+
+    yield from remove_boilerplate(numbered_pages(), name="pages")
 
 if __name__ == "__main__":
-    pages_to_process = [
-        ("LABOUR", "https://www.canada.ca/en/employment-social-development/corporate/portfolio/labour.html"),
-        ("WORKPLACE", "https://www.canada.ca/en/services/jobs/workplace.html"),
-        ("LABOUR-REPORTS", "https://www.canada.ca/en/employment-social-development/corporate/portfolio/labour/programs/labour-standards/reports.html")
-    ]
-    
-    # Initialize PROCESSED_LINKS with starting pages
-    PROCESSED_LINKS = set(pages_to_process)
-
-    BLACKLIST_ROOT_URLS = set([
-        "/en/news/"
-    ])
-
-    all_processed_pages = []
-    
-    for id_prefix, page_url in pages_to_process:
-        processed_pages = process_page(page_url, 0)
-
-        # Set the id for each page (Otherwise, might not be in order due to parallel processing)
-        for idx, page in enumerate(processed_pages):
-            page.id = f"{id_prefix}-{idx + 1}"
-
-        all_processed_pages.extend(processed_pages)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
-    save_to_csv(all_processed_pages, "pages.csv")
+    frontier = CrawlFrontier(FRONTIER_PATH, blocked_prefixes=BLACKLIST_ROOT_URLS)
+    save_pages(iter_pages(frontier=frontier), "pages", formats=OUTPUT_FORMATS)
+    frontier.delete()
+    logger.info("Metrics written to %s", ", ".join(map(str, METRICS.write_report("extract_canada_page"))))
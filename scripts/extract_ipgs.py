@@ -3,23 +3,31 @@
 This script extracts Interpretations, Policies and Guidelines (IPGs) from the Canada Labour Program website.
 For each IPG it:
   - Creates a Page object containing the IPG's metadata and content
-  - Extracts content from the linked page
+  - Extracts content from the linked page, without the blocks repeated across the IPG pages (boilerplate)
   - Saves all IPG data to a CSV file
 """
 
+import logging
 import requests
-from bs4 import BeautifulSoup
-from typing import List, Optional
+from typing import Iterator, List, Optional
 from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 from dataclasses import dataclass
 
-from utils.page_utils import Page, extract_main_content, save_to_csv
+from utils.html_parser import MAIN_CONTENT, parse_html
+from utils.htmltables_converter import HTMLTable, HTMLTablestoDataframes
+from utils.http_cache import create_cached_session
+from utils.metrics import METRICS
+from utils.boilerplate import remove_boilerplate
+from utils.page_utils import OUTPUT_FORMATS, Page, extract_main_blocks, save_pages
 
 MAX_WORKERS = 10
 BASE_URL = "https://www.canada.ca"
+IPG_INDEX_URL = "https://www.canada.ca/en/employment-social-development/programs/laws-regulations/labour/interpretations-policies.html"
 
-PROCESSED_IPG_IDS = []
+PROCESSED_IPG_IDS = set()
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class IPG:
@@ -28,16 +36,18 @@ class IPG:
     id: str
     table_title: str
 
-def process_ipg_page(ipg: IPG) -> Optional[Page]:
+def process_ipg_page(ipg: IPG, session: requests.Session) -> Optional[Page]:
     try:
         full_url = urljoin(BASE_URL, ipg.url)
-        response = requests.get(full_url, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        text, linked_pages = extract_main_content(soup)
+        with METRICS.span("ipg_page"):
+            response = session.get(full_url, timeout=10)
+            response.raise_for_status()
+
+            soup = parse_html(response.content, only=MAIN_CONTENT)
+            blocks, linked_pages = extract_main_blocks(soup)
 
-        print(f"Processed IPG: {ipg.title} - {full_url} (Hierarchy: {ipg.table_title})")
+        METRICS.inc("ipgs_processed")
+        logger.info("Processed IPG: %s - %s (Hierarchy: %s)", ipg.title, full_url, ipg.table_title)
         
         return Page(
             ipg.id,
@@ -46,87 +56,71 @@ def process_ipg_page(ipg: IPG) -> Optional[Page]:
             [ipg.table_title],
             [],
             linked_pages,
-            text
+            " ".join(blocks),
+            blocks
         )
     
     except Exception as e:
-        print(f"Error processing {ipg.url}: {e}")
+        logger.warning("Error processing %s: %s", ipg.url, e)
         return None
 
-def extract_ipgs_from_table(table) -> List[IPG]:
+def extract_ipgs_from_table(table: HTMLTable) -> List[IPG]:
     ipgs = []
-    
-    # Find table title (usually in a caption or preceding h2/h3)
-    table_title = ""
-    caption = table.find('caption')
-    if caption:
-        table_title = caption.get_text(strip=True)
-    else:
-        # Look for preceding header
-        prev_elem = table.find_previous(['h2', 'h3'])
-        if prev_elem:
-            table_title = prev_elem.get_text(strip=True)
-    
-    # Find the header row to determine column positions
-    headers = table.find_all('th')
-    title_idx = next((i for i, h in enumerate(headers) if 'Title' in h.get_text()), 0)
-    number_idx = next((i for i, h in enumerate(headers) if 'Number' in h.get_text() or 'No.' in h.get_text()), 1)
-    
-    # Process each row
-    for row in table.find_all('tr')[1:]:  # Skip header row
-        cells = row.find_all('td')
-        title_cell = cells[title_idx]
-        number_cell = cells[number_idx]
-        
+    title_idx = table.column('Title', default=0)
+    number_idx = table.column('Number', 'No.', default=1)
+
+    for row in table.rows:
+        if len(row) <= max(title_idx, number_idx):
+            continue
+        title_cell = row[title_idx]
+        ipg_id = row[number_idx].text
+
         # Extract title and link
-        link = title_cell.find('a')
-        if not link:
+        url = title_cell.href
+        if not url:
             continue
-            
-        title = title_cell.get_text(strip=True)
-        url = link.get('href')
-        ipg_id = number_cell.get_text(strip=True)
+        title = title_cell.text
 
         if ipg_id in PROCESSED_IPG_IDS:
-            print(f"Skipping duplicate IPG: {ipg_id}")
+            logger.info("Skipping duplicate IPG: %s", ipg_id)
+            METRICS.inc("ipg_duplicates")
             continue
-        
+
         if url and title and ipg_id:
-            ipgs.append(IPG(title, url, ipg_id, table_title))
-            PROCESSED_IPG_IDS.append(ipg_id)
-    
+            ipgs.append(IPG(title, url, ipg_id, table.title))
+            PROCESSED_IPG_IDS.add(ipg_id)
+
     return ipgs
 
-def main():
-    # Fetch main IPG page
-    response = requests.get("https://www.canada.ca/en/employment-social-development/programs/laws-regulations/labour/interpretations-policies.html")
-    response.raise_for_status()
-    soup = BeautifulSoup(response.content, 'html.parser')
-    
-    # Find all tables
-    tables = soup.find_all('table')
-    
+def iter_ipg_pages(session: requests.Session = None) -> Iterator[Page]:
+    """Yield the page of every IPG listed in the tables of the IPG index, in the order of the tables,
+    as they are processed, without the boilerplate learned over the first of them."""
+    session = session or create_cached_session(MAX_WORKERS)
+
+    # Fetch the main IPG page and parse its tables, with their links, in one pass
+    ipg_tables = HTMLTablestoDataframes(url=IPG_INDEX_URL, session=session)
+
     # Extract IPGs from all tables
     all_ipgs = []
-    for table in tables:
+    for table in ipg_tables.tables:
         all_ipgs.extend(extract_ipgs_from_table(table))
     
-    print(f"Found {len(all_ipgs)} IPGs to process")
+    logger.info("Found %d IPGs to process", len(all_ipgs))
     
     # Process IPG pages in parallel
-    processed_pages = []
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         future_to_ipg = {
-            executor.submit(process_ipg_page, ipg): ipg 
+            executor.submit(process_ipg_page, ipg, session): ipg 
             for ipg in all_ipgs
         }
         
-        for future in future_to_ipg:
-            page = future.result()
-            if page:
-                processed_pages.append(page)
-    
-    save_to_csv(processed_pages, "ipgs.csv")
+        processed_pages = (future.result() for future in future_to_ipg)
+        yield from remove_boilerplate((page for page in processed_pages if page), name="ipgs")
+
+def main():
+    save_pages(iter_ipg_pages(), "ipgs", formats=OUTPUT_FORMATS)
+    logger.info("Metrics written to %s", ", ".join(map(str, METRICS.write_report("extract_ipgs"))))
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     main()
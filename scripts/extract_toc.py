@@ -11,11 +11,18 @@ It writes each leaf section's title, section number, hierarchy, URL and text as
 """
 
 import csv
+import logging
 import os
+import pathlib
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse
 
+from utils.html_parser import TOC_ELEMENTS, parse_html
+from utils.http_cache import create_cached_session
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
 class TocItem:
     def __init__(self, title: str, section_number: str, link_url: str, hierarchy: str):
         self.title = title
@@ -61,106 +68,158 @@ def parse_toc_items(ul, current_hierarchy, base_url) -> list[TocItem]:
     return items
 
 # Fetch the main Labour Code page and parse the table-of-contents recursively.
-def get_main_toc_links(base_url: str) -> list[TocItem]:
-    response = requests.get(base_url, timeout=10)
+def get_main_toc_links(base_url: str, session: requests.Session) -> list[TocItem]:
+    response = session.get(base_url, timeout=10)
     response.raise_for_status()
-    soup = BeautifulSoup(response.content, 'html.parser')
+    soup = parse_html(response.content, only=TOC_ELEMENTS)
     
     toc = soup.find('ul', class_='TocIndent')
     toc_items = parse_toc_items(toc, [], base_url)
     return toc_items
 
-# Given a candidate section URL, download and extract the text content for that specific section.
-def extract_page_text(soup, url):
-    parsed_url = urlparse(url)
-    if parsed_url.fragment:
-        header_tags = ["h1", "h2", "h3", "h4", "h5", "h6"]
+HEADER_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+
+# Build a fragment id -> section text map in a single pass over the document.
+# The boundary rules are the ones of a section lookup: a section starts at its <hX> tag (or at
+# the enclosing <header> tag, if any) and includes the subsequent siblings up to the next <hX>.
+# Sections starting at a <header> tag include all their subsequent siblings (Ex : Schedule I).
+def build_section_index(soup) -> dict[str, str]:
+    section_index = {}
+    siblings_cache = {}
+
+    def siblings_of(element):
+        # Children of the element's parent and their text, computed once per parent
+        parent = element.parent
+        if id(parent) not in siblings_cache:
+            children = [child for child in parent.children if getattr(child, "name", None)]
+            positions = {id(child): idx for idx, child in enumerate(children)}
+            siblings_cache[id(parent)] = (children, positions, [None] * len(children))
+        return siblings_cache[id(parent)]
+
+    for section_header in soup.find_all(HEADER_TAGS, id=True):
+        fragment = section_header["id"]
+        if fragment in section_index:
+            continue
 
-        # Look for the section header with the matching fragment id
-        section_header = soup.find(header_tags, id=parsed_url.fragment)
-        if not section_header:
-            print(f"Section with ID '{parsed_url.fragment}' not found in {url}.")
-            return ""
-        
         # Check if the header is within a <header> tag
         parent_header = section_header.find_parent('header')
-        if parent_header:
-            section_header = parent_header
-        
-        # Start with the header's text
-        extracted_text = section_header.get_text(separator="\n", strip=True)
+        start = parent_header if parent_header else section_header
 
-        # Grab subsequent siblings up to the next <hX>
-        for sibling in section_header.find_next_siblings():
-            # Include all siblings if in a <header> tag section (Ex : Schedule I)
-            if sibling.name in header_tags and parent_header is None:
+        children, positions, texts = siblings_of(start)
+        section_texts = []
+        for idx in range(positions[id(start)], len(children)):
+            sibling = children[idx]
+            if idx > positions[id(start)] and sibling.name in HEADER_TAGS and parent_header is None:
                 break
-            extracted_text += "\n" + sibling.get_text(separator="\n", strip=True)
+            if texts[idx] is None:
+                texts[idx] = sibling.get_text(separator="\n", strip=True)
+            section_texts.append(texts[idx])
 
         # Replace newlines with spaces
-        extracted_text = extracted_text.replace("\n", " ").replace("\r", " ")
+        section_index[fragment] = "\n".join(section_texts).replace("\n", " ").replace("\r", " ").strip()
 
-        return extracted_text.strip()
+    return section_index
+
+# Given a candidate section URL, extract the text content for that specific section.
+# Pass the `section_index` of the soup when extracting many sections from the same document.
+def extract_page_text(soup, url, section_index=None):
+    parsed_url = urlparse(url)
+    if parsed_url.fragment:
+        if section_index is None:
+            section_index = build_section_index(soup)
+
+        # Look for the section header with the matching fragment id
+        if parsed_url.fragment not in section_index:
+            logger.warning("Section with ID '%s' not found in %s.", parsed_url.fragment, url)
+            return ""
+
+        return section_index[parsed_url.fragment]
     else:
         return None
 
-def process_toc_page(toc_url, full_page_url, file_name, empty_section_number_prefix = ""):
-    print("Fetching table of contents links...")
-    toc_items = get_main_toc_links(toc_url)
-    print(f"Found {len(toc_items)} leaf links.")
+TOC_COLUMNS = ["id", "title", "section_number", "hierarchy", "hyperlink", "text"]
+
+# (table of contents url, full text url, output name, prefix of the ids of the sections without number)
+TOC_DOCUMENTS = [
+    (
+        "https://laws-lois.justice.gc.ca/eng/acts/l-2/",
+        "https://laws-lois.justice.gc.ca/eng/acts/l-2/FullText.html",
+        "clc",
+        ""
+    ),
+    (
+        "https://laws-lois.justice.gc.ca/eng/regulations/C.R.C.,_c._986",
+        "https://laws-lois.justice.gc.ca/eng/regulations/C.R.C.,_c._986/FullText.html", 
+        "clsr",
+        "SCHEDULE"
+    )
+]
+
+# Yield one row (a dict keyed by TOC_COLUMNS) per leaf section of the table of contents.
+def iter_toc_sections(toc_url, full_page_url, file_name, empty_section_number_prefix = "", session = None):
+    session = session or create_cached_session()
+    logger.info("Fetching table of contents links...")
+    with METRICS.span("toc_links", document=file_name):
+        toc_items = get_main_toc_links(toc_url, session)
+    logger.info("Found %d leaf links.", len(toc_items))
     soup = None
 
+    # A failed fetch must not pass for a document without sections: let it propagate
     try:
-        response = requests.get(full_page_url, timeout=10)
+        response = session.get(full_page_url, timeout=10)
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = parse_html(response.content)
         
     except Exception as e:
-        print(f"Error extracting text from {full_page_url}: {e}")
-        return ""
-    
-    # Open the CSV file for writing.
-    with open(f"outputs/{file_name}.csv", "w", newline="", encoding="utf-8") as csvfile:
-        csv_writer = csv.writer(csvfile)
-        csv_writer.writerow(["id", "title", "section_number", "hierarchy", "hyperlink", "text"])
-        empty_section_nb = 1
-
-        for toc_item in toc_items:
-            url = requests.compat.urljoin(full_page_url, toc_item.link_url)
-            print(f"Processing: {toc_item.title} - {url} (Section Number: {toc_item.section_number}, Hierarchy: {toc_item.hierarchy})")
-            text = extract_page_text(soup, url)
-
-            if not text:
-                print(f"No text found for {url}")
-                continue
-
-            id_prefix = file_name.upper() + "-"
-            if toc_item.section_number:
-                id_text = f"{id_prefix}{toc_item.section_number}"
-            else:
-                id_text = f"{id_prefix}{empty_section_number_prefix}-{empty_section_nb}"
-                empty_section_nb += 1
-
-            csv_writer.writerow([id_text, toc_item.title, toc_item.section_number, toc_item.hierarchy, url, text])
+        logger.error("Error extracting text from %s: %s", full_page_url, e)
+        raise
+
+    section_index = build_section_index(soup)
+    empty_section_nb = 1
+
+    for toc_item in toc_items:
+        url = requests.compat.urljoin(full_page_url, toc_item.link_url)
+        logger.debug("Processing: %s - %s (Section Number: %s, Hierarchy: %s)", toc_item.title, url, toc_item.section_number, toc_item.hierarchy)
+        text = extract_page_text(soup, url, section_index)
+
+        if not text:
+            logger.warning("No text found for %s", url)
+            METRICS.inc("sections_missing", document=file_name)
+            continue
+
+        METRICS.inc("sections_extracted", document=file_name)
+        id_prefix = file_name.upper() + "-"
+        if toc_item.section_number:
+            id_text = f"{id_prefix}{toc_item.section_number}"
+        else:
+            id_text = f"{id_prefix}{empty_section_number_prefix}-{empty_section_nb}"
+            empty_section_nb += 1
+
+        yield dict(zip(TOC_COLUMNS, [id_text, toc_item.title, toc_item.section_number, toc_item.hierarchy, url, text]))
+
+def process_toc_page(toc_url, full_page_url, file_name, empty_section_number_prefix = "", session = None):
+    # Write to a temporary file, which only replaces the CSV once every section was extracted:
+    # an error leaves the previous CSV in place.
+    csv_path = f"outputs/{file_name}.csv"
+    tmp_path = f"{csv_path}.tmp"
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as csvfile:
+            csv_writer = csv.DictWriter(csvfile, fieldnames=TOC_COLUMNS)
+            csv_writer.writeheader()
+            csv_writer.writerows(iter_toc_sections(toc_url, full_page_url, file_name, empty_section_number_prefix, session))
+    except BaseException:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, csv_path)
 
 if __name__ == "__main__":
-    documents = [
-        (
-            "https://laws-lois.justice.gc.ca/eng/acts/l-2/",
-            "https://laws-lois.justice.gc.ca/eng/acts/l-2/FullText.html",
-            "clc",
-            ""
-        ),
-        (
-            "https://laws-lois.justice.gc.ca/eng/regulations/C.R.C.,_c._986",
-            "https://laws-lois.justice.gc.ca/eng/regulations/C.R.C.,_c._986/FullText.html", 
-            "clsr",
-            "SCHEDULE"
-        )
-    ]
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     # Create outputs directory if it doesn't exist
     os.makedirs("outputs", exist_ok=True)
 
-    for toc_url, full_page_url, file_name, empty_section_number_prefix in documents:
-        process_toc_page(toc_url, full_page_url, file_name, empty_section_number_prefix)
\ No newline at end of file
+    session = create_cached_session()
+    for toc_url, full_page_url, file_name, empty_section_number_prefix in TOC_DOCUMENTS:
+        process_toc_page(toc_url, full_page_url, file_name, empty_section_number_prefix, session)
+
+    logger.info("Metrics written to %s", ", ".join(map(str, METRICS.write_report("extract_toc"))))
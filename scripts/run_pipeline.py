@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+This script runs the whole ingestion as one pipeline: scrape -> clean -> chunk -> embed -> index.
+It:
+  - Scrapes the four sources (CLC, CLSR, IPGs, canada.ca pages) in parallel branches
+  - Cleans each source into (id, document, metadata) records, streamed into the chunking stage
+  - Collapses near-duplicate pages (the crawl roots overlap) into a canonical page listing its aliases
+  - Chunks the corpus, fills the embedding cache, then syncs the collection and its BM25 index
+  - Fingerprints the inputs of every stage, including the source of the code it relies on (CODE_DEPS),
+    and skips the stages whose output is current: the scrapers are re-run once their output is older
+    than --max-age hours, and an unchanged scrape leaves the downstream stages untouched
+
+Stage outputs are kept under --cache-dir. With --no-cache every stage runs and records are handed
+over in memory only. Examples:
+    python run_pipeline.py                       # bring the collection up to date
+    python run_pipeline.py --targets chunk       # stop after chunking
+    python run_pipeline.py --force scrape_ipgs   # re-scrape the IPGs even if they are recent
+"""
+
+import argparse
+import functools
+import logging
+import pathlib
+from dataclasses import asdict
+
+import chromadb
+from chromadb.utils import embedding_functions
+from more_itertools import batched
+
+import create_database_with_specific_embeddings
+import extract_canada_page
+import extract_ipgs
+import extract_toc
+import utils.bm25
+import utils.boilerplate
+import utils.chromadb_utils
+import utils.chunker
+import utils.crawler
+import utils.dedup
+import utils.embedding_cache
+import utils.frontier
+import utils.html_parser
+import utils.htmltables_converter
+import utils.page_utils
+from create_database_with_specific_embeddings import COLLECTION_NAME, HNSW_PARAMS, MODEL_NAME, NEAR_DUPLICATE_THRESHOLD, page_documents, section_documents
+from utils.bm25 import BM25Index, bm25_path
+from utils.chromadb_utils import EMBEDDING_CACHE_DIRNAME, HNSWParams, manifest_path, sync_collection
+from utils.chunker import TokenChunker, length_sorted_order, load_tokenizer
+from utils.dedup import MinHashDeduplicator, deduplicate
+from utils.embedding_cache import CachedEmbeddingFunction
+from utils.embedding_pool import ProcessPoolEmbeddingFunction
+from utils.frontier import CrawlFrontier
+from utils.metrics import METRICS
+from utils.page_utils import PAGE_COLUMNS, get_page_csv_row
+from utils.pipeline import Pipeline, Stage, load_records, save_records
+
+logger = logging.getLogger(__name__)
+
+TOC_SOURCES = {name: (toc_url, full_page_url, prefix) for toc_url, full_page_url, name, prefix in extract_toc.TOC_DOCUMENTS}
+PAGE_SOURCES = ["ipgs", "pages"]
+
+
+def scrape_toc(toc_url: str, full_page_url: str, name: str, empty_section_number_prefix: str):
+    return extract_toc.iter_toc_sections(toc_url, full_page_url, name, empty_section_number_prefix)
+
+
+def scrape_ipgs():
+    return (dict(zip(PAGE_COLUMNS, get_page_csv_row(page))) for page in extract_ipgs.iter_ipg_pages())
+
+
+def scrape_pages(frontier_path: str):
+    frontier = CrawlFrontier(frontier_path, blocked_prefixes=extract_canada_page.BLACKLIST_ROOT_URLS)
+    pages = [dict(zip(PAGE_COLUMNS, get_page_csv_row(page))) for page in extract_canada_page.iter_pages(frontier=frontier)]
+    frontier.delete()
+    return pages
+
+
+def clean(kind: str, source: str, **scraped):
+    """(id, document, metadata) records of the rows of a source, with whitespace collapsed and empty documents dropped."""
+    rows = next(iter(scraped.values()))
+    documents = section_documents(rows, source) if kind == "sections" else page_documents(rows, source)
+    for id_, text, metadata in documents:
+        text = " ".join(str(text).split())
+        if text and text != "N/A":
+            yield {"id": id_, "document": text, "metadata": metadata}
+
+
+def dedup(threshold: float, **sources):
+    records = [record for name in sorted(sources) for record in sources[name]]
+    ids, documents, metadatas, _ = deduplicate([r["id"] for r in records], [r["document"] for r in records],
+                                               [r["metadata"] for r in records], MinHashDeduplicator(threshold))
+    return [{"id": id_, "document": text, "metadata": metadata} for id_, text, metadata in zip(ids, documents, metadatas)]
+
+
+def chunk(model_name: str, max_tokens: int, **sources):
+    chunker = TokenChunker(load_tokenizer(model_name), max_tokens=max_tokens)
+    for name in sorted(sources):
+        for record in sources[name]:
+            for c in chunker.chunk(record["id"], record["document"], record["metadata"]):
+                yield {"id": c.id, "document": c.text, "metadata": c.metadata}
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_function(model_name: str, chroma_path: str, workers: int) -> CachedEmbeddingFunction:
+    """The model wrapped in the on-disk embedding cache, loaded once for the embed and index stages."""
+    if workers > 1:
+        model_ef = ProcessPoolEmbeddingFunction(model_name=model_name, num_workers=workers)
+    else:
+        model_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+    return CachedEmbeddingFunction(model_ef, model_name=model_name, cache_dir=pathlib.Path(chroma_path) / EMBEDDING_CACHE_DIRNAME)
+
+
+def embed(chunk, model_name: str, chroma_path: str, workers: int, batch_size: int):
+    """Fill the embedding cache with the embeddings of every chunk (already cached ones are not recomputed)."""
+    embedding_func = get_embedding_function(model_name, chroma_path, workers)
+    documents = [record["document"] for record in chunk]
+    order = length_sorted_order(documents)
+    for batch in batched(order, batch_size):
+        with METRICS.span("embed_batch"):
+            embedding_func([documents[idx] for idx in batch])
+        METRICS.inc("embedded_docs", len(batch))
+    embedding_func.flush()
+    return embedding_func.stats()
+
+
+def index(chunk, embed, collection_name: str, hnsw: dict, model_name: str, chroma_path: str, workers: int, batch_size: int):
+    embedding_func = get_embedding_function(model_name, chroma_path, workers)
+    client = chromadb.PersistentClient(path=chroma_path)
+    hnsw_params = HNSWParams(**hnsw)
+    collection = client.get_or_create_collection(collection_name, embedding_function=embedding_func, metadata=hnsw_params.to_metadata("cosine"))
+    hnsw_params.apply(collection)
+    records = list(chunk)
+    return sync_collection(
+        collection,
+        manifest_path(pathlib.Path(chroma_path), collection.name),
+        [record["id"] for record in records],
+        [record["document"] for record in records],
+        [record["metadata"] for record in records],
+        embedding_func=embedding_func,
+        embedding_batch_size=batch_size,
+    )
+
+
+def lexical(chunk, collection_name: str, chroma_path: str):
+    """Sync the BM25 index used for hybrid search, keyed on the ids holding the section numbers."""
+    records = list(chunk)
+    path = bm25_path(pathlib.Path(chroma_path), collection_name)
+    bm25 = BM25Index.load(path)
+    nb_indexed, nb_deleted = bm25.sync([r["id"] for r in records], [r["document"] for r in records],
+                                       [r["metadata"]["parent_id"] for r in records])
+    bm25.save(path)
+    return {"indexed": nb_indexed, "deleted": nb_deleted}
+
+
+# Code the stages rely on besides their own function: changing it invalidates their cached output
+PAGE_SCRAPER_CODE = [utils.page_utils, utils.html_parser, utils.boilerplate]
+CODE_DEPS = {
+    "scrape_toc": [extract_toc, utils.html_parser],
+    "scrape_ipgs": [extract_ipgs, utils.htmltables_converter, *PAGE_SCRAPER_CODE],
+    "scrape_pages": [extract_canada_page, utils.crawler, utils.frontier, *PAGE_SCRAPER_CODE],
+    "clean": [create_database_with_specific_embeddings, utils.chromadb_utils.document_metadata],
+    "dedup": [utils.dedup],
+    "chunk": [utils.chunker],
+    "embed": [utils.embedding_cache],
+    "index": [utils.chromadb_utils],
+    "lexical": [utils.bm25],
+}
+
+
+def build_stages(args) -> list[Stage]:
+    scrape_max_age = args.max_age * 3600
+    records_io = {"save": save_records, "load": load_records}
+
+    stages = []
+    for name, (toc_url, full_page_url, prefix) in TOC_SOURCES.items():
+        stages.append(Stage(f"scrape_{name}", scrape_toc, params={"toc_url": toc_url, "full_page_url": full_page_url, "name": name,
+                                                                   "empty_section_number_prefix": prefix},
+                            max_age=scrape_max_age, code_deps=CODE_DEPS["scrape_toc"], **records_io))
+    stages.append(Stage("scrape_ipgs", scrape_ipgs, max_age=scrape_max_age, code_deps=CODE_DEPS["scrape_ipgs"], **records_io))
+    stages.append(Stage("scrape_pages", scrape_pages, params={"frontier_path": str(args.cache_dir / "pages_frontier.sqlite")},
+                        max_age=scrape_max_age, code_deps=CODE_DEPS["scrape_pages"], **records_io))
+
+    sources = list(TOC_SOURCES) + PAGE_SOURCES
+    for name in sources:
+        kind = "sections" if name in TOC_SOURCES else "pages"
+        # Streams into the next stage: no need to keep the cleaned records of a source
+        stages.append(Stage(f"clean_{name}", clean, deps=[f"scrape_{name}"], params={"kind": kind, "source": name}, lazy=True,
+                            code_deps=CODE_DEPS["clean"]))
+
+    model_params = {"model_name": MODEL_NAME, "chroma_path": str(args.chroma_path), "workers": args.embedding_workers,
+                    "batch_size": 32 * args.embedding_workers}
+    stages.append(Stage("dedup", dedup, deps=[f"clean_{name}" for name in PAGE_SOURCES],
+                        params={"threshold": args.dedup_threshold}, code_deps=CODE_DEPS["dedup"], **records_io))
+    stages.append(Stage("chunk", chunk, deps=[f"clean_{name}" for name in TOC_SOURCES] + ["dedup"],
+                        params={"model_name": MODEL_NAME, "max_tokens": args.max_tokens}, code_deps=CODE_DEPS["chunk"], **records_io))
+    stages.append(Stage("embed", embed, deps=["chunk"], params=model_params, code_deps=CODE_DEPS["embed"]))
+    stages.append(Stage("index", index, deps=["chunk", "embed"],
+                        params={"collection_name": COLLECTION_NAME, "hnsw": asdict(HNSW_PARAMS), **model_params},
+                        code_deps=CODE_DEPS["index"]))
+    stages.append(Stage("lexical", lexical, deps=["chunk"], params={"collection_name": COLLECTION_NAME, "chroma_path": str(args.chroma_path)},
+                        code_deps=CODE_DEPS["lexical"]))
+    return stages
+
+
+if __name__ == "__main__": # required to spawn the embedding worker processes
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", help="Stages to bring up to date (all by default)")
+    parser.add_argument("--force", nargs="+", default=[], help="Stages to re-run even if they are up to date")
+    parser.add_argument("--no-cache", action="store_true", help="Run every stage, handing records over in memory only")
+    parser.add_argument("--cache-dir", type=pathlib.Path, default=pathlib.Path("outputs/pipeline"))
+    parser.add_argument("--chroma-path", type=pathlib.Path, default=pathlib.Path("../chromadb_directory"))
+    parser.add_argument("--max-age", type=float, default=24, help="Hours after which the scraped sources are stale")
+    parser.add_argument("--dedup-threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD,
+                        help="Similarity above which pages are collapsed as near-duplicates")
+    parser.add_argument("--max-tokens", type=int, default=384, help="Max tokens per chunk (the model's max sequence length)")
+    parser.add_argument("--embedding-workers", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=4, help="Stages run in parallel")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    pipeline = Pipeline(build_stages(args), cache_dir=args.cache_dir, cache=not args.no_cache, max_workers=args.workers)
+    pipeline.run(args.targets, force=args.force)
+    logger.info("Metrics written to %s", ", ".join(map(str, METRICS.write_report("pipeline"))))
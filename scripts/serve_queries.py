@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+This script serves queries over the persistent collection built by create_database_with_specific_embeddings.py.
+It:
+  - Loads the embedding model once and keeps it warm
+  - Caches the embeddings of recent queries and coalesces concurrent queries into batched encodes and searches
+  - Searches the collection's HNSW index, or with SEARCH_BACKEND=exact an exact in-memory search over its
+    embeddings (faster and exact for collections of a few thousand vectors)
+  - Exposes POST /query ({"query": ..., "n_results": 3, "where": {"source": "clsr"}}) and GET /stats
+"""
+
+import os
+import pathlib
+
+import chromadb
+import uvicorn
+from chromadb.utils import embedding_functions
+
+from utils.exact_search import ExactSearchIndex
+from utils.query_service import QueryService, create_app
+
+CHROMA_PATH = pathlib.Path(os.environ.get("CHROMA_PATH", "../chromadb_directory"))
+COLLECTION_NAME = os.environ.get("COLLECTION_NAME", "Labour_Program_Feb132025")
+MODEL_NAME = "multi-qa-mpnet-base-dot-v1"
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "hnsw") # "hnsw" or "exact"
+
+if __name__ == "__main__":
+    client = chromadb.PersistentClient(path=str(CHROMA_PATH))
+    collection = client.get_collection(COLLECTION_NAME)
+    if SEARCH_BACKEND == "exact":
+        collection = ExactSearchIndex.from_collection(collection)
+    embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=MODEL_NAME)
+
+    app = create_app(QueryService(collection, embedding_func))
+    uvicorn.run(app, host=os.environ.get("HOST", "127.0.0.1"), port=int(os.environ.get("PORT", "8000")))
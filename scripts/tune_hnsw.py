@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+This script sweeps the HNSW parameters of a collection over a held-out query set, to pick the operating point of a deployment.
+It:
+  - Takes the embeddings of an existing collection (--collection), or of a synthetic corpus with a stub model (--synthetic N)
+  - Embeds the held-out queries: the sample queries of create_database_with_specific_embeddings.py plus the
+    lines of --queries-file (e.g. questions taken from the query logs)
+  - Builds one index per combination of the parameters (search_ef included: chromadb keeps the value an index
+    was loaded with for the lifetime of the process), recording its build time and memory (estimated from
+    hnswlib's memory layout)
+  - Queries every index and records its p50/p99 latency and recall@k against an exact search
+  - Prints the configuration with the lowest p99 latency among the ones reaching --target-recall, and writes
+    every result to --output
+Example:
+    python tune_hnsw.py --collection Labour_Program_Feb132025 --queries-file queries.txt --M 16 32 64 --search-ef 50 100 200
+"""
+
+import argparse
+import itertools
+import json
+import math
+import pathlib
+import tempfile
+import time
+import warnings
+
+import chromadb
+import numpy as np
+from chromadb.utils import embedding_functions
+
+from benchmark_query import QUERIES
+from utils.chromadb_utils import HNSWParams
+from utils.exact_search import ExactSearchIndex
+
+DEFAULT_M = 16  # chromadb's default, used for the memory estimate
+
+
+def index_memory(nb_vectors: int, dim: int, M: int = None) -> int:
+    """Bytes held by an hnswlib index: level 0 stores the vector, 2*M links and the label of every
+    element; about one element in M - 1 also has links on upper levels."""
+    M = M or DEFAULT_M
+    level0 = nb_vectors * (dim * 4 + 2 * M * 4 + 4 + 8)
+    upper_levels = math.ceil(nb_vectors / max(M - 1, 1)) * (M * 4 + 4)
+    return level0 + upper_levels
+
+
+def load_embeddings(args) -> tuple[ExactSearchIndex, np.ndarray]:
+    """The corpus (as an exact index, the ground truth) and the embeddings of the held-out queries."""
+    queries = list(QUERIES)
+    if args.queries_file:
+        with open(args.queries_file, "r", encoding="utf-8") as f:
+            queries.extend(line.strip() for line in f if line.strip())
+
+    if args.synthetic:
+        from benchmark_ingest import StubEmbeddingFunction, make_corpus
+
+        ids, documents, _ = make_corpus(args.synthetic)
+        embedding_func = StubEmbeddingFunction(dim=args.dim)
+        index = ExactSearchIndex(ids, embedding_func(documents), space=args.space)
+        # Queries close to documents of the corpus, as real questions are close to the passages answering them
+        rng = np.random.default_rng(0)
+        base = index.embeddings[rng.choice(len(ids), size=max(len(queries), args.synthetic_queries))]
+        query_embeddings = base + rng.standard_normal(base.shape, dtype=np.float32) * np.linalg.norm(base, axis=1, keepdims=True) / np.sqrt(args.dim)
+    else:
+        collection = chromadb.PersistentClient(path=str(args.chroma_path)).get_collection(args.collection)
+        index = ExactSearchIndex.from_collection(collection)
+        embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=args.model)
+        query_embeddings = np.asarray(embedding_func(queries), dtype=np.float32)
+    return index, query_embeddings
+
+
+def build(index: ExactSearchIndex, params: HNSWParams, chroma_path: str):
+    client = chromadb.PersistentClient(path=chroma_path)
+    collection = client.create_collection("hnsw-tuning", metadata=params.to_metadata(index.space))
+    start = time.perf_counter()
+    batch_size = client.get_max_batch_size()
+    for idx in range(0, len(index.ids), batch_size):
+        collection.add(ids=index.ids[idx : idx + batch_size], embeddings=index.embeddings[idx : idx + batch_size])
+    return collection, time.perf_counter() - start
+
+
+def measure(collection, index: ExactSearchIndex, queries: np.ndarray, k: int, repeats: int) -> dict:
+    expected = index.query(queries, n_results=k, include=[])["ids"]
+    found, latencies = [], []
+    for repeat in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            result = collection.query(query_embeddings=[query], n_results=k, include=[])
+            latencies.append(time.perf_counter() - start)
+            if repeat == 0:
+                found.append(result["ids"][0])
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return {
+        "recall": hits / sum(len(e) for e in expected),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="Labour_Program_Feb132025")
+    parser.add_argument("--chroma-path", type=pathlib.Path, default=pathlib.Path("../chromadb_directory"))
+    parser.add_argument("--model", default="multi-qa-mpnet-base-dot-v1")
+    parser.add_argument("--queries-file", help="Held-out queries, one per line")
+    parser.add_argument("--synthetic", type=int, help="Sweep over a synthetic corpus of this many documents instead")
+    parser.add_argument("--synthetic-queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of the synthetic embeddings")
+    parser.add_argument("--space", default="cosine", choices=["cosine", "ip", "l2"], help="Distance of the synthetic corpus")
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--M", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--num-threads", type=int, nargs="+", default=[None])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[None])
+    parser.add_argument("--sync-threshold", type=int, nargs="+", default=[None])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=20, help="Passes over the queries when measuring latency")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--output", type=pathlib.Path, default=pathlib.Path("outputs/hnsw_tuning.json"))
+    args = parser.parse_args()
+
+    index, queries = load_embeddings(args)
+    dim = index.embeddings.shape[1]
+    print(f"{index.count()} vectors of dimension {dim} ({index.space}), {len(queries)} queries, recall@{args.k}\n")
+
+    header = f"{'construction_ef':>15} {'M':>4} {'threads':>7} {'batch':>6} {'sync':>6} {'build s':>8} {'MiB':>7} {'search_ef':>9} {'recall':>7} {'p50 ms':>7} {'p99 ms':>7}"
+    print(header)
+    results = []
+    for construction_ef, M, num_threads, batch_size, sync_threshold, search_ef in itertools.product(
+        args.construction_ef, args.M, args.num_threads, args.batch_size, args.sync_threshold, args.search_ef
+    ):
+        params = HNSWParams(construction_ef, M, search_ef, num_threads, batch_size, sync_threshold)
+        with tempfile.TemporaryDirectory() as chroma_path:
+            collection, build_seconds = build(index, params, chroma_path)
+            memory = index_memory(index.count(), dim, M)
+            result = {**vars(params), "build_seconds": build_seconds, "memory_bytes": memory,
+                      **measure(collection, index, queries, args.k, args.repeats)}
+        results.append(result)
+        print(f"{construction_ef:>15} {M:>4} {str(num_threads):>7} {str(batch_size):>6} {str(sync_threshold):>6} "
+              f"{build_seconds:>8.2f} {memory / 2**20:>7.1f} {search_ef:>9} {result['recall']:>7.4f} "
+              f"{result['p50_ms']:>7.2f} {result['p99_ms']:>7.2f}")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"vectors": index.count(), "dim": dim, "space": index.space, "k": args.k, "results": results}, f, indent=1)
+
+    eligible = [result for result in results if result["recall"] >= args.target_recall]
+    if eligible:
+        best = min(eligible, key=lambda result: result["p99_ms"])
+        chosen = {name: best[name] for name in vars(HNSWParams()) if best[name] is not None}
+        print(f"\nLowest p99 latency with recall >= {args.target_recall}: {chosen} "
+              f"(recall {best['recall']:.4f}, p99 {best['p99_ms']:.2f} ms)")
+        print("Set it with " + " ".join(f"HNSW_{name.upper()}={value}" for name, value in chosen.items()))
+    else:
+        print(f"\nNo configuration reaches a recall of {args.target_recall}, widen the sweep (higher M, construction_ef or search_ef)")
+    print(f"Results written to {args.output}")
@@ -0,0 +1,208 @@
+import hashlib
+import heapq
+import math
+import pickle
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.exact_search import matches
+from utils.metrics import METRICS
+
+BM25_SUFFIX = ".bm25.pkl"
+DEFAULT_RRF_K = 60  # rank constant of reciprocal rank fusion (the value of the original paper)
+
+# Section numbers ("206.1", "206-1" in the ids) are kept whole, with dashes read as dots
+TOKEN = re.compile(r"\d+(?:[.\-]\d+)*|[^\W\d_]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how if in is it its may must of on or shall should "
+    "that the their there this to under what when where which who will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token.replace("-", ".") for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def bm25_path(chroma_path: Path, collection_name: str) -> Path:
+    """The BM25 index of a collection is stored next to it, in the chroma directory"""
+    return Path(chroma_path) / f"{collection_name}{BM25_SUFFIX}"
+
+
+class BM25Index:
+    """In-process inverted index scoring documents with Okapi BM25.
+
+    Postings map every term to the term frequency of the documents containing it, so a query
+    only visits the documents sharing a term with it. `keywords` (e.g. the id of the section,
+    which holds its number) are indexed `keyword_boost` times on top of the text, so that
+    asking for "section 206.1" ranks that section first.
+
+    The index is updated in place: `sync` only re-indexes the documents whose content changed
+    and drops the ids that disappeared, like `sync_collection` does for the collection."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, keyword_boost: int = 3) -> None:
+        self.k1 = k1
+        self.b = b
+        self.keyword_boost = keyword_boost
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.ids: List[Optional[str]] = []  # slot -> id (None for free slots)
+        self.lengths: List[int] = []
+        self.terms: List[Tuple[str, ...]] = []  # distinct terms of every slot, to remove it
+        self.hashes: List[Optional[str]] = []
+        self.slots: Dict[str, int] = {}
+        self.free_slots: List[int] = []
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @staticmethod
+    def _hash(text: str, keywords: str) -> str:
+        return hashlib.sha256(f"{keywords}\0{text}".encode("utf-8")).hexdigest()
+
+    def add(self, id_: str, text: str, keywords: str = "") -> None:
+        """Index a document, replacing the one with the same id if any."""
+        if id_ in self.slots:
+            self.delete([id_])
+        counts = Counter(tokenize(text))
+        for token in tokenize(keywords):
+            counts[token] += self.keyword_boost
+
+        slot = self.free_slots.pop() if self.free_slots else len(self.ids)
+        if slot == len(self.ids):
+            self.ids.append(None)
+            self.lengths.append(0)
+            self.terms.append(())
+            self.hashes.append(None)
+        self.ids[slot], self.lengths[slot], self.terms[slot] = id_, sum(counts.values()), tuple(counts)
+        self.hashes[slot] = self._hash(text, keywords)
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[slot] = count
+        self.slots[id_] = slot
+        self.total_length += self.lengths[slot]
+
+    def delete(self, ids: Sequence[str]) -> None:
+        for id_ in ids:
+            slot = self.slots.pop(id_, None)
+            if slot is None:
+                continue
+            for term in self.terms[slot]:
+                postings = self.postings[term]
+                del postings[slot]
+                if not postings:
+                    del self.postings[term]
+            self.total_length -= self.lengths[slot]
+            self.ids[slot], self.lengths[slot], self.terms[slot], self.hashes[slot] = None, 0, (), None
+            self.free_slots.append(slot)
+
+    def sync(self, ids: Sequence[str], documents: Sequence[str], keywords: Sequence[str] = None) -> Tuple[int, int]:
+        """Bring the index in line with the given corpus; returns the number of documents
+        (re-)indexed and deleted."""
+        keywords = keywords if keywords is not None else [""] * len(ids)
+        corpus_ids = set(ids)
+        removed = [id_ for id_ in self.slots if id_ not in corpus_ids]
+        self.delete(removed)
+
+        nb_indexed = 0
+        with METRICS.span("bm25_sync"):
+            for id_, text, words in zip(ids, documents, keywords):
+                slot = self.slots.get(id_)
+                if slot is None or self.hashes[slot] != self._hash(text, words):
+                    self.add(id_, text, words)
+                    nb_indexed += 1
+        METRICS.inc("bm25_indexed_docs", nb_indexed)
+        return nb_indexed, len(removed)
+
+    def search(self, query: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """(id, score) of the best matching documents, best first."""
+        if not self.slots:
+            return []
+        nb_docs = len(self.slots)
+        avg_length = self.total_length / nb_docs
+        scores: Dict[int, float] = {}
+        with METRICS.span("bm25_search"):
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (nb_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for slot, count in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[slot] / avg_length)
+                    scores[slot] = scores.get(slot, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+            best = heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+        return [(self.ids[slot], score) for slot, score in best]
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "BM25Index":
+        """The index saved at `path`, or a new empty one (built with `kwargs`) if there is none."""
+        path = Path(path)
+        if not path.exists():
+            return cls(**kwargs)
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = DEFAULT_RRF_K, weights: Sequence[float] = None) -> List[Tuple[str, float]]:
+    """Fuse ranked lists of ids: every id scores sum(weight / (k + rank)) over the lists it is in.
+    Only ranks are used, so scores of different scales (BM25, distances) need no calibration."""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] = scores.get(id_, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridSearch:
+    """Vector search on a collection fused with BM25 search, by reciprocal rank fusion.
+
+    Both sides retrieve `candidates` hits per query (at least `n_results`); the fused top
+    `n_results` come back in the shape of `Collection.query`, with the fused `scores` and
+    the vector `distances` (None for the hits only found by BM25). A `where` filter is
+    passed to the collection and checked on the metadata of the BM25 hits."""
+
+    def __init__(self, collection, bm25: BM25Index, candidates: int = 20, rrf_k: int = DEFAULT_RRF_K,
+                 weights: Tuple[float, float] = (1.0, 1.0)) -> None:
+        self.collection = collection
+        self.bm25 = bm25
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.weights = weights
+
+    def query(self, query_texts: List[str], n_results: int = 10, where: dict = None, query_embeddings=None) -> dict:
+        nb_candidates = max(self.candidates, n_results)
+        vector_args = {"query_embeddings": query_embeddings} if query_embeddings is not None else {"query_texts": query_texts}
+        with METRICS.span("hybrid_search"):
+            vector = self.collection.query(**vector_args, n_results=nb_candidates, where=where,
+                                           include=["documents", "metadatas", "distances"])
+            lexical = [[id_ for id_, _ in self.bm25.search(text, nb_candidates)] for text in query_texts]
+
+            # Documents and metadata of the hits only found by BM25
+            known = {}
+            for ids, documents, metadatas in zip(vector["ids"], vector["documents"], vector["metadatas"]):
+                known.update(zip(ids, zip(documents, metadatas)))
+            missing = list({id_ for ids in lexical for id_ in ids if id_ not in known})
+            if missing:
+                fetched = self.collection.get(ids=missing, include=["documents", "metadatas"])
+                known.update(zip(fetched["ids"], zip(fetched["documents"], fetched["metadatas"])))
+
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "scores": []}
+            for vector_ids, distances, lexical_ids in zip(vector["ids"], vector["distances"], lexical):
+                # (ids missing from the collection were deleted since the BM25 index was saved)
+                lexical_ids = [id_ for id_ in lexical_ids if id_ in known and (not where or matches(known[id_][1], where))]
+                fused = reciprocal_rank_fusion([vector_ids, lexical_ids], self.rrf_k, self.weights)[:n_results]
+                vector_distances = dict(zip(vector_ids, distances))
+                results["ids"].append([id_ for id_, _ in fused])
+                results["documents"].append([known[id_][0] for id_, _ in fused])
+                results["metadatas"].append([known[id_][1] for id_, _ in fused])
+                results["distances"].append([vector_distances.get(id_) for id_, _ in fused])
+                results["scores"].append([score for _, score in fused])
+        return results
@@ -0,0 +1,93 @@
+import logging
+import re
+from collections import Counter
+from itertools import chain, islice
+from typing import Iterable, Iterator, List
+
+from utils.chunker import RegexTokenizer
+from utils.metrics import METRICS
+from utils.page_utils import Page
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_PAGES = 5
+DEFAULT_MIN_FRACTION = 0.1
+DEFAULT_SAMPLE_SIZE = 500  # pages held in memory to learn the boilerplate from
+
+DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def block_key(block: str) -> str:
+    """Key under which a block is counted: lower-cased, dates masked, so that blocks only
+    differing by a date (e.g. "Date modified: 2024-05-01") are counted together."""
+    return DATE.sub("0000-00-00", block.lower())
+
+
+def count_tokens(text: str) -> int:
+    return len(RegexTokenizer.TOKEN.findall(text))
+
+
+class BoilerplateRemover:
+    """Learns the text blocks repeated across a corpus of pages (footers, "Report a problem",
+    share widgets, related links...) and strips them from the pages.
+
+    A block is boilerplate when it is found in at least `min_pages` pages and in at least
+    `min_fraction` of the pages of the corpus it was learned from."""
+
+    def __init__(self, min_pages: int = DEFAULT_MIN_PAGES, min_fraction: float = DEFAULT_MIN_FRACTION) -> None:
+        self.min_pages = min_pages
+        self.min_fraction = min_fraction
+        self.page_counts: Counter = Counter()
+        self.nb_pages = 0
+
+    def fit(self, pages_blocks: Iterable[List[str]]) -> "BoilerplateRemover":
+        for blocks in pages_blocks:
+            self.page_counts.update({block_key(block) for block in blocks})
+            self.nb_pages += 1
+        return self
+
+    def is_boilerplate(self, block: str) -> bool:
+        count = self.page_counts[block_key(block)]
+        return count >= self.min_pages and count >= self.min_fraction * self.nb_pages
+
+    def strip(self, blocks: List[str]) -> List[str]:
+        return [block for block in blocks if not self.is_boilerplate(block)]
+
+
+def remove_boilerplate(pages: Iterable[Page], remover: BoilerplateRemover = None, name: str = "pages",
+                       sample_size: int = DEFAULT_SAMPLE_SIZE) -> Iterator[Page]:
+    """Yield the pages with their text rewritten without the boilerplate, learned from the
+    `blocks` of the first `sample_size` pages. Only that sample is held in memory: the pages
+    after it are stripped as they stream through, with the boilerplate learned from the
+    sample (so the writers downstream keep a flat memory). Blocks are dropped once a page is
+    stripped, and pages left without text are skipped. Logs and records (as metrics) the
+    tokens saved. Pages without blocks are yielded as they are."""
+    remover = remover or BoilerplateRemover()
+    pages = iter(pages)
+    sample = list(islice(pages, sample_size))
+    remover.fit(page.blocks for page in sample if page.blocks is not None)
+
+    tokens_before = tokens_after = blocks_removed = nb_stripped = nb_emptied = 0
+    for page in chain(sample, pages):
+        if page.blocks is not None:
+            kept = remover.strip(page.blocks)
+            blocks_removed += len(page.blocks) - len(kept)
+            tokens_before += count_tokens(page.text)
+            page.text = " ".join(kept)
+            page.blocks = None
+            tokens_after += count_tokens(page.text)
+            nb_stripped += 1
+            if not page.text:
+                nb_emptied += 1
+                continue
+        yield page
+
+    METRICS.inc("boilerplate_blocks_removed", blocks_removed, output=name)
+    METRICS.inc("boilerplate_tokens_saved", tokens_before - tokens_after, output=name)
+    METRICS.inc("boilerplate_empty_pages", nb_emptied, output=name)
+    logger.info(
+        "Removed %d boilerplate blocks (learned from %d pages) from %d %s: %d of %d tokens saved (%.1f%%), "
+        "%d pages left empty and skipped",
+        blocks_removed, remover.nb_pages, nb_stripped, name, tokens_before - tokens_after, tokens_before,
+        100 * (tokens_before - tokens_after) / tokens_before if tokens_before else 0.0, nb_emptied,
+    )
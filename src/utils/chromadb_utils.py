@@ -1,8 +1,107 @@
+import hashlib
+import json
+import logging
+import os
 import pathlib
+import queue
+import re
+import threading
+from dataclasses import asdict, dataclass, field, fields
+from typing import Iterable, Optional
+
 import chromadb
+from chromadb.api.types import EmbeddingFunction
 from chromadb.utils import embedding_functions
 from more_itertools import batched
 
+from utils.chunker import length_sorted_order
+from utils.embedding_cache import DEFAULT_MAX_ENTRIES, CachedEmbeddingFunction
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SUFFIX = ".manifest.json"
+EMBEDDING_CACHE_DIRNAME = "embedding_cache"
+DEFAULT_EMBEDDING_BATCH_SIZE = 64  # sized for CPU throughput, independently from the insert batches
+HNSW_ENV_PREFIX = "HNSW_"
+
+# Metadata of every record: one fixed set of keys, so that queries can filter on them
+METADATA_FIELDS = ("source", "title", "url", "section_number", "part", "hierarchy", "hierarchy_1", "hierarchy_2",
+                   "hierarchy_3", "content_hash")
+HIERARCHY_LEVELS = 3
+PART = re.compile(r"^part\s+([ivxlc]+)\b", re.IGNORECASE)  # "PART III" in the tables of contents of Justice Laws
+
+
+@dataclass
+class HNSWParams:
+    """Parameters of the HNSW index of a collection (None leaves chromadb's default).
+
+    `construction_ef` and `M` (neighbours per node) trade build time and memory for recall
+    and are fixed once the collection is created. `search_ef` trades query latency for
+    recall; it can be changed on an existing collection, like `num_threads`, `batch_size`
+    (vectors buffered before being added to the index) and `sync_threshold` (vectors added
+    before the index is persisted). Changes apply when the index is loaded: a process that
+    already queried the collection keeps the previous values."""
+
+    construction_ef: Optional[int] = None
+    M: Optional[int] = None
+    search_ef: Optional[int] = None
+    num_threads: Optional[int] = None
+    batch_size: Optional[int] = None
+    sync_threshold: Optional[int] = None
+
+    # Parameters that can be changed after creation, with their name in the collection configuration
+    RUNTIME_PARAMS = {"search_ef": "ef_search", "num_threads": "num_threads", "batch_size": "batch_size", "sync_threshold": "sync_threshold"}
+
+    @classmethod
+    def from_env(cls, prefix: str = HNSW_ENV_PREFIX) -> "HNSWParams":
+        """Parameters set in the environment, e.g. HNSW_M=32 or HNSW_SEARCH_EF=200."""
+        values = {}
+        for param in fields(cls):
+            value = os.environ.get(f"{prefix}{param.name.upper()}")
+            if value:
+                values[param.name] = int(value)
+        return cls(**values)
+
+    def to_metadata(self, distance_func_name: str = "cosine") -> dict:
+        """Collection metadata setting the distance and the parameters given."""
+        metadata = {"hnsw:space": distance_func_name}
+        metadata.update({f"hnsw:{name}": value for name, value in asdict(self).items() if value is not None})
+        return metadata
+
+    def apply(self, collection) -> None:
+        """Set the runtime parameters given on an existing collection (the others are fixed at creation),
+        before it is queried."""
+        hnsw = {key: getattr(self, name) for name, key in self.RUNTIME_PARAMS.items() if getattr(self, name) is not None}
+        if hnsw:
+            collection.modify(configuration={"hnsw": hnsw})
+
+
+def document_metadata(source: str, title: str, url: str, section_number: str = "", hierarchy: Iterable[str] = ()) -> dict:
+    """Metadata of a document in the fixed schema (`content_hash` is added when it is written).
+
+    `source` is the output it comes from (clc, clsr, ipgs, pages). The first levels of its
+    hierarchy get their own key and `part` holds the part named by the first level naming
+    one, in a canonical form ("PART III" is stored as "Part III"), so that queries can be
+    scoped with e.g. `where={"source": "clc", "part": "Part III"}`."""
+    hierarchy = [level for level in hierarchy if level]
+    metadata = {
+        "source": source,
+        "title": title,
+        "url": url,
+        "section_number": section_number.replace("-", "."),  # as cited, "206.1" (extract_toc uses dashes)
+        "part": next((f"Part {match.group(1).upper()}" for match in map(PART.match, hierarchy) if match), ""),
+        "hierarchy": " / ".join(hierarchy),
+    }
+    for level in range(HIERARCHY_LEVELS):
+        metadata[f"hierarchy_{level + 1}"] = hierarchy[level] if level < len(hierarchy) else ""
+    return metadata
+
+
+def with_content_hash(documents: list[str], metadatas: list[dict]) -> list[dict]:
+    """The metadatas with the hash of their document as `content_hash`."""
+    return [{**metadata, "content_hash": content_hash(document)} for document, metadata in zip(documents, metadatas)]
+
 
 def build_chroma_collection(
     chroma_path: pathlib.Path,
@@ -12,31 +111,277 @@ def build_chroma_collection(
     documents: list[str],
     metadatas: list[dict],
     distance_func_name: str = "cosine",
+    embedding_cache_dir: pathlib.Path = None,
+    embedding_cache_max_entries: int = DEFAULT_MAX_ENTRIES,
+    embedding_function: EmbeddingFunction = None,
+    embedding_batch_size: int = DEFAULT_EMBEDDING_BATCH_SIZE,
+    hnsw_params: HNSWParams = None,
 ):
-    """Create a ChromaDB collection"""
+    """Create a ChromaDB collection.
+    Embeddings are cached on disk (by default next to the collections) so that rebuilding
+    a collection over the same texts with the same model does not embed them again.
+    `embedding_function` replaces the SentenceTransformer model named `embedding_func_name`
+    when given (the name is still used as the cache key). `hnsw_params` tunes the index."""
 
     chroma_client = chromadb.PersistentClient(chroma_path)
 
-    embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=embedding_func_name
+    embedding_func = CachedEmbeddingFunction(
+        embedding_function
+        or embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=embedding_func_name
+        ),
+        model_name=embedding_func_name,
+        cache_dir=embedding_cache_dir or pathlib.Path(chroma_path) / EMBEDDING_CACHE_DIRNAME,
+        max_entries=embedding_cache_max_entries,
     )
 
     collection = chroma_client.create_collection(
         name=collection_name,
         embedding_function=embedding_func,
-        metadata={"hnsw:space": distance_func_name},
+        metadata=(hnsw_params or HNSWParams()).to_metadata(distance_func_name),
+    )
+
+    pipelined_insert(
+        collection.add,
+        embedding_func,
+        ids,
+        documents,
+        with_content_hash(documents, metadatas),
+        insert_batch_size=chroma_client.get_max_batch_size(),
+        embedding_batch_size=embedding_batch_size,
     )
 
-    document_indices = list(range(len(documents)))
+    embedding_func.flush()
+    logger.info("Embedding cache: %s", embedding_func.stats())
+    return collection
+
+
+def pipelined_insert(
+    write,
+    embedding_func: EmbeddingFunction,
+    ids: list[str],
+    documents: list[str],
+    metadatas: list[dict],
+    insert_batch_size: int,
+    embedding_batch_size: int = DEFAULT_EMBEDDING_BATCH_SIZE,
+    prefetch: int = 2,
+    sort_by_length: bool = True,
+) -> int:
+    """Embed and write documents in a producer/consumer pipeline.
+
+    A background thread embeds the documents `embedding_batch_size` at a time and hands
+    them over in insert batches of `insert_batch_size`, while the calling thread writes
+    the previous batch with `write` (e.g. `collection.add` or `collection.upsert`). At most
+    `prefetch` embedded batches wait in the queue. Documents are sorted by length first
+    (unless `sort_by_length` is False) so that every embedding batch holds texts of similar
+    lengths. Returns the number of documents written."""
+
+    if sort_by_length:
+        order = length_sorted_order(documents)
+        ids = [ids[idx] for idx in order]
+        documents = [documents[idx] for idx in order]
+        metadatas = [metadatas[idx] for idx in order]
+
+    batches = queue.Queue(maxsize=prefetch)
+    done = object()
+
+    def produce():
+        try:
+            for batch in batched(range(len(documents)), insert_batch_size):
+                start_idx, end_idx = batch[0], batch[-1] + 1
+                embeddings = []
+                for sub_batch in batched(documents[start_idx:end_idx], embedding_batch_size):
+                    with METRICS.span("embed_batch"):
+                        embeddings.extend(embedding_func(list(sub_batch)))
+                    METRICS.inc("embedded_docs", len(sub_batch))
+                batches.put((start_idx, end_idx, embeddings))
+            batches.put(done)
+        except Exception as e:
+            batches.put(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    nb_written = 0
+    while (item := batches.get()) is not done:
+        if isinstance(item, Exception):
+            raise item
+        start_idx, end_idx, embeddings = item
+        with METRICS.span("insert_batch"):
+            write(
+                ids=ids[start_idx:end_idx],
+                documents=documents[start_idx:end_idx],
+                metadatas=metadatas[start_idx:end_idx],
+                embeddings=embeddings,
+            )
+        METRICS.inc("inserted_docs", end_idx - start_idx)
+        nb_written += end_idx - start_idx
+
+    producer.join()
+    return nb_written
+
 
-    for batch in batched(
-        document_indices, 166
-    ):  # 166 is the maximum batch size supported by Chromadb
-        start_idx = batch[0]
-        end_idx = batch[-1]
+@dataclass
+class ManifestDiff:
+    """Ids of a corpus grouped by what needs to happen to them in the collection."""
 
-        collection.add(
-            ids=ids[start_idx:end_idx],
-            documents=documents[start_idx:end_idx],
-            metadatas=metadatas[start_idx:end_idx],
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    metadata_changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    unchanged: list[str] = field(default_factory=list)
+
+
+def content_hash(content) -> str:
+    """Hash a document (str) or a metadata dict in a stable way"""
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def manifest_path(chroma_path: pathlib.Path, collection_name: str) -> pathlib.Path:
+    """The manifest of a collection is stored next to it, in the chroma directory"""
+    return pathlib.Path(chroma_path) / f"{collection_name}{MANIFEST_SUFFIX}"
+
+
+def load_manifest(path: pathlib.Path) -> dict:
+    path = pathlib.Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(path: pathlib.Path, manifest: dict) -> None:
+    path = pathlib.Path(path)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    tmp_path.replace(path)
+
+
+def build_manifest(ids: list[str], documents: list[str], metadatas: list[dict]) -> dict:
+    return {
+        id_: {"document": content_hash(doc), "metadata": content_hash(meta)}
+        for id_, doc, meta in zip(ids, documents, metadatas)
+    }
+
+
+def diff_manifest(old: dict, new: dict) -> ManifestDiff:
+    diff = ManifestDiff(removed=[id_ for id_ in old if id_ not in new])
+
+    for id_, hashes in new.items():
+        previous = old.get(id_)
+        if previous is None:
+            diff.added.append(id_)
+        elif previous["document"] != hashes["document"]:
+            diff.changed.append(id_)
+        elif previous["metadata"] != hashes["metadata"]:
+            diff.metadata_changed.append(id_)
+        else:
+            diff.unchanged.append(id_)
+
+    return diff
+
+
+def stored_manifest(collection, ids: list[str], batch_size: int) -> dict:
+    """Manifest entries of records of the collection, rebuilt from their stored metadata (records
+    written without a `content_hash` get an empty document hash, so they are embedded again)."""
+    manifest = {}
+    for batch in batched(ids, batch_size):
+        stored = collection.get(ids=list(batch), include=["metadatas"])
+        for id_, metadata in zip(stored["ids"], stored["metadatas"]):
+            metadata = metadata or {}
+            manifest[id_] = {"document": metadata.get("content_hash", ""), "metadata": content_hash(metadata)}
+    return manifest
+
+
+def reconcile_manifest(collection, manifest: dict, batch_size: int) -> dict:
+    """The manifest restricted to the ids the collection actually holds (ids it lost are added
+    again), completed with the records it does not know of, e.g. when the manifest is missing
+    or the collection was built before it existed (they are verified from their metadata)."""
+    stored_ids = collection.get(include=[])["ids"]
+    reconciled = {id_: manifest[id_] for id_ in stored_ids if id_ in manifest}
+    unknown = [id_ for id_ in stored_ids if id_ not in manifest]
+    if unknown:
+        logger.info("%s holds %d records missing from its manifest, verifying them", collection.name, len(unknown))
+        reconciled.update(stored_manifest(collection, unknown, batch_size))
+    return reconciled
+
+
+def clear_stale_keys(collection, ids: list[str], metadatas: list[dict], positions: dict, batch_size: int) -> list[dict]:
+    """The metadatas with the keys that the stored records of `ids` have and their new
+    metadata lacks set to None, which deletes them when the records are written."""
+    metadatas = list(metadatas)
+    for batch in batched(ids, batch_size):
+        stored = collection.get(ids=list(batch), include=["metadatas"])
+        for id_, old in zip(stored["ids"], stored["metadatas"]):
+            new = metadatas[positions[id_]]
+            stale = [key for key in old or {} if key not in new]
+            if stale:
+                metadatas[positions[id_]] = {**new, **dict.fromkeys(stale)}
+    return metadatas
+
+
+def sync_collection(
+    collection,
+    path: pathlib.Path,
+    ids: list[str],
+    documents: list[str],
+    metadatas: list[dict],
+    batch_size: int = 166,
+    embedding_func: EmbeddingFunction = None,
+    embedding_batch_size: int = DEFAULT_EMBEDDING_BATCH_SIZE,
+) -> ManifestDiff:
+    """Bring a collection in line with the given corpus, embedding only what changed.
+
+    The manifest at `path` records a content hash per id from the last sync; it is reconciled
+    with the ids of the collection first, so records the collection lost are added again and
+    records the manifest does not know of are verified (or deleted). New and changed documents are upserted (and embedded), documents whose metadata only
+    changed are updated without being embedded again, and ids that disappeared from
+    the corpus are deleted. The manifest is only rewritten once the collection is synced.
+    When `embedding_func` is given, new and changed documents go through `pipelined_insert`.
+    Metadata gets the `content_hash` of its document, and the keys a record no longer has
+    are removed from it (chromadb merges the metadata of updated records)."""
+
+    metadatas = with_content_hash(documents, metadatas)
+    new_manifest = build_manifest(ids, documents, metadatas)
+    diff = diff_manifest(reconcile_manifest(collection, load_manifest(path), batch_size), new_manifest)
+    positions = {id_: idx for idx, id_ in enumerate(ids)}
+    metadatas = clear_stale_keys(collection, diff.changed + diff.metadata_changed, metadatas, positions, batch_size)
+
+    to_upsert = diff.added + diff.changed
+    if embedding_func is not None:
+        pipelined_insert(
+            collection.upsert,
+            embedding_func,
+            to_upsert,
+            [documents[positions[id_]] for id_ in to_upsert],
+            [metadatas[positions[id_]] for id_ in to_upsert],
+            insert_batch_size=batch_size,
+            embedding_batch_size=embedding_batch_size,
+        )
+    else:
+        for batch in batched(to_upsert, batch_size):
+            collection.upsert(
+                ids=list(batch),
+                documents=[documents[positions[id_]] for id_ in batch],
+                metadatas=[metadatas[positions[id_]] for id_ in batch],
+            )
+
+    for batch in batched(diff.metadata_changed, batch_size):
+        collection.update(
+            ids=list(batch),
+            metadatas=[metadatas[positions[id_]] for id_ in batch],
         )
+
+    for batch in batched(diff.removed, batch_size):
+        collection.delete(ids=list(batch))
+
+    save_manifest(path, new_manifest)
+    logger.info(
+        "Synced %s: %d added, %d changed, %d metadata updated, %d removed, %d unchanged",
+        collection.name, len(diff.added), len(diff.changed), len(diff.metadata_changed),
+        len(diff.removed), len(diff.unchanged),
+    )
+    return diff
@@ -0,0 +1,106 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple
+
+DEFAULT_MAX_TOKENS = 384
+DEFAULT_OVERLAP_TOKENS = 64
+
+
+@dataclass
+class Chunk:
+    id: str
+    parent_id: str
+    index: int
+    text: str
+    metadata: dict
+
+
+class RegexTokenizer:
+    """Fallback tokenizer splitting words and punctuation, a close enough estimate of the
+    number of tokens when the model's own tokenizer is not available."""
+
+    TOKEN = re.compile(r"\w+|[^\w\s]")
+
+    def token_spans(self, text: str) -> List[Tuple[int, int]]:
+        return [match.span() for match in self.TOKEN.finditer(text)]
+
+
+class HFTokenizer:
+    """Token spans from a HuggingFace fast tokenizer (the one the embedding model uses)."""
+
+    def __init__(self, tokenizer) -> None:
+        self.tokenizer = tokenizer
+
+    def token_spans(self, text: str) -> List[Tuple[int, int]]:
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return [tuple(span) for span in encoding["offset_mapping"]]
+
+
+def load_tokenizer(model_name: str):
+    """Load the tokenizer of a SentenceTransformer model, or the regex fallback if transformers is missing."""
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        return RegexTokenizer()
+
+    if "/" not in model_name:
+        model_name = f"sentence-transformers/{model_name}"
+    return HFTokenizer(AutoTokenizer.from_pretrained(model_name))
+
+
+class TokenChunker:
+    """Splits documents into windows of at most `max_tokens` tokens, overlapping by `overlap_tokens`.
+
+    Chunks keep the original text between their first and last token. Their ids are stable
+    (`<parent id>#<chunk index>`) and their metadata is the one of the parent document plus
+    `parent_id`, `chunk_index`, `chunk_count` and `token_count`."""
+
+    def __init__(self, tokenizer=None, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS) -> None:
+        if overlap_tokens >= max_tokens:
+            raise ValueError(f"overlap_tokens ({overlap_tokens}) must be smaller than max_tokens ({max_tokens})")
+        self.tokenizer = tokenizer or RegexTokenizer()
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def chunk(self, parent_id: str, text: str, metadata: dict = None) -> List[Chunk]:
+        spans = self.tokenizer.token_spans(text)
+        step = self.max_tokens - self.overlap_tokens
+
+        windows = []
+        for start in range(0, max(len(spans), 1), step):
+            windows.append((start, min(start + self.max_tokens, len(spans))))
+            if start + self.max_tokens >= len(spans):
+                break
+
+        chunks = []
+        for index, (start, end) in enumerate(windows):
+            chunk_text = text[spans[start][0] : spans[end - 1][1]] if spans else text
+            chunk_metadata = dict(metadata or {})
+            chunk_metadata.update(
+                parent_id=parent_id,
+                chunk_index=index,
+                chunk_count=len(windows),
+                token_count=end - start,
+            )
+            chunks.append(Chunk(f"{parent_id}#{index}", parent_id, index, chunk_text, chunk_metadata))
+        return chunks
+
+    def chunk_corpus(
+        self, ids: Iterable[str], documents: Iterable[str], metadatas: Iterable[dict]
+    ) -> Iterator[Chunk]:
+        for parent_id, text, metadata in zip(ids, documents, metadatas):
+            yield from self.chunk(parent_id, text, metadata)
+
+
+def chunk_corpus(
+    ids: List[str], documents: List[str], metadatas: List[dict], chunker: TokenChunker
+) -> Tuple[List[str], List[str], List[dict]]:
+    """Chunk a corpus given as columns and return the columns of the chunks"""
+    chunks = list(chunker.chunk_corpus(ids, documents, metadatas))
+    return [c.id for c in chunks], [c.text for c in chunks], [c.metadata for c in chunks]
+
+
+def length_sorted_order(documents: List[str]) -> List[int]:
+    """Positions of the documents sorted by length, so that embedding batches hold texts
+    of similar lengths and waste little compute on padding."""
+    return sorted(range(len(documents)), key=lambda idx: len(documents[idx]))
@@ -0,0 +1,103 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import requests
+
+from utils.frontier import CrawlFrontier
+from utils.http_cache import create_session
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CrawlTask:
+    """A unit of work for the crawl engine.
+
+    `order` is the path of child indices from the seed; results are returned
+    sorted on it so that the output order matches a depth-first walk, no matter
+    in which order the fetches complete."""
+
+    url: str
+    depth: int = 0
+    skip_toc: bool = False
+    order: Tuple[int, ...] = ()
+
+
+# A handler receives the task and its response and returns the items extracted
+# from the page along with the child tasks to schedule.
+CrawlHandler = Callable[[CrawlTask, requests.Response], Tuple[List[Any], List[CrawlTask]]]
+
+
+class CrawlEngine:
+    """Work-queue crawler with a single concurrency limit for every depth.
+
+    All fetches share one pooled session so connections (and TLS handshakes) are
+    reused between pages. Scheduling and de-duplication happen on the calling
+    thread only, so the handler never has to touch shared state."""
+
+    def __init__(
+        self,
+        handler: CrawlHandler,
+        max_workers: int = 10,
+        session: Optional[requests.Session] = None,
+        timeout: int = 10,
+    ) -> None:
+        self.handler = handler
+        self.max_workers = max_workers
+        self.session = session or create_session(max_workers)
+        self.timeout = timeout
+
+    def _run(self, task: CrawlTask) -> Tuple[List[Any], List[CrawlTask], Optional[str]]:
+        logger.info("Processing %s at depth %d", task.url, task.depth)
+        try:
+            with METRICS.span("crawl_page"):
+                response = self.session.get(task.url, timeout=self.timeout)
+                response.raise_for_status()
+                items, children = self.handler(task, response)
+        except Exception as e:
+            logger.warning("Error processing %s: %s", task.url, e)
+            return [], [], f"{type(e).__name__}: {e}"
+        METRICS.inc("pages_crawled", depth=task.depth)
+        return items, children, None
+
+    def crawl(
+        self, seeds: Iterable[CrawlTask], frontier: Optional[CrawlFrontier] = None
+    ) -> List[Tuple[Tuple[int, ...], Any]]:
+        """Crawl from the seed tasks and return `(order, item)` pairs sorted by order.
+
+        The `frontier` (in memory by default) de-duplicates the URLs and records every
+        completed task. When it holds the tasks of an interrupted crawl, their unfinished
+        tasks are scheduled again and the items of the finished ones are part of the results."""
+        frontier = frontier or CrawlFrontier()
+        resumed = [CrawlTask(*row) for row in frontier.unfinished()]
+        if resumed:
+            logger.info("Resuming %d unfinished tasks (%s)", len(resumed), frontier.counts())
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self._run, task): task for task in resumed}
+            for task in seeds:
+                if frontier.claim(task):
+                    pending[executor.submit(self._run, task)] = task
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    items, children, error = future.result()
+
+                    # Children are claimed before the task is marked as completed, so that
+                    # a crawl interrupted in between schedules them again
+                    for idx, child in enumerate(children):
+                        child = replace(child, order=task.order + (idx,))
+                        if frontier.claim(child):
+                            pending[executor.submit(self._run, child)] = child
+
+                    if error is None:
+                        frontier.complete(task, items)
+                    else:
+                        frontier.fail(task, error)
+
+        return frontier.results()
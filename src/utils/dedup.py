@@ -0,0 +1,135 @@
+import re
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from utils.metrics import METRICS
+
+DEFAULT_THRESHOLD = 0.85
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 5
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes, without overflowing uint64
+_PRIME = np.uint64(4294967311)
+_MAX_COEFFICIENT = 2**31
+
+WORD = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str, size: int = DEFAULT_SHINGLE_SIZE) -> np.ndarray:
+    """32-bit hashes of the distinct word `size`-grams of a text (lower-cased)."""
+    words = WORD.findall(text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = {" ".join(words[idx : idx + size]) for idx in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64, count=len(grams))
+
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) splitting the signature so that pairs around `threshold` become candidates.
+    A pair of similarity s shares a band with probability 1 - (1 - s^rows)^bands, whose
+    steepest point is near (1 / bands)^(1 / rows); it is kept just below the threshold so
+    that candidates are missed rarely, false candidates being dropped on verification."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        point = (1 / bands) ** (1 / rows)
+        if point <= threshold and (best is None or point > best[0]):
+            best = (point, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashDeduplicator:
+    """Groups near-duplicate documents with MinHash signatures and LSH banding.
+
+    Documents are compared on their sets of word shingles. Their MinHash signatures
+    estimate the Jaccard similarity of these sets; banding the signatures only compares
+    the pairs sharing a band, instead of every pair. Candidate pairs whose estimated
+    similarity reaches `threshold` are merged into clusters (transitively)."""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 1) -> None:
+        if not 0 < threshold <= 1:
+            raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MAX_COEFFICIENT, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MAX_COEFFICIENT, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of a text, or None if it has no words."""
+        hashes = shingle_hashes(text, self.shingle_size)
+        if not len(hashes):
+            return None
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def clusters(self, documents: List[str]) -> List[List[int]]:
+        """Positions of the documents grouped by near-duplicates, every cluster sorted and
+        holding at least two documents."""
+        signatures = [self.signature(text) for text in documents]
+        parents = list(range(len(documents)))
+
+        def find(idx):
+            while parents[idx] != idx:
+                parents[idx] = parents[parents[idx]]
+                idx = parents[idx]
+            return idx
+
+        for band in range(self.bands):
+            buckets: Dict[bytes, List[int]] = {}
+            start = band * self.rows
+            for idx, signature in enumerate(signatures):
+                if signature is not None:
+                    buckets.setdefault(signature[start : start + self.rows].tobytes(), []).append(idx)
+            for members in buckets.values():
+                # Compare every member with one document of each cluster already met in the bucket
+                representatives = []
+                for idx in members:
+                    for representative in representatives:
+                        root, idx_root = find(representative), find(idx)
+                        if root == idx_root:
+                            break
+                        if np.mean(signatures[representative] == signatures[idx]) >= self.threshold:
+                            parents[max(root, idx_root)] = min(root, idx_root)
+                            break
+                    else:
+                        representatives.append(idx)
+
+        groups: Dict[int, List[int]] = {}
+        for idx in range(len(documents)):
+            groups.setdefault(find(idx), []).append(idx)
+        return [members for members in groups.values() if len(members) > 1]
+
+
+def deduplicate(
+    ids: List[str], documents: List[str], metadatas: List[dict], deduplicator: MinHashDeduplicator
+) -> Tuple[List[str], List[str], List[dict], int]:
+    """Collapse the near-duplicates of a corpus given as columns into the first document of
+    their cluster (the canonical one), whose metadata gets the ids of the others as `aliases`.
+    Returns the columns of the remaining documents and the number of documents removed."""
+    with METRICS.span("dedup"):
+        clusters = deduplicator.clusters(documents)
+    aliases = {}
+    for members in clusters:
+        aliases[members[0]] = members[1:]
+    removed = {idx for members in aliases.values() for idx in members}
+
+    kept_ids, kept_documents, kept_metadatas = [], [], []
+    for idx, (id_, text, metadata) in enumerate(zip(ids, documents, metadatas)):
+        if idx in removed:
+            continue
+        if idx in aliases:
+            metadata = dict(metadata)
+            # chromadb metadata values cannot be lists
+            metadata["aliases"] = str([ids[alias] for alias in aliases[idx]])
+            metadata["alias_count"] = len(aliases[idx])
+        kept_ids.append(id_)
+        kept_documents.append(text)
+        kept_metadatas.append(metadata)
+    METRICS.inc("near_duplicates_removed", len(removed))
+    return kept_ids, kept_documents, kept_metadatas, len(removed)
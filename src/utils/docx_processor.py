@@ -1,17 +1,61 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterator, Optional, Tuple
 
 import docx
 import yaml
 
+from utils.metrics import METRICS
+
+MANIFEST_FILE_NAME = ".docx_manifest.json"
+
+logger = logging.getLogger(__name__)
+
+
+def docx_to_text(file_name) -> str:
+    doc = docx.Document(file_name)
+    fullText = []
+    for para in doc.paragraphs:
+        fullText.append(para.text)
+
+    return "\n".join(fullText)
+
+
+def _convert(file_name) -> Tuple[Path, Optional[str], Optional[str]]:
+    """Worker function: returns (file name, text, error) so one bad file does not stop the batch."""
+    try:
+        return file_name, docx_to_text(file_name), None
+    except Exception as e:
+        return file_name, None, f"{type(e).__name__}: {e}"
+
+
+def _file_hash(file_name) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
 
 class DocxBatchProcessor:
-    def __init__(self, yml_config_file_path: str = None) -> None:
+    """Converts the Word documents of `dataset_dir` to text files in `output_dir`.
+
+    A manifest in `output_dir` records the size, mtime and hash of every converted document,
+    so that documents left untouched since the last run are skipped. Conversions run in a
+    process pool when `max_workers` is greater than 1."""
+
+    def __init__(self, yml_config_file_path: str = None, max_workers: int = 1) -> None:
         with open(yml_config_file_path, "r") as f:
             config = yaml.safe_load(f)
         self.dataset_dir = Path(config["dataset_dir"])
         self.output_dir = Path(config["output_dir"])
         self.input_files_extension = config["input_files_extension"]
         self.output_files_extension = config["output_files_extension"]
+        self.max_workers = max_workers
+        self.manifest_path = self.output_dir.joinpath(MANIFEST_FILE_NAME)
         self.full_file_names = list(
             self.dataset_dir.glob(f"*{self.input_files_extension}")
         )
@@ -22,40 +66,108 @@ class DocxBatchProcessor:
             )
             for i in self.short_file_names
         ]
-
-    def _retrieve_text(self, file_name) -> str:
-        try:
-            doc = docx.Document(file_name)
-            fullText = []
-            for para in doc.paragraphs:
-                fullText.append(para.text)
-
-            return "\n".join(fullText)
-        except Exception:
-            print("Failed to retrieve text.")
+        self.failures = {}
 
     def _save_to_new_file_format(self, input_data, output_file_name) -> None:
-        try:
-            with open(output_file_name, "w", encoding="utf-8") as out:
-                out.write(input_data)
-        except Exception:
-            print("Failed to save to new file format")
+        with open(output_file_name, "w", encoding="utf-8") as out:
+            out.write(input_data)
         return
 
-    def process_and_save_to_txt(self) -> None:
+    def _load_manifest(self) -> dict:
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: dict) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+
+    def _changed_files(self, manifest: dict) -> list:
+        """Input files (with their output file) that are new or changed since they were last converted."""
+        changed = []
         for i, j in zip(self.full_file_names, self.output_full_file_names):
-            try:
-                data = self._retrieve_text(file_name=i)
-                self._save_to_new_file_format(
-                    input_data=data,
-                    output_file_name=j,
-                )
-            except Exception:
-                print("Failed to process files in the designated folder.")
-        return
+            stat = i.stat()
+            entry = manifest.get(i.name)
+            if entry and j.exists():
+                if (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                # Touched but not modified (e.g. copied over): only refresh the manifest
+                if entry["sha256"] == _file_hash(i):
+                    entry["mtime_ns"] = stat.st_mtime_ns
+                    continue
+            changed.append((i, j))
+        return changed
+
+    def iter_texts(self, file_names=None) -> Iterator[Tuple[Path, str]]:
+        """Yield (file name, text) for every document (or the given ones) as they are converted,
+        without writing anything. Documents that fail to convert are recorded in `self.failures`."""
+        file_names = self.full_file_names if file_names is None else file_names
+
+        if self.max_workers > 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                results = executor.map(_convert, file_names, chunksize=8)
+                yield from self._collect(results)
+        else:
+            yield from self._collect(map(_convert, file_names))
+
+    def _collect(self, results) -> Iterator[Tuple[Path, str]]:
+        for file_name, text, error in results:
+            if error is not None:
+                logger.warning("Failed to retrieve text from %s: %s", file_name, error)
+                METRICS.inc("docx_failed")
+                self.failures[Path(file_name).name] = error
+                continue
+            METRICS.inc("docx_converted")
+            yield file_name, text
+
+    def process_and_save_to_txt(self) -> dict:
+        """Convert the new and changed documents and return a summary of the run."""
+        manifest = self._load_manifest()
+        changed = self._changed_files(manifest)
+        output_file_names = dict(changed)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.failures = {}
+
+        nb_converted = 0
+        with METRICS.span("docx_batch"):
+            for file_name, text in self.iter_texts([i for i, _ in changed]):
+                try:
+                    self._save_to_new_file_format(
+                        input_data=text,
+                        output_file_name=output_file_names[file_name],
+                    )
+                except OSError as e:
+                    logger.warning("Failed to save %s: %s", output_file_names[file_name], e)
+                    METRICS.inc("docx_save_failed")
+                    self.failures[file_name.name] = f"{type(e).__name__}: {e}"
+                    continue
+
+                stat = file_name.stat()
+                manifest[file_name.name] = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "sha256": _file_hash(file_name),
+                }
+                nb_converted += 1
+
+        # Forget the documents removed from the dataset
+        manifest = {k: v for k, v in manifest.items() if k in self.short_file_names}
+        self._save_manifest(manifest)
+
+        summary = {
+            "converted": nb_converted,
+            "skipped": len(self.full_file_names) - len(changed),
+            "failed": len(self.failures),
+        }
+        METRICS.inc("docx_skipped", summary["skipped"])
+        logger.info("Processed %s: %s", self.dataset_dir, summary)
+        return summary
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     batch_processor = DocxBatchProcessor(
         yml_config_file_path=r"C:\Work\labour-chatbot-knowledge-base\config\text_data_processing.yml"
     )
@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import os
+import pathlib
+import re
+import threading
+from typing import Optional
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 100_000
+KEY_DTYPE = np.dtype("S32")
+ARRAY_NAMES = ("embeddings", "keys", "last_used")
+RESIZE_CHUNK_ROWS = 10_000
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest().encode("ascii")
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Wraps any embedding function with a persistent cache keyed by (model, text hash).
+
+    The cache of a model lives in its own directory under `cache_dir` and is made of three
+    memory-mapped arrays holding `max_entries` rows: the embeddings (float32), the text hash
+    of every row and a logical clock of the last time every row was used. Once the cache is
+    full, the least recently used rows are overwritten. An existing cache opened with another
+    `max_entries` is resized to it, keeping its most recently used rows.
+    """
+
+    def __init__(
+        self,
+        embedding_function: EmbeddingFunction,
+        model_name: str,
+        cache_dir: pathlib.Path,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.cache_dir = pathlib.Path(cache_dir) / re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._embeddings: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._last_used: Optional[np.memmap] = None
+        self._index: dict[bytes, int] = {}
+        self._clock = 0
+
+        if (self.cache_dir / "embeddings.npy").exists():
+            self._open()
+
+    def _open(self, dim: Optional[int] = None) -> None:
+        """Open the arrays of the cache, creating them when `dim` is given."""
+        open_memmap = np.lib.format.open_memmap
+        if dim is None:
+            self._embeddings = open_memmap(self.cache_dir / "embeddings.npy", mode="r+")
+            self._keys = open_memmap(self.cache_dir / "keys.npy", mode="r+")
+            self._last_used = open_memmap(self.cache_dir / "last_used.npy", mode="r+")
+            if not len(self._embeddings) == len(self._keys) == len(self._last_used):
+                # Left by a resize interrupted midway: start over, it is only a cache
+                logger.warning("Embedding cache %s is inconsistent, clearing it", self.cache_dir)
+                self._embeddings = self._keys = self._last_used = None
+                for name in ARRAY_NAMES:
+                    (self.cache_dir / f"{name}.npy").unlink(missing_ok=True)
+                return
+        else:
+            self._embeddings, self._keys, self._last_used = self._create_arrays(self.cache_dir, dim, "")
+
+        self._index = {key: row for row, key in enumerate(self._keys) if key}
+        self._clock = int(self._last_used.max(initial=0))
+        if dim is None and len(self._keys) != self.max_entries:
+            self._resize()
+
+    def _create_arrays(self, directory: pathlib.Path, dim: int, suffix: str) -> tuple:
+        open_memmap = np.lib.format.open_memmap
+        shape = (self.max_entries,)
+        return (
+            open_memmap(directory / f"embeddings.npy{suffix}", mode="w+", dtype=np.float32, shape=shape + (dim,)),
+            open_memmap(directory / f"keys.npy{suffix}", mode="w+", dtype=KEY_DTYPE, shape=shape),
+            open_memmap(directory / f"last_used.npy{suffix}", mode="w+", dtype=np.int64, shape=shape),
+        )
+
+    def _resize(self) -> None:
+        """Rewrite the arrays with `max_entries` rows, keeping the most recently used entries
+        (in their order, as used rows are kept contiguous from the first one)."""
+        rows = np.array(sorted(self._index.values()), dtype=np.int64)
+        kept = np.sort(rows[np.argsort(-self._last_used[rows], kind="stable")][: self.max_entries])
+        logger.info("Resizing embedding cache %s from %d to %d entries (%d kept)",
+                    self.cache_dir, len(self._keys), self.max_entries, len(kept))
+
+        arrays = self._create_arrays(self.cache_dir, self._embeddings.shape[1], ".tmp")
+        for start in range(0, len(kept), RESIZE_CHUNK_ROWS):
+            chunk = kept[start : start + RESIZE_CHUNK_ROWS]
+            for new, old in zip(arrays, (self._embeddings, self._keys, self._last_used)):
+                new[start : start + len(chunk)] = old[chunk]
+        for array in arrays:
+            array.flush()
+
+        # Release the mappings of the old files before replacing them
+        del arrays
+        self._embeddings = self._keys = self._last_used = None
+        for name in ARRAY_NAMES:
+            os.replace(self.cache_dir / f"{name}.npy.tmp", self.cache_dir / f"{name}.npy")
+        self._open()
+
+    def _free_rows(self, count: int) -> np.ndarray:
+        """Pick `count` rows to write to: empty rows first, then the least recently used ones."""
+        capacity = len(self._keys)
+        used = len(self._index)
+        if used + count <= capacity:
+            return np.arange(used, used + count)
+
+        empty = np.arange(used, capacity)
+        nb_evicted = min(count - len(empty), used)
+        evicted = np.argpartition(self._last_used[:used], nb_evicted - 1)[:nb_evicted]
+        for row in evicted:
+            del self._index[bytes(self._keys[row])]
+        return np.concatenate([empty, evicted])
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [text_hash(text) for text in input]
+        results: list[Optional[np.ndarray]] = [None] * len(input)
+
+        with self._lock:
+            missing: dict[bytes, list[int]] = {}
+            for position, key in enumerate(keys):
+                row = self._index.get(key)
+                if row is None:
+                    missing.setdefault(key, []).append(position)
+                    continue
+                self._clock += 1
+                self._last_used[row] = self._clock
+                results[position] = np.array(self._embeddings[row])
+
+            self.hits += len(input) - sum(len(positions) for positions in missing.values())
+            self.misses += sum(len(positions) for positions in missing.values())
+
+        if missing:
+            texts = [input[positions[0]] for positions in missing.values()]
+            embeddings = np.asarray(self.embedding_function(texts), dtype=np.float32)
+
+            with self._lock:
+                if self._embeddings is None:
+                    self._open(dim=embeddings.shape[1])
+
+                # Keys stored by another thread while the lock was released only get their use
+                # refreshed: a key held by two rows would break the contiguity of the used rows
+                new_embeddings = {}
+                for key, embedding in zip(missing, embeddings):
+                    row = self._index.get(key)
+                    if row is None:
+                        new_embeddings[key] = embedding
+                    else:
+                        self._clock += 1
+                        self._last_used[row] = self._clock
+
+                # A batch bigger than the cache only keeps its last rows
+                stored = list(new_embeddings)[-self.max_entries :]
+                rows = self._free_rows(len(stored))
+                for key, row in zip(stored, rows):
+                    embedding = new_embeddings[key]
+                    self._clock += 1
+                    self._embeddings[row] = embedding
+                    self._keys[row] = key
+                    self._last_used[row] = self._clock
+                    self._index[key] = int(row)
+
+            for positions, embedding in zip(missing.values(), embeddings):
+                for position in positions:
+                    results[position] = embedding
+
+        return results
+
+    def flush(self) -> None:
+        with self._lock:
+            for array in (self._embeddings, self._keys, self._last_used):
+                if array is not None:
+                    array.flush()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._index),
+            "max_entries": self.max_entries,
+        }
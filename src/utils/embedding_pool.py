@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TOKENIZERS_PARALLELISM"]
+
+# Embedding function of the current worker process, built once by _init_worker
+_worker_embedding_function: Optional[EmbeddingFunction] = None
+
+
+def _init_worker(model_factory: Callable[[], EmbeddingFunction], threads_per_worker: int) -> None:
+    global _worker_embedding_function
+
+    # Must be set before torch / the BLAS libraries are loaded by the model
+    for env_var in THREAD_ENV_VARS:
+        os.environ[env_var] = "false" if env_var == "TOKENIZERS_PARALLELISM" else str(threads_per_worker)
+    try:
+        import torch
+
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+
+    _worker_embedding_function = model_factory()
+
+
+def _embed_shard(texts: list[str]) -> np.ndarray:
+    return np.asarray(_worker_embedding_function(texts), dtype=np.float32)
+
+
+class ProcessPoolEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Embedding function sharding every call across a pool of worker processes.
+
+    Each worker loads its own copy of the model (built by `model_factory`, which has to be
+    picklable) and is limited to `threads_per_worker` threads, so that the workers do not
+    fight over the cores. Calls should be big enough to give every worker a shard of at
+    least `min_shard_size` texts, e.g. `embedding_batch_size=32 * num_workers`.
+    """
+
+    def __init__(
+        self,
+        model_name: str = None,
+        num_workers: int = None,
+        threads_per_worker: int = None,
+        model_factory: Callable[[], EmbeddingFunction] = None,
+        min_shard_size: int = 8,
+    ) -> None:
+        if model_factory is None:
+            model_factory = partial(embedding_functions.SentenceTransformerEmbeddingFunction, model_name=model_name)
+        self.model_factory = model_factory
+        self.num_workers = num_workers or os.cpu_count()
+        self.threads_per_worker = threads_per_worker or max(1, os.cpu_count() // self.num_workers)
+        self.min_shard_size = min_shard_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn rather than fork: the parent may already run threads (chromadb, torch)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_factory, self.threads_per_worker),
+            )
+        return self._executor
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if not input:
+            return []
+        nb_shards = max(1, min(self.num_workers, len(input) // self.min_shard_size))
+        shards = [list(shard) for shard in np.array_split(np.array(input, dtype=object), nb_shards)]
+        embeddings = np.concatenate(list(self._get_executor().map(_embed_shard, shards)))
+        return list(embeddings)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "ProcessPoolEmbeddingFunction":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,153 @@
+import json
+import logging
+from typing import List, Optional
+
+import numpy as np
+
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SPACES = ("cosine", "ip", "l2")
+DEFAULT_SPACE = "l2"  # chromadb's default for "hnsw:space"
+LOAD_BATCH_SIZE = 5000
+
+
+def _compare(value, operator: str, operand) -> bool:
+    if operator == "$eq":
+        return value == operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if value is None:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    raise ValueError(f"Unsupported operator {operator} in where filter")
+
+
+def matches(metadata: Optional[dict], where: dict) -> bool:
+    """Whether a metadata dict matches a chromadb `where` filter ($and, $or and the
+    $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin operators)."""
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            if key not in metadata and not set(condition) <= {"$ne", "$nin"}:
+                return False
+            if not all(_compare(metadata.get(key), operator, operand) for operator, operand in condition.items()):
+                return False
+        elif key not in metadata or metadata[key] != condition:
+            return False
+    return True
+
+
+class ExactSearchIndex:
+    """Exact nearest-neighbour search over the embeddings of a collection, held in memory.
+
+    For collections of a few thousand vectors a brute-force search (one matrix product per
+    batch of queries, then `argpartition` for the top k) is both faster than HNSW and exact.
+    Embeddings are kept in a contiguous float32 matrix, normalised up-front for the cosine
+    space. Distances follow chromadb: `1 - cosine similarity`, `1 - inner product` or the
+    squared L2 distance. A `where` filter is resolved to the matching rows first (once per
+    distinct filter), and only these rows are searched.
+
+    `query` takes the arguments of `Collection.query` (with `query_embeddings`) and returns
+    results of the same shape, so the index can stand in for a collection, e.g. in
+    `QueryService`. It is a snapshot: load it again after the collection changed."""
+
+    def __init__(self, ids: List[str], embeddings, documents: List[str] = None, metadatas: List[dict] = None,
+                 space: str = DEFAULT_SPACE, name: str = "exact") -> None:
+        if space not in SPACES:
+            raise ValueError(f"Unsupported space {space}, expected one of {SPACES}")
+        self.name = name
+        self.space = space
+        self.ids = list(ids)
+        self.documents = list(documents) if documents is not None else [None] * len(self.ids)
+        self.metadatas = list(metadatas) if metadatas is not None else [None] * len(self.ids)
+
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(self.ids), -1)
+        if space == "cosine":
+            self.embeddings /= np.maximum(np.linalg.norm(self.embeddings, axis=1, keepdims=True), 1e-12)
+        self.squared_norms = np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+        self._rows = {}
+
+    @classmethod
+    def from_collection(cls, collection, batch_size: int = LOAD_BATCH_SIZE) -> "ExactSearchIndex":
+        """Load the embeddings, documents and metadata of a collection (in its "hnsw:space")."""
+        ids, embeddings, documents, metadatas = [], [], [], []
+        for offset in range(0, collection.count(), batch_size):
+            batch = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+            ids.extend(batch["ids"])
+            embeddings.append(np.asarray(batch["embeddings"], dtype=np.float32))
+            documents.extend(batch["documents"])
+            metadatas.extend(batch["metadatas"])
+
+        space = (collection.metadata or {}).get("hnsw:space", DEFAULT_SPACE)
+        matrix = np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+        logger.info("Loaded %d embeddings of %s for exact search (%s)", len(ids), collection.name, space)
+        return cls(ids, matrix, documents, metadatas, space=space, name=collection.name)
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def matching_rows(self, where: Optional[dict]) -> Optional[np.ndarray]:
+        """Positions of the rows matching the filter (None for all rows), computed once per distinct filter."""
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True)
+        if key not in self._rows:
+            mask = np.fromiter((matches(metadata, where) for metadata in self.metadatas), dtype=bool, count=len(self.ids))
+            self._rows[key] = np.flatnonzero(mask)
+        return self._rows[key]
+
+    def distances(self, query_embeddings, rows: np.ndarray = None) -> np.ndarray:
+        """(queries x rows) matrix of the distances of the queries to the given rows (all by default)."""
+        embeddings = self.embeddings if rows is None else self.embeddings[rows]
+        squared_norms = self.squared_norms if rows is None else self.squared_norms[rows]
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.embeddings.shape[1])
+        if self.space == "cosine":
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        products = queries @ embeddings.T
+        if self.space == "l2":
+            return np.maximum(np.einsum("ij,ij->i", queries, queries)[:, None] - 2 * products + squared_norms, 0)
+        return 1 - products
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None, include: list = None) -> dict:
+        include = include if include is not None else ["metadatas", "documents", "distances"]
+        with METRICS.span("exact_search"):
+            rows = self.matching_rows(where)
+            distances = self.distances(query_embeddings, rows)
+            n_results = min(n_results, distances.shape[1])
+
+            if 0 < n_results < distances.shape[1]:
+                top = np.argpartition(distances, n_results - 1, axis=1)[:, :n_results]
+            else:
+                top = np.tile(np.arange(distances.shape[1]), (len(distances), 1))[:, :max(n_results, 0)]
+            top_distances = np.take_along_axis(distances, top, axis=1)
+            order = np.argsort(top_distances, axis=1, kind="stable")
+            top, top_distances = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+            if rows is not None:
+                top = rows[top]
+        METRICS.inc("exact_search_queries", len(distances))
+
+        results = {"ids": [[self.ids[idx] for idx in row] for row in top]}
+        results["distances"] = top_distances.tolist() if "distances" in include else None
+        results["documents"] = [[self.documents[idx] for idx in row] for row in top] if "documents" in include else None
+        results["metadatas"] = [[self.metadatas[idx] for idx in row] for row in top] if "metadatas" in include else None
+        results["embeddings"] = [self.embeddings[row] for row in top] if "embeddings" in include else None
+        return results
@@ -0,0 +1,138 @@
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL, so that URLs pointing to the same page compare equal:
+    lower-case scheme and host, no default port, no fragment, sorted query parameters
+    and no trailing slash (except for the root path)."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+class CrawlFrontier:
+    """Persistent record of the tasks (see `utils.crawler.CrawlTask`) of a crawl and of what
+    was extracted from them.
+
+    URLs are de-duplicated on their normalised form: `claim` atomically registers a task
+    and returns False if its URL was already claimed (or is blocked), so that several
+    threads can share the frontier. Every completed task is committed along with its
+    items, so a crawl restarted on the same file resumes where it stopped: finished
+    pages are not fetched again and unfinished (or failed) ones are scheduled again.
+
+    `path` is the SQLite file (in memory when None). URLs starting with one of the
+    `blocked_prefixes` (full URLs or paths such as "/en/news/") are never claimed."""
+
+    def __init__(self, path: Optional[Path] = None, blocked_prefixes: Iterable[str] = ()) -> None:
+        self.path = path
+        self.blocked_prefixes = tuple(blocked_prefixes)
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(":memory:" if path is None else str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS tasks (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    skip_toc INTEGER NOT NULL,
+                    order_key TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    items BLOB,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+
+    def is_blocked(self, url: str) -> bool:
+        path = urlsplit(url).path
+        return any(url.startswith(prefix) or path.startswith(prefix) for prefix in self.blocked_prefixes)
+
+    def claim(self, task) -> bool:
+        """Register the task if its URL is new; return whether the caller should process it."""
+        if self.is_blocked(task.url):
+            return False
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO tasks (key, url, depth, skip_toc, order_key, state, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(task.url), task.url, task.depth, int(task.skip_toc), json.dumps(task.order), PENDING, time.time()),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task, items: List[Any]) -> None:
+        self._set_state(task, DONE, items=pickle.dumps(items))
+
+    def fail(self, task, error: str) -> None:
+        self._set_state(task, FAILED, error=error)
+
+    def _set_state(self, task, state: str, items: bytes = None, error: str = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE tasks SET state = ?, items = ?, error = ?, updated_at = ? WHERE key = ?",
+                (state, items, error, time.time(), normalize_url(task.url)),
+            )
+
+    def unfinished(self) -> List[Tuple[str, int, bool, Tuple[int, ...]]]:
+        """(url, depth, skip_toc, order) of the tasks claimed by a previous run that did not
+        complete (interrupted or failed), sorted by order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, depth, skip_toc, order_key FROM tasks WHERE state != ?", (DONE,)
+            ).fetchall()
+        tasks = [(url, depth, bool(skip_toc), tuple(json.loads(order))) for url, depth, skip_toc, order in rows]
+        return sorted(tasks, key=lambda task: task[3])
+
+    def results(self) -> List[Tuple[Tuple[int, ...], Any]]:
+        """`(order, item)` pairs of every completed task, sorted by order."""
+        with self._lock:
+            rows = self._conn.execute("SELECT order_key, items FROM tasks WHERE state = ?", (DONE,)).fetchall()
+        results = []
+        for order, items in rows:
+            order = tuple(json.loads(order))
+            results.extend((order, item) for item in pickle.loads(items))
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def delete(self) -> None:
+        """Close the frontier and remove its file, once its results are saved."""
+        self.close()
+        if self.path is not None:
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+
+    def __enter__(self) -> "CrawlFrontier":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,54 @@
+import os
+from typing import Dict, Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from utils.metrics import METRICS
+
+try:
+    import lxml  # noqa: F401
+
+    DEFAULT_BACKEND = os.environ.get("HTML_PARSER", "lxml")
+except ImportError:
+    DEFAULT_BACKEND = os.environ.get("HTML_PARSER", "html.parser")
+
+# Elements needed by the extractors, as tag name -> required class (None for any).
+# Everything outside of them is skipped while parsing.
+PAGE_ELEMENTS = {"main": None, "h1": None, "ol": "breadcrumb", "ul": "toc"}  # extract_canada_page
+MAIN_CONTENT = {"main": None}  # page_utils.extract_main_content
+TABLE_ELEMENTS = {"table": None, "h2": None, "h3": None}  # extract_ipgs: tables and the headers preceding them
+TOC_ELEMENTS = {"ul": "TocIndent"}  # extract_toc: table of contents of an act
+
+
+class ElementStrainer(SoupStrainer):
+    """Strainer keeping the top-level elements matching one of the (tag name, class) pairs."""
+
+    def __init__(self, elements: Dict[str, Optional[str]]) -> None:
+        self.elements = elements
+        super().__init__(name=self._match)
+
+    def _match(self, name, attrs=None) -> bool:
+        if name not in self.elements:
+            return False
+        required_class = self.elements[name]
+        if required_class is None or attrs is None:
+            return True
+        classes = attrs.get("class") or []
+        if isinstance(classes, str):
+            classes = classes.split()
+        return required_class in classes
+
+    # Called by beautifulsoup4 >= 4.13 (older versions pass the attributes to the name function)
+    def allow_tag_creation(self, nsprefix, name, attrs) -> bool:
+        return self._match(name, attrs)
+
+
+def parse_html(markup, only: Optional[Dict[str, Optional[str]]] = None, backend: str = None) -> BeautifulSoup:
+    """Parse an HTML document with the given backend ("lxml" when installed, else "html.parser").
+
+    When `only` is given, only the matching elements (and their descendants) are materialised,
+    which saves most of the tree building on pages where the extractors look at a small part
+    of the document."""
+    parse_only = ElementStrainer(only) if only else None
+    with METRICS.span("parse", partial=bool(only)):
+        return BeautifulSoup(markup, backend or DEFAULT_BACKEND, parse_only=parse_only)
@@ -1,13 +1,93 @@
-from dataclasses import dataclass
-from io import StringIO
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import urljoin
 
-from pandas import read_html
+import pandas as pd
 import requests
 
+from utils.html_parser import TABLE_ELEMENTS, parse_html
+from utils.http_cache import create_cached_session
+
+
+@dataclass
+class TableCell:
+    text: str
+    hrefs: List[str] = field(default_factory=list)  # absolute urls of the links in the cell
+
+    @property
+    def href(self) -> Optional[str]:
+        return self.hrefs[0] if self.hrefs else None
+
+
+@dataclass
+class HTMLTable:
+    title: str  # caption of the table, or the header preceding it
+    headers: List[str]
+    rows: List[List[TableCell]]
+
+    def column(self, *names: str, default: int = None) -> Optional[int]:
+        """Position of the first column whose header contains one of `names`."""
+        return next((idx for idx, header in enumerate(self.headers) if any(name in header for name in names)), default)
+
+    def index_by(self, column: int) -> Dict[str, List[TableCell]]:
+        """Rows keyed by the text of their cell in `column` (the first row wins on duplicates)."""
+        index = {}
+        for row in self.rows:
+            if column < len(row):
+                index.setdefault(row[column].text, row)
+        return index
+
+    def to_dataframe(self) -> pd.DataFrame:
+        width = max([len(self.headers)] + [len(row) for row in self.rows])
+        columns = self.headers + [str(idx) for idx in range(len(self.headers), width)]
+        return pd.DataFrame([[cell.text for cell in row] + [None] * (width - len(row)) for row in self.rows], columns=columns)
+
+
+def _cell(element, base_url: str) -> TableCell:
+    hrefs = [urljoin(base_url, a["href"]) for a in element.find_all("a", href=True)]
+    return TableCell(element.get_text(strip=True), hrefs)
+
+
+def extract_table(table, base_url: str) -> HTMLTable:
+    """Headers, rows and resolved links of a <table>, in a single walk over its rows."""
+    caption = table.find("caption")
+    if caption:
+        title = caption.get_text(strip=True)
+    else:
+        previous_header = table.find_previous(["h2", "h3"])
+        title = previous_header.get_text(strip=True) if previous_header else ""
+
+    headers, rows = [], []
+    for tr in table.find_all("tr"):
+        cells = tr.find_all(["td", "th"], recursive=False)
+        if not headers and cells and all(cell.name == "th" for cell in cells):
+            headers = [cell.get_text(strip=True) for cell in cells]
+        elif cells:
+            rows.append([_cell(cell, base_url) for cell in cells])
+    return HTMLTable(title, headers, rows)
+
+
 @dataclass
 class HTMLTablestoDataframes:
+    """Tables of the page at `url`, fetched and parsed once.
+
+    `tables` holds every table with its rows and the links of its cells resolved against
+    the page url; `df_list` holds the text of the same tables as DataFrames. The page
+    content can be passed as `html` when it was already downloaded."""
+
     url:str = None
+    session:requests.Session = None
+    html:bytes = None
 
     def __post_init__(self):
-        html_content = requests.get(self.url)
-        self.df_list = read_html(StringIO(html_content.text))
+        if self.html is None:
+            session = self.session or create_cached_session()
+            response = session.get(self.url, timeout=10)
+            response.raise_for_status()
+            self.html = response.content
+        soup = parse_html(self.html, only=TABLE_ELEMENTS)
+        self.tables = [extract_table(table, self.url) for table in soup.find_all("table")]
+
+    @property
+    def df_list(self) -> List[pd.DataFrame]:
+        return [table.to_dataframe() for table in self.tables]
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import get_encoding_from_headers
+
+from utils.metrics import METRICS
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("HTTP_CACHE_DIR", ".http_cache"))
+DEFAULT_MAX_BYTES = 1024**3  # 1 GiB
+
+# Headers kept with a cached body so a 304 can be turned back into the original 200
+STORED_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+class HTTPCache:
+    """On-disk store of response bodies along with their validators (ETag / Last-Modified).
+
+    Every entry is a `<sha256(url)>.body` file plus a `<sha256(url)>.json` metadata file,
+    both written atomically. The modification time of the metadata file is the last access
+    time, which is used to evict the least recently used entries once the total size goes
+    over `max_bytes`. Use `HTTPCache.shared` to get the one instance of a cache directory,
+    so that all the sessions of a process account for the same bytes."""
+
+    _instances: dict = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total_bytes = sum(f.stat().st_size for f in self.cache_dir.glob("*.body"))
+
+    @classmethod
+    def shared(cls, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES) -> "HTTPCache":
+        """The instance of the cache at `cache_dir`, created on first use."""
+        key = Path(cache_dir).resolve()
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(cache_dir, max_bytes)
+            return cls._instances[key]
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{key}.json", self.cache_dir / f"{key}.body"
+
+    def get(self, url: str) -> Optional[dict]:
+        """Return the metadata of the cached entry for `url`, if any."""
+        meta_path, _ = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read(self, url: str) -> Optional[bytes]:
+        """Return the cached body for `url` and mark the entry as recently used."""
+        meta_path, body_path = self._paths(url)
+        try:
+            body = body_path.read_bytes()
+            os.utime(meta_path)
+            return body
+        except OSError:
+            return None
+
+    def store(self, url: str, headers: dict, body: bytes) -> None:
+        meta_path, body_path = self._paths(url)
+        meta = {"url": url, "headers": {k: headers[k] for k in STORED_HEADERS if k in headers}}
+
+        with self._lock:
+            self._total_bytes -= _size(body_path)
+            self._write(body_path, body)
+            self._write(meta_path, json.dumps(meta).encode("utf-8"))
+            self._total_bytes += len(body)
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _write(self, path: Path, data: bytes) -> None:
+        """Write to a temporary file renamed over `path`, so that readers never see a partial file."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=path.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits in `max_bytes`.
+        Entries may be removed concurrently (e.g. by another process sharing the directory)."""
+        entries = []
+        for meta_path in self.cache_dir.glob("*.json"):
+            try:
+                entries.append((meta_path.stat().st_mtime, meta_path))
+            except FileNotFoundError:
+                continue
+        for _, meta_path in sorted(entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            body_path = meta_path.with_suffix(".body")
+            self._total_bytes -= _size(body_path)
+            body_path.unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+
+
+def _size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+class CachingHTTPAdapter(HTTPAdapter):
+    """Transport adapter revalidating cached GET responses with conditional requests.
+
+    A 304 Not Modified answer is served from the cache as a regular 200 response
+    (with `response.from_cache` set), so callers do not have to know about the cache.
+    If the cached body is gone (e.g. evicted since its metadata was read), the request is
+    sent again without the validators."""
+
+    def __init__(self, cache: HTTPCache, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != "GET" or stream:
+            return super().send(request, stream=stream, **kwargs)
+
+        entry = self.cache.get(request.url)
+        if entry:
+            etag = entry["headers"].get("ETag")
+            last_modified = entry["headers"].get("Last-Modified")
+            if etag:
+                request.headers["If-None-Match"] = etag
+            if last_modified:
+                request.headers["If-Modified-Since"] = last_modified
+
+        response = super().send(request, stream=stream, **kwargs)
+        response.from_cache = False
+
+        if response.status_code == 304 and entry:
+            body = self.cache.read(request.url)
+            response.content  # Drain the empty 304 body so the connection goes back to the pool
+            if body is not None:
+                response.status_code = 200
+                response.reason = "OK"
+                response.headers.update(entry["headers"])
+                response.encoding = get_encoding_from_headers(response.headers)
+                response._content = body
+                response.from_cache = True
+                return response
+
+            # The cached body is gone: fetch the page again, unconditionally
+            METRICS.inc("http_cache_missing_bodies")
+            request.headers.pop("If-None-Match", None)
+            request.headers.pop("If-Modified-Since", None)
+            response = super().send(request, stream=stream, **kwargs)
+            response.from_cache = False
+
+        if response.status_code == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers):
+            self.cache.store(request.url, response.headers, response.content)
+
+        return response
+
+
+def create_session(pool_size: int = 10, cache: Optional[HTTPCache] = None) -> requests.Session:
+    """Create a session whose connection pool can hold one connection per worker.
+    Responses are revalidated against `cache` when one is given."""
+    session = requests.Session()
+    if cache is not None:
+        adapter = CachingHTTPAdapter(cache, pool_connections=pool_size, pool_maxsize=pool_size)
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(_record_response)
+    return session
+
+
+def _record_response(response: requests.Response, *args, **kwargs) -> None:
+    """Response hook recording the fetch latency and the bytes downloaded (cache hits download nothing)."""
+    source = "cache" if getattr(response, "from_cache", False) else "network"
+    METRICS.inc("http_responses", status=response.status_code, source=source)
+    METRICS.observe("fetch_seconds", response.elapsed.total_seconds(), source=source)
+    if source == "network" and not kwargs.get("stream"):
+        METRICS.inc("downloaded_bytes", len(response.content))
+
+
+def create_cached_session(pool_size: int = 10) -> requests.Session:
+    """Create a session backed by the shared on-disk cache used by all the scrapers."""
+    return create_session(pool_size, HTTPCache.shared())
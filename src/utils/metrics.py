@@ -0,0 +1,170 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+METRICS_DIR = Path(os.environ.get("METRICS_DIR", "metrics"))
+METRICS_PREFIX = "chromadb_experiment"
+
+# Upper bounds (in seconds) of the histogram buckets, from a cache hit to a slow page
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Count, sum, min, max and cumulative-ready bucket counts of the observed values."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[idx] += 1
+                break
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+        }
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms, with timed spans.
+
+    Recording a value is a dictionary lookup and a few additions under a lock, cheap
+    enough to leave on for every fetch, page and batch. Metrics can carry labels
+    (e.g. `stage="ipgs"`). The registry is exported as a JSON run report or as a
+    Prometheus textfile (for the node_exporter textfile collector)."""
+
+    def __init__(self, prefix: str = METRICS_PREFIX) -> None:
+        self.prefix = prefix
+        self.started_at = time.time()
+        self._counters: Dict[Tuple[str, LabelSet], float] = {}
+        self._histograms: Dict[Tuple[str, LabelSet], Histogram] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> Tuple[str, LabelSet]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        """Time the block into the `<name>_seconds` histogram (failed blocks are counted in `<name>_errors`)."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_errors", **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    def report(self) -> dict:
+        """Snapshot of every metric, with the label sets rendered as `name{label="value"}`."""
+        with self._lock:
+            counters = {_render(name, labels): value for (name, labels), value in sorted(self._counters.items())}
+            histograms = {_render(name, labels): h.summary() for (name, labels), h in sorted(self._histograms.items())}
+        return {
+            "started_at": self.started_at,
+            "duration_seconds": time.time() - self.started_at,
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, h.bucket_counts[:], h.buckets, h.count, h.sum) for key, h in self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{_render(metric, labels)} {value}")
+
+        for (name, labels), bucket_counts, buckets, count, total in histograms:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{_render(metric + '_bucket', labels + (('le', le),))} {cumulative}")
+            lines.append(f"{_render(metric + '_sum', labels)} {total}")
+            lines.append(f"{_render(metric + '_count', labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, name: str, output_dir: Path = METRICS_DIR) -> Tuple[Path, Path]:
+        """Write `<name>.json` and `<name>.prom` in `output_dir` and return their paths.
+        Files are replaced atomically so a collector never reads a partial file."""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        json_path, prom_path = output_dir / f"{name}.json", output_dir / f"{name}.prom"
+        _write_atomic(json_path, json.dumps(self.report(), indent=1))
+        _write_atomic(prom_path, self.to_prometheus())
+        return json_path, prom_path
+
+
+def _render(name: str, labels: LabelSet) -> str:
+    if not labels:
+        return name
+    rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{name}{{{rendered}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path: Path, content: str) -> None:
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+# Registry shared by every stage of a run
+METRICS = Metrics()
@@ -1,7 +1,14 @@
-from typing import Tuple, List
+from typing import Iterable, Set, Tuple, List
 import os
 import csv
-from dataclasses import dataclass
+import logging
+from dataclasses import dataclass, field
+
+from bs4.element import CData, NavigableString
+
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class Page:
@@ -12,41 +19,148 @@ class Page:
     url_hierarchy: List[str]
     linked_pages: List[str]
     text: str
-        
-def extract_main_content(soup) -> Tuple[str, List[str]]:
+    blocks: List[str] = field(default=None, repr=False) # text blocks of the main content, before boilerplate removal
+
+# Elements starting a new block of text (table rows are kept whole so that cells stay together)
+BLOCK_TAGS = {"address", "article", "aside", "blockquote", "dd", "details", "div", "dl", "dt", "figcaption", "figure",
+              "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "li", "nav", "ol", "p", "pre", "section",
+              "summary", "table", "tr", "ul"}
+
+def _collect_blocks(element, blocks: List[str], current: List[str]):
+    for child in element.children:
+        if type(child) in (NavigableString, CData): # the strings get_text() keeps (no comments or scripts)
+            current.append(str(child))
+        elif child.name in BLOCK_TAGS:
+            _flush_block(blocks, current)
+            _collect_blocks(child, blocks, current)
+            _flush_block(blocks, current)
+        elif child.name is not None:
+            _collect_blocks(child, blocks, current)
+
+def _flush_block(blocks: List[str], current: List[str]):
+    text = " ".join("".join(current).split())
+    if text:
+        blocks.append(text)
+    current.clear()
+
+def extract_main_blocks(soup) -> Tuple[List[str], List[str]]:
+    """Text blocks (paragraphs, list items, headings, table rows...) of the main content, whitespace collapsed, and its links."""
     main_content = soup.find('main')
     if not main_content:
-        return "", []
-    
-    linked_pages = []
+        return [], []
+
+    blocks, current = [], []
+    _collect_blocks(main_content, blocks, current)
+    _flush_block(blocks, current)
+
+    linked_pages = {} # dict keys keep the links unique, in order
 
-    text_content = main_content.get_text().replace("\n", " ").replace("\r", " ")
-        
     # Extract links from the element
     for link in main_content.find_all('a'):
         href = link.get('href')
-        if href and href.startswith('/') and href not in linked_pages:
-            linked_pages.append(href)
-    
-    return text_content, list(linked_pages)
+        if href and href.startswith('/'):
+            linked_pages[href] = None
+
+    return blocks, list(linked_pages)
+
+def extract_main_content(soup) -> Tuple[str, List[str]]:
+    blocks, linked_pages = extract_main_blocks(soup)
+    return " ".join(blocks), linked_pages
+
+# Formats written by the scrapers (csv, parquet)
+OUTPUT_FORMATS = os.environ.get("OUTPUT_FORMATS", "csv,parquet").split(",")
+
+PAGE_COLUMNS = ['id', 'title', 'hyperlink', 'hierarchy', 'url_hierarchy', 'linked_pages', 'text']
 
 def get_page_csv_row(page: Page) -> List[str]:
     return [page.id, page.title, page.url, " / ".join(page.hierarchy), " / ".join(page.url_hierarchy), "|".join(page.linked_pages) if page.linked_pages else "", page.text]
 
-def save_to_csv(pages: List[Page], filename: str):
-    os.makedirs("outputs", exist_ok=True)
-    csv_path = f"outputs/{filename}"
-    existing_page_ids = []
-    
-    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['id', 'title', 'hyperlink', 'hierarchy', 'url_hierarchy', 'linked_pages', 'text'])
+class CsvPageWriter:
+    extension = "csv"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(PAGE_COLUMNS)
+
+    def write(self, page: Page):
+        self._writer.writerow(get_page_csv_row(page))
+
+    def close(self):
+        self._file.close()
+
+class ParquetPageWriter:
+    """Writes pages to a Parquet file in row groups of `batch_size` pages, so that only one
+    row group is held in memory. Requires pyarrow."""
+    extension = "parquet"
+
+    def __init__(self, path: str, batch_size: int = 1000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.batch_size = batch_size
+        self._pa = pa
+        self._schema = pa.schema([(column, pa.string()) for column in PAGE_COLUMNS])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._rows = []
+
+    def write(self, page: Page):
+        self._rows.append(get_page_csv_row(page))
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            columns = [list(column) for column in zip(*self._rows)]
+            self._writer.write_table(self._pa.Table.from_arrays(columns, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+PAGE_WRITERS = {writer.extension: writer for writer in (CsvPageWriter, ParquetPageWriter)}
+
+class PageSink:
+    """Streams pages to one writer per output format as they are produced, checking for duplicate ids."""
+
+    def __init__(self, name: str, output_dir: str = "outputs", formats: Iterable[str] = ("csv",)):
+        os.makedirs(output_dir, exist_ok=True)
+        self.writers = [PAGE_WRITERS[fmt](os.path.join(output_dir, f"{name}.{fmt}")) for fmt in formats]
+        self.page_ids: Set[str] = set()
+
+    def write(self, page: Page):
+        if page.id in self.page_ids:
+            # Throw an error, not supposed to happen
+            raise ValueError(f"Page {page.id} already exists in {', '.join(w.path for w in self.writers)}")
+
+        for writer in self.writers:
+            writer.write(page)
+        self.page_ids.add(page.id)
+
+    def write_all(self, pages: Iterable[Page]) -> int:
         for page in pages:
-            if page.id in existing_page_ids:
-                # Throw an error, not supposed to happen
-                raise ValueError(f"Page {page.id} already exists in {csv_path}")
-            
-            writer.writerow(get_page_csv_row(page))
-            existing_page_ids.append(page.id)
-
-    print(f"Saved {len(pages)} pages to {csv_path}")
\ No newline at end of file
+            self.write(page)
+        return len(self.page_ids)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def save_pages(pages: Iterable[Page], name: str, output_dir: str = "outputs", formats: Iterable[str] = ("csv",)):
+    with METRICS.span("save_pages", output=name), PageSink(name, output_dir, formats) as sink:
+        nb_pages = sink.write_all(pages)
+
+    METRICS.inc("pages_saved", nb_pages, output=name)
+    logger.info("Saved %d pages to %s", nb_pages, ", ".join(writer.path for writer in sink.writers))
+
+def save_to_csv(pages: Iterable[Page], filename: str):
+    save_pages(pages, os.path.splitext(filename)[0])
@@ -0,0 +1,244 @@
+import hashlib
+import inspect
+import json
+import logging
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE_NAME = "state.json"
+RECORDS_FILE_NAME = "records.jsonl"
+
+
+@dataclass
+class Stage:
+    """A step of a pipeline.
+
+    `func` is called with `params` and with the value of every dependency, as keyword
+    arguments named after the dependencies. With the stage cache on, `save` writes the
+    value into the stage's own directory and `load` reads it back, so that downstream
+    stages can use the output of a stage skipped because it was current. Stages without
+    them (e.g. the ones writing to an index) are only skipped or re-run as a whole.
+
+    `max_age` (in seconds) makes an output stale after a while even if the inputs did not
+    change, for sources such as scrapers. A `lazy` stage hands its iterator to its single
+    downstream stage as is, so records stream from one to the other; other stages
+    materialise the iterators they return, in their own thread. Lazy stages are meant for
+    cheap transforms: the value of a skipped one is recomputed when a downstream stage
+    needs it.
+
+    Only the source of `func` is fingerprinted by default: `code_deps` lists the modules,
+    classes or functions it relies on (chunker, scraper, ...) whose source is hashed too, so
+    that changing them invalidates the cached output. `version` can be bumped to invalidate
+    it for changes that are not in Python source (e.g. an upgraded model or library)."""
+
+    name: str
+    func: Callable[..., Any]
+    deps: List[str] = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+    save: Optional[Callable[[Any, Path], None]] = None
+    load: Optional[Callable[[Path], Any]] = None
+    max_age: Optional[float] = None
+    lazy: bool = False
+    code_deps: List[Any] = field(default_factory=list)
+    version: str = ""
+
+    def code_hash(self) -> str:
+        sha256 = hashlib.sha256(self.version.encode("utf-8"))
+        for code in [self.func, *self.code_deps]:
+            sha256.update(_source(code).encode("utf-8"))
+        return sha256.hexdigest()
+
+
+def _source(code) -> str:
+    try:
+        return inspect.getsource(code)
+    except (OSError, TypeError):
+        return getattr(code, "__qualname__", repr(code))
+
+
+def save_records(records: Iterable[dict], directory: Path) -> None:
+    with open(directory / RECORDS_FILE_NAME, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+
+
+def load_records(directory: Path) -> Iterator[dict]:
+    with open(directory / RECORDS_FILE_NAME, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _hash_directory(directory: Path) -> str:
+    sha256 = hashlib.sha256()
+    for path in sorted(p for p in directory.rglob("*") if p.is_file()):
+        sha256.update(str(path.relative_to(directory)).encode("utf-8"))
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class Pipeline:
+    """Runs a DAG of stages, make-style.
+
+    The fingerprint of a stage covers its code, its parameters and the output hashes of
+    its dependencies. With `cache` on, a stage whose fingerprint matches the one of its last
+    successful run (and whose output is still there and not older than `max_age`) is
+    skipped; since fingerprints follow the outputs rather than the runs, a stage re-run
+    with an unchanged output does not invalidate the stages downstream. With `cache` off,
+    every stage runs and values are handed over in memory only.
+
+    Stages run as soon as their dependencies are done, up to `max_workers` at a time, so
+    that independent branches run in parallel."""
+
+    def __init__(self, stages: Iterable[Stage], cache_dir: Path = Path(".pipeline"), cache: bool = True, max_workers: int = 4) -> None:
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage {stage.name}")
+            self.stages[stage.name] = stage
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+
+        self.cache_dir = Path(cache_dir)
+        self.cache = cache
+        self.max_workers = max_workers
+        self.state_path = self.cache_dir / STATE_FILE_NAME
+
+    def _required(self, targets: Iterable[str]) -> List[str]:
+        """The targets and their ancestors, dependencies first (raises ValueError on cycles)."""
+        order, visiting, visited = [], set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle through stage {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for target in targets:
+            if target not in self.stages:
+                raise ValueError(f"Unknown stage {target}")
+            visit(target)
+        return order
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state: dict) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1)
+        tmp_path.replace(self.state_path)
+
+    def fingerprint(self, stage: Stage, output_hashes: Dict[str, str]) -> str:
+        payload = {
+            "code": stage.code_hash(),
+            "params": stage.params,
+            "deps": {dep: output_hashes[dep] for dep in stage.deps},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _is_current(self, stage: Stage, fingerprint: str, entry: Optional[dict]) -> bool:
+        if not entry or entry["fingerprint"] != fingerprint:
+            return False
+        if stage.max_age is not None and time.time() - entry["finished_at"] > stage.max_age:
+            return False
+        if stage.save is not None:
+            directory = self.cache_dir / stage.name
+            return directory.exists() and _hash_directory(directory) == entry["output_hash"]
+        return True
+
+    def run(self, targets: Iterable[str] = None, force: Iterable[str] = ()) -> Dict[str, Any]:
+        """Run the stages needed to bring `targets` (every stage by default) up to date,
+        re-running the `force`d ones regardless. Returns the value of the targets that ran."""
+        targets = list(targets or self.stages)
+        required = self._required(targets)
+        force = set(force)
+        state = self._load_state() if self.cache else {}
+
+        values: Dict[str, Any] = {}
+        output_hashes: Dict[str, str] = {}
+        consumers = {name: [other for other in required if name in self.stages[other].deps] for name in required}
+
+        def dep_value(name):
+            if name in values:
+                return values[name]
+            # Skipped stage: read its output back, once per consumer as loaders may return iterators
+            stage = self.stages[name]
+            if stage.load is not None:
+                return stage.load(self.cache_dir / name)
+            if stage.lazy:
+                return stage.func(**stage.params, **{dep: dep_value(dep) for dep in stage.deps})
+            return None
+
+        def execute(stage: Stage, kwargs: dict):
+            with METRICS.span("pipeline_stage", stage=stage.name):
+                value = stage.func(**stage.params, **kwargs)
+                if isinstance(value, Iterator) and not (stage.lazy and not self.cache):
+                    value = list(value)
+                if self.cache and stage.save is not None:
+                    directory = self.cache_dir / stage.name
+                    shutil.rmtree(directory, ignore_errors=True)
+                    directory.mkdir(parents=True)
+                    stage.save(value, directory)
+                    output_hash = _hash_directory(directory)
+                else:
+                    output_hash = None
+            return value, output_hash
+
+        remaining = list(required)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while remaining or running:
+                for name in [n for n in remaining if all(dep in output_hashes for dep in self.stages[n].deps)]:
+                    remaining.remove(name)
+                    stage = self.stages[name]
+                    fingerprint = self.fingerprint(stage, output_hashes)
+
+                    if self.cache and name not in force and self._is_current(stage, fingerprint, state.get(name)):
+                        logger.info("Stage %s is up to date", name)
+                        METRICS.inc("pipeline_stages_skipped", stage=name)
+                        output_hashes[name] = state[name]["output_hash"]
+                        continue
+
+                    if stage.lazy and len(consumers[name]) > 1:
+                        raise ValueError(f"Lazy stage {name} has more than one consumer")
+                    kwargs = {dep: dep_value(dep) for dep in stage.deps}
+                    logger.info("Running stage %s", name)
+                    running[executor.submit(execute, stage, kwargs)] = (name, fingerprint)
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, fingerprint = running.pop(future)
+                    values[name], output_hash = future.result()
+                    output_hashes[name] = output_hash or fingerprint
+                    METRICS.inc("pipeline_stages_run", stage=name)
+                    if self.cache:
+                        state[name] = {"fingerprint": fingerprint, "output_hash": output_hashes[name], "finished_at": time.time()}
+                        self._save_state(state)
+
+        return {name: values[name] for name in targets if name in values}
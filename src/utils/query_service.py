@@ -0,0 +1,217 @@
+import asyncio
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction, validate_where
+
+DEFAULT_INCLUDE = ["metadatas", "distances", "documents"]
+
+
+@dataclass
+class _QueryRequest:
+    text: str
+    n_results: int
+    where: Optional[dict]
+    future: asyncio.Future
+
+
+class QueryService:
+    """Low-latency query front-end over a collection.
+
+    The embedding model stays loaded for the lifetime of the service and the embeddings of
+    recent queries are kept in an LRU cache. Concurrent queries are coalesced: the first one
+    waits up to `max_wait` seconds for others (up to `max_batch_size`), then the whole batch
+    is embedded in one call and searched with one `collection.query` per distinct
+    (n_results, where) pair. Arguments are validated before a query joins a batch, and a
+    failing search only fails the queries of its own (n_results, where) pair.
+
+    Use it as an async context manager (or call `start` / `stop`) from a running event loop."""
+
+    def __init__(
+        self,
+        collection,
+        embedding_func: EmbeddingFunction,
+        cache_size: int = 1024,
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        include: list = None,
+    ) -> None:
+        self.collection = collection
+        self.embedding_func = embedding_func
+        self.cache_size = cache_size
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.include = include or DEFAULT_INCLUDE
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+        self._cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        # Load the model and run it once, so that the first query does not pay for it
+        await asyncio.to_thread(self.embedding_func, ["warm up"])
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def __aenter__(self) -> "QueryService":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def query(self, text: str, n_results: int = 3, where: Optional[dict] = None) -> dict:
+        """Raises ValueError for invalid arguments, without queueing the query."""
+        if not isinstance(text, str):
+            raise ValueError(f"Expected the query to be a str, got {type(text).__name__}")
+        if isinstance(n_results, bool) or not isinstance(n_results, int) or n_results < 1:
+            raise ValueError(f"Expected n_results to be a positive int, got {n_results!r}")
+        where = where or None
+        if where is not None:
+            validate_where(where)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_QueryRequest(text, n_results, where, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batches += 1
+            try:
+                results = await asyncio.to_thread(self._process, batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            for request, result in zip(batch, results):
+                if request.future.done():
+                    continue
+                if isinstance(result, Exception):
+                    request.future.set_exception(result)
+                else:
+                    request.future.set_result(result)
+
+    def _embed(self, texts: list[str]) -> list[np.ndarray]:
+        missing = [text for text in dict.fromkeys(texts) if text not in self._cache]
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+
+        computed = {}
+        if missing:
+            for text, embedding in zip(missing, self.embedding_func(missing)):
+                computed[text] = np.asarray(embedding, dtype=np.float32)
+
+        embeddings = []
+        for text in texts:
+            if text in computed:
+                embeddings.append(computed[text])
+            else:
+                self._cache.move_to_end(text)
+                embeddings.append(self._cache[text])
+
+        for text, embedding in computed.items():
+            self._cache[text] = embedding
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return embeddings
+
+    def _process(self, batch: list[_QueryRequest]) -> list:
+        """The result of every query of the batch, or the exception raised by the search of its group."""
+        embeddings = self._embed([request.text for request in batch])
+
+        groups: dict[tuple, list[int]] = {}
+        for position, request in enumerate(batch):
+            key = (request.n_results, json.dumps(request.where, sort_keys=True))
+            groups.setdefault(key, []).append(position)
+
+        results = [None] * len(batch)
+        for positions in groups.values():
+            first = batch[positions[0]]
+            try:
+                response = self.collection.query(
+                    query_embeddings=[embeddings[position] for position in positions],
+                    n_results=first.n_results,
+                    where=first.where,
+                    include=self.include,
+                )
+            except Exception as e:
+                for position in positions:
+                    results[position] = e
+                continue
+            for idx, position in enumerate(positions):
+                results[position] = {
+                    key: values[idx] if isinstance(values, list) else values
+                    for key, values in response.items()
+                    if key in ["ids"] + self.include and values is not None
+                }
+        return results
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "batches": self.batches,
+        }
+
+
+def create_app(service: QueryService):
+    """FastAPI app exposing the service at POST /query."""
+    from contextlib import asynccontextmanager
+
+    from fastapi import FastAPI, HTTPException
+    from pydantic import BaseModel
+
+    class QueryRequest(BaseModel):
+        query: str
+        n_results: int = 3
+        where: Optional[dict] = None
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with service:
+            yield
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post("/query")
+    async def query(request: QueryRequest) -> dict:
+        try:
+            return await service.query(request.query, request.n_results, request.where)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @app.get("/stats")
+    async def stats() -> dict:
+        return service.stats()
+
+    return app
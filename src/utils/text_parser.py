@@ -1,36 +1,167 @@
 import chardet
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+import json
+import logging
+import os
 from pathlib import Path
 import re
+from typing import Iterator, Tuple
 
 import yaml
 
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SIZE = 64 * 1024  # bytes read at most per file to detect its encoding
+ENCODING_CACHE_FILE_NAME = ".encoding_cache.json"
+
+
+def detect_encoding(file, sample_size: int = DEFAULT_SAMPLE_SIZE, chunk_size: int = 8192) -> dict:
+    """Detects the encoding of a file incrementally, stopping as soon as the detector is confident
+    or `sample_size` bytes have been read. Returns the same dict as `chardet.detect`.
+
+    A sample that stops before the end of the file and holds only ASCII (or nothing the detector
+    recognises) says nothing of the rest of the file: utf-8, a superset of ASCII, is reported then."""
+    detector = chardet.UniversalDetector()
+    nb_read = 0
+    with open(file, "rb") as f:
+        while nb_read < sample_size and not detector.done:
+            chunk = f.read(min(chunk_size, sample_size - nb_read))
+            if not chunk:
+                break
+            detector.feed(chunk)
+            nb_read += len(chunk)
+        truncated = bool(f.read(1))
+    result = detector.close()
+    if truncated and result["encoding"] in (None, "ascii"):
+        result = {**result, "encoding": "utf-8"}
+    return result
+
 
 @dataclass
 class FilesLoader:
     """Reads paths, file names, opens and read the content of files to automatically detect the encoding of the data. 
     Indicates whether the encoding found across all files within a directory is consistent. 
     Stores all of the info above in class instance attributes.
+
+    Only a sample of each file is read. Detected encodings are cached in the data directory, keyed
+    on the size and mtime of the files, and new files are processed across `max_workers` processes.
     """
 
     config: dict
     extension: str
+    sample_size: int = DEFAULT_SAMPLE_SIZE
+    max_workers: int = None
 
     def __post_init__(self):
-        self.dir_path = Path(config["data_path"])
+        self.dir_path = Path(self.config["data_path"])
         self.file_names = list(self.dir_path.glob(self.extension))
         self.files_and_encoding = dict.fromkeys(self.file_names, 0)
+        self.cache_path = self.dir_path.joinpath(ENCODING_CACHE_FILE_NAME)
 
+        cache = self._load_cache()
+        stats = {file: file.stat() for file in self.file_names}
+        to_detect = []
         for file in self.file_names:
-            with open(file, "rb+") as f:
-                data = f.read()
-                encoding_detected = chardet.detect(data)
-                self.files_and_encoding[file] = encoding_detected
+            entry = cache.get(file.name)
+            if entry and (entry["size"], entry["mtime_ns"]) == (stats[file].st_size, stats[file].st_mtime_ns):
+                self.files_and_encoding[file] = entry["encoding"]
+            else:
+                to_detect.append(file)
+
+        max_workers = self.max_workers or os.cpu_count()
+        if max_workers > 1 and len(to_detect) > max_workers:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                detected = executor.map(
+                    detect_encoding, to_detect, [self.sample_size] * len(to_detect), chunksize=64
+                )
+                detected = list(detected)
+        else:
+            detected = [detect_encoding(file, self.sample_size) for file in to_detect]
+
+        for file, encoding_detected in zip(to_detect, detected):
+            self.files_and_encoding[file] = encoding_detected
+            cache[file.name] = {
+                "size": stats[file].st_size,
+                "mtime_ns": stats[file].st_mtime_ns,
+                "encoding": encoding_detected,
+            }
+
+        self._cache = cache
+        if to_detect:
+            self._save_cache({file.name: cache[file.name] for file in self.file_names})
 
         self.encoding_isConsistent = (
             len(set([i["encoding"] for i in self.files_and_encoding.values()])) <= 1
         )
 
+    def update_encoding(self, file, encoding_detected: dict) -> None:
+        """Replace the encoding of a file (e.g. the sample guess that failed to decode it) and its cache entry."""
+        stat = file.stat()
+        self.files_and_encoding[file] = encoding_detected
+        self._cache[file.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "encoding": encoding_detected}
+        self._save_cache({file.name: self._cache[file.name] for file in self.file_names if file.name in self._cache})
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache: dict) -> None:
+        try:
+            with open(self.cache_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+        except OSError:
+            logger.warning("Could not write the encoding cache to %s", self.cache_path)
+
+
+class TextCleaner:
+    """Precompiled normaliser for the text of the documents: line breaks become spaces, then every
+    character outside of the allowed set is removed in a single pass of one compiled regex.
+    (str.replace is used for the line breaks as str.translate is much slower on non-ASCII text.)
+
+    Both steps work character by character, so files can be cleaned chunk by chunk."""
+
+    # Latin letters (including accented ones), digits, Cyrillic letters, spaces and slashes
+    UNWANTED_CHARACTERS = re.compile(r"[^ A-Za-z0-9\u00C0-\u00D6\u00D8-\u00F6\u00F8-\u00FF\u0400-\u04FF/]+")
+
+    def __init__(self, chunk_size: int = 1024 * 1024) -> None:
+        self.chunk_size = chunk_size
+
+    def clean(self, text: str) -> str:
+        return self.UNWANTED_CHARACTERS.sub("", text.replace("\n", " ").replace("\r", " "))
+
+    def iter_clean_file(self, file, encoding: str, errors: str = "strict") -> Iterator[str]:
+        """Yield the cleaned content of a file, `chunk_size` characters at a time."""
+        with open(file, "r", encoding=encoding, errors=errors) as f:
+            while chunk := f.read(self.chunk_size):
+                yield self.clean(chunk)
+
+    def clean_file(self, file, encoding: str, errors: str = "strict") -> str:
+        return "".join(self.iter_clean_file(file, encoding, errors))
+
+    def clean_file_checked(self, file, encoding: str) -> Tuple[str, dict]:
+        """Clean a file with the encoding detected on its sample; if it does not decode, detect the
+        encoding on the whole file and retry, replacing undecodable bytes as a last resort.
+        Returns the text and the full detection result when one was needed (None otherwise)."""
+        try:
+            return self.clean_file(file, encoding), None
+        except UnicodeDecodeError as error:
+            logger.warning("%s does not decode as %s (%s), detecting its encoding on the whole file", file, encoding, error)
+        detected = detect_encoding(file, sample_size=os.path.getsize(file))
+        detected = {**detected, "encoding": detected["encoding"] or "utf-8"}
+        try:
+            return self.clean_file(file, detected["encoding"]), detected
+        except UnicodeDecodeError:
+            logger.warning("%s does not decode as %s either, replacing the undecodable bytes", file, detected["encoding"])
+            METRICS.inc("texts_decoded_with_replacement")
+            return self.clean_file(file, detected["encoding"], errors="replace"), detected
+
 
 class EncodedTextFilesParser:
     """
@@ -39,39 +170,46 @@ class EncodedTextFilesParser:
     --decode their content with the automatically detected encoding format, \n
     --clean up unwanted characters (e.g. unicode)\n
 
-    Returns: a list of documents in raw string format.
+    Returns: a list of documents in raw string format (or an iterator of documents with iter_text).
     """
 
     def __init__(self, parser: FilesLoader) -> None:
         pass
 
+    @staticmethod
+    def iter_text(parser: FilesLoader, cleaner: TextCleaner = None, max_workers: int = 1) -> Iterator[str]:
+        """Lazily yield the cleaned documents in order, each decoded with its own encoding.
+        With `max_workers` > 1, files are cleaned in worker processes, at most two per worker in flight."""
+        cleaner = cleaner or TextCleaner()
+        jobs = [(i, parser.files_and_encoding[i]["encoding"]) for i in parser.file_names]
+
+        with METRICS.span("clean_texts"):
+            for (file, _), (text, detected) in zip(jobs, EncodedTextFilesParser._clean_all(jobs, cleaner, max_workers)):
+                if detected is not None:
+                    parser.update_encoding(file, detected)
+                METRICS.inc("texts_cleaned")
+                METRICS.inc("cleaned_chars", len(text))
+                yield text
+
+    @staticmethod
+    def _clean_all(jobs, cleaner: TextCleaner, max_workers: int) -> Iterator[Tuple[str, dict]]:
+        if max_workers <= 1:
+            for file, encoding in jobs:
+                yield cleaner.clean_file_checked(file, encoding)
+            return
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for file, encoding in jobs:
+                pending.append(executor.submit(cleaner.clean_file_checked, file, encoding))
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
     @staticmethod
     def parse_text(parser: FilesLoader):
-        files = []
-
-        if parser.encoding_isConsistent:
-            for i in parser.file_names:
-                with open(
-                    str(i),
-                    "r",
-                    encoding=list(parser.files_and_encoding.values())[0]["encoding"],
-                ) as f:
-                    doc = f.read()
-                    doc = doc.replace("\n", " ")
-                    doc = doc.replace("\r", " ")
-                    doc = re.sub(r"[^ \nA-Za-z0-9Ã€-Ã–Ã˜-Ã¶Ã¸-Ã¿Ð€-Ó¿/]+", "", doc)
-                files.append(str(doc))
-        else:
-            for i in parser.file_names:
-                with open(
-                    str(i), "r", encoding=parser.files_and_encoding[i]["encoding"]
-                ) as f:
-                    doc = " ".join(f.readlines())
-                    doc = doc.replace("\n", " ")
-                    doc = doc.replace("\r", " ")
-                    doc = re.sub(r"[^ \nA-Za-z0-9Ã€-Ã–Ã˜-Ã¶Ã¸-Ã¿Ð€-Ó¿/]+", "", doc)
-                files.append(str(doc))
-        return files
+        return list(EncodedTextFilesParser.iter_text(parser))
 
 
 if __name__ == "__main__":
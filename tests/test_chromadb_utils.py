@@ -0,0 +1,97 @@
+import chromadb
+import pytest
+
+from utils.chromadb_utils import (
+    document_metadata,
+    load_manifest,
+    manifest_path,
+    sync_collection,
+)
+
+
+class CountingEmbeddingFunction:
+    """Deterministic embeddings, recording the texts embedded."""
+
+    def __init__(self) -> None:
+        self.embedded = []
+
+    def __call__(self, input):
+        self.embedded.extend(input)
+        return [[float(len(text)), float(sum(map(ord, text)) % 97), 1.0] for text in input]
+
+
+@pytest.fixture
+def collection(tmp_path):
+    client = chromadb.PersistentClient(str(tmp_path / "chroma"))
+    return client.create_collection(name="test_sync", embedding_function=None)
+
+
+def corpus(documents: dict) -> tuple:
+    ids = list(documents)
+    metadatas = [document_metadata("clc", id_, f"https://example.org/{id_}") for id_ in ids]
+    return ids, [documents[id_] for id_ in ids], metadatas
+
+
+def sync(collection, path, documents, embedding_func, metadatas=None):
+    ids, texts, default_metadatas = corpus(documents)
+    return sync_collection(collection, path, ids, texts, metadatas or default_metadatas, batch_size=2,
+                           embedding_func=embedding_func)
+
+
+def test_sync_only_embeds_new_and_changed_documents(collection, tmp_path):
+    path = manifest_path(tmp_path, collection.name)
+    embedding_func = CountingEmbeddingFunction()
+    diff = sync(collection, path, {"a": "alpha", "b": "beta", "c": "gamma"}, embedding_func)
+    assert sorted(diff.added) == ["a", "b", "c"]
+    assert set(load_manifest(path)) == {"a", "b", "c"}
+
+    embedding_func.embedded.clear()
+    diff = sync(collection, path, {"a": "alpha", "b": "beta!", "d": "delta"}, embedding_func)
+    assert (diff.added, diff.changed, diff.removed, diff.unchanged) == (["d"], ["b"], ["c"], ["a"])
+    assert sorted(embedding_func.embedded) == ["beta!", "delta"]
+
+    stored = collection.get(ids=["a", "b", "d"], include=["documents"])
+    assert dict(zip(stored["ids"], stored["documents"])) == {"a": "alpha", "b": "beta!", "d": "delta"}
+    assert collection.count() == 3
+
+
+def test_metadata_changes_are_updated_without_embedding(collection, tmp_path):
+    path = manifest_path(tmp_path, collection.name)
+    embedding_func = CountingEmbeddingFunction()
+    ids, texts, metadatas = corpus({"a": "alpha", "b": "beta"})
+    metadatas[0] = document_metadata("clc", "a", "https://example.org/a", hierarchy=["PART III"])
+    sync(collection, path, dict(zip(ids, texts)), embedding_func, metadatas)
+
+    embedding_func.embedded.clear()
+    metadatas[0] = document_metadata("clc", "a", "https://example.org/a")
+    diff = sync(collection, path, dict(zip(ids, texts)), embedding_func, metadatas)
+    assert (diff.metadata_changed, diff.unchanged) == (["a"], ["b"])
+    assert embedding_func.embedded == []
+    assert collection.get(ids=["a"], include=["metadatas"])["metadatas"][0]["part"] == ""
+
+
+def test_sync_reconciles_manifest_with_collection(collection, tmp_path):
+    path = manifest_path(tmp_path, collection.name)
+    embedding_func = CountingEmbeddingFunction()
+    documents = {"a": "alpha", "b": "beta", "c": "gamma"}
+    sync(collection, path, documents, embedding_func)
+
+    # The collection lost a record the manifest still lists: it is added again
+    collection.delete(ids=["b"])
+    diff = sync(collection, path, documents, embedding_func)
+    assert (diff.added, sorted(diff.unchanged)) == (["b"], ["a", "c"])
+
+    # Without a manifest, the stored records are verified from their metadata
+    path.unlink()
+    embedding_func.embedded.clear()
+    diff = sync(collection, path, {"a": "alpha", "b": "beta"}, embedding_func)
+    assert (sorted(diff.unchanged), diff.removed) == (["a", "b"], ["c"])
+    assert embedding_func.embedded == []
+    assert collection.count() == 2
+
+
+def test_document_metadata_canonicalises_part():
+    metadata = document_metadata("clc", "Murder", "https://example.org", "231-1", ["PART VIII", "Homicide"])
+    assert metadata["part"] == "Part VIII"
+    assert metadata["section_number"] == "231.1"
+    assert (metadata["hierarchy_1"], metadata["hierarchy_2"], metadata["hierarchy_3"]) == ("PART VIII", "Homicide", "")
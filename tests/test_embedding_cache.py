@@ -0,0 +1,77 @@
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+from utils.embedding_cache import CachedEmbeddingFunction
+
+
+class SlowEmbeddingFunction:
+    """Deterministic embeddings, slow enough for concurrent callers to miss the same texts."""
+
+    def __init__(self, delay: float = 0.05, dim: int = 8) -> None:
+        self.delay = delay
+        self.dim = dim
+
+    @staticmethod
+    def expected(text: str, dim: int = 8) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+    def __call__(self, input):
+        time.sleep(self.delay)
+        return [self.expected(text, self.dim) for text in input]
+
+
+def embed_concurrently(cache, texts, nb_threads=4):
+    barrier = threading.Barrier(nb_threads)
+
+    def work():
+        barrier.wait()
+        cache(texts)
+
+    threads = [threading.Thread(target=work) for _ in range(nb_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def assert_cached_correctly(cache, texts):
+    for text, embedding in zip(texts, cache(texts)):
+        np.testing.assert_array_equal(embedding, SlowEmbeddingFunction.expected(text))
+
+
+def test_concurrent_misses_store_every_key_once(tmp_path):
+    cache = CachedEmbeddingFunction(SlowEmbeddingFunction(), "stub", tmp_path, max_entries=10)
+    embed_concurrently(cache, ["a"])
+    cache(["b"])
+
+    assert len(set(cache._index.values())) == len(cache._index) == 2
+    assert_cached_correctly(cache, ["a", "b"])
+
+
+def test_concurrent_misses_then_evictions_keep_embeddings_correct(tmp_path):
+    cache = CachedEmbeddingFunction(SlowEmbeddingFunction(delay=0.01), "stub", tmp_path, max_entries=6)
+    for batch in (["a", "b"], ["b", "c", "d"], ["e"], ["a", "f", "g"], ["h", "c"]):
+        embed_concurrently(cache, batch)
+        assert len(set(cache._index.values())) == len(cache._index) <= cache.max_entries
+        assert set(cache._index.values()) == set(range(len(cache._index)))
+        assert_cached_correctly(cache, batch)
+
+    hits = cache.hits
+    assert_cached_correctly(cache, ["h", "c"])
+    assert cache.hits == hits + 2
+
+
+def test_reopened_cache_keeps_correct_embeddings(tmp_path):
+    cache = CachedEmbeddingFunction(SlowEmbeddingFunction(delay=0), "stub", tmp_path, max_entries=3)
+    cache(["a", "b", "c", "d"])
+    cache.flush()
+    del cache
+
+    reopened = CachedEmbeddingFunction(SlowEmbeddingFunction(delay=0), "stub", tmp_path, max_entries=10)
+    assert len(reopened._keys) == 10
+    assert_cached_correctly(reopened, ["b", "c", "d"])
+    assert reopened.hits == 3